@@ -1,6 +1,5 @@
 import sys
 import os
-import json
 from pathlib import Path
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, as_completed
@@ -10,13 +9,36 @@ BASE_DIR = Path("/workspace/datdq/SignWeather")
 INPUT_DIR = BASE_DIR / "data/scene_videos_cropped"
 OUTPUT_VIDEO_DIR = BASE_DIR / "data/scene_videos_pose"
 OUTPUT_JSON_DIR = BASE_DIR / "data/scene_keypoints"
+SCENE_METADATA_CSV = BASE_DIR / "data/metadata/scene_metadata.csv"
+KEYPOINT_QUALITY_CSV = BASE_DIR / "data/metadata/scene_keypoint_quality.csv" # Full per-clip metrics
 MAX_WORKERS = 2 
 
+# Pose-overlay videos are drawn from the saved keypoints. By default they are rendered
+# on demand (utils/pose_preview.py); PRERENDER = True writes one per clip up front.
+PRERENDER = False
+PRERENDER_CRF = 23
+
+# Landmark groups to extract (see utils/pose_detection.py). None = full Holistic,
+# e.g. hands + upper-body pose only:
+# {"pose": {"model_complexity": 1, "subset": "upper_body"}, "hands": {"model_complexity": 1}}
+LANDMARK_CONFIG = None
+KEYPOINT_CHUNK_SIZE = 256 # Frames buffered per worker before flushing to disk
+
+# Keypoint quality gate (see utils/keypoint_quality.py), computed while keypoints are written.
+# Clips failing a threshold are "skipped" or only "flagged" in the keypoint_quality column.
+# Skipped clips get no pre-rendered overlay and utils/pose_preview.py refuses to render them;
+# nothing else reads the column, so exports still include them unless filtered on it.
+# Keep "flag" until the thresholds are tuned on reviewed clips.
+QUALITY_OVERRIDES = {} # Overrides of utils.keypoint_quality.THRESHOLDS, e.g. {"max_jitter": 0.03}
+QUALITY_ACTION = "flag" # "skip" or "flag"
+
 # Add BASE_DIR to path to allow import form utils
 sys.path.append(str(BASE_DIR))
 
 try:
-    from utils.pose_detection import extract_pose_landmarks, visualize_pose_on_video
+    from utils.pose_detection import iter_pose_landmarks, render_overlay_from_keypoints, KeypointWriter
+    from utils.keypoint_quality import THRESHOLDS, QualityAnalyzer, check_quality, write_quality_csv, add_quality_column
+    from utils import profiling
 except ImportError as e:
     print(f"Error importing pose utils: {e}")
     print(f"Ensure {BASE_DIR}/utils/pose_detection.py exists.")
@@ -40,24 +62,47 @@ def process_single_video(file_path):
         out_json_path = OUTPUT_JSON_DIR / json_rel_path
         
         # Create parent directories
-        out_video_path.parent.mkdir(parents=True, exist_ok=True)
+        if PRERENDER:
+            out_video_path.parent.mkdir(parents=True, exist_ok=True)
         out_json_path.parent.mkdir(parents=True, exist_ok=True)
         
         # Skip if both exist? (Optional)
         # if out_video_path.exists() and out_json_path.exists():
         #    return {'status': 'skipped', 'path': str(rel_path)}
 
-        # 1. Extract Landmarks
-        landmarks_data = extract_pose_landmarks(file_path)
+        profiling.set_context(video=str(rel_path))
         
-        # Save JSON
-        with open(out_json_path, 'w', encoding='utf-8') as f:
-            json.dump(landmarks_data, f, indent=2)
+        # 1. Extract Landmarks, streamed to JSON (frames + schema of what was extracted)
+        #    and to the quality analyzer, so the file is never read back
+        with profiling.span("extract_keypoints"), \
+                KeypointWriter(out_json_path, LANDMARK_CONFIG, chunk_size=KEYPOINT_CHUNK_SIZE) as writer:
+            analyzer = QualityAnalyzer(writer.schema)
+            for frame_data in iter_pose_landmarks(file_path, landmark_config=LANDMARK_CONFIG):
+                with profiling.frame_span("write_keypoints"):
+                    writer.write(frame_data)
+                with profiling.frame_span("quality_metrics"):
+                    analyzer.add(frame_data)
+        
+        # 2. Quality gate
+        metrics = analyzer.metrics()
+        failed = check_quality(metrics, {**THRESHOLDS, **QUALITY_OVERRIDES})
+        quality = {
+            **metrics,
+            'keypoint_quality': ("skipped" if QUALITY_ACTION == "skip" else "flagged") if failed else "ok",
+            'keypoint_issues': ";".join(failed),
+        }
+        if failed and QUALITY_ACTION == "skip":
+            out_video_path.unlink(missing_ok=True) # Drop a render from an earlier run
+            return {'status': 'gated', 'path': str(rel_path), 'quality': quality}
             
-        # 2. Visualize
-        visualize_pose_on_video(file_path, out_video_path)
+        # 3. Overlay video from the stored keypoints (optional, see PRERENDER)
+        if PRERENDER:
+            with profiling.span("render_overlay"):
+                rendered = render_overlay_from_keypoints(file_path, out_json_path, out_video_path, crf=PRERENDER_CRF)
+            if not rendered:
+                return {'status': 'error', 'path': str(rel_path), 'msg': "overlay render failed", 'quality': quality}
         
-        return {'status': 'success', 'path': str(rel_path)}
+        return {'status': 'success', 'path': str(rel_path), 'quality': quality}
         
     except Exception as e:
         return {'status': 'error', 'path': str(file_path.name), 'msg': str(e)}
@@ -80,12 +125,15 @@ def main():
         return
         
     print(f"Found {len(video_files)} videos. Processing with {MAX_WORKERS} workers...")
-    print(f"Output Video: {OUTPUT_VIDEO_DIR}")
+    print(f"Output Video: {OUTPUT_VIDEO_DIR if PRERENDER else 'on demand (utils/pose_preview.py)'}")
     print(f"Output JSON: {OUTPUT_JSON_DIR}")
     
     success_count = 0
     error_count = 0
     skipped_count = 0
+    gated_count = 0
+    flagged_count = 0
+    quality_results = {}
     
     with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
         futures = {executor.submit(process_single_video, vid_path): vid_path for vid_path in video_files}
@@ -93,9 +141,15 @@ def main():
         with tqdm(total=len(video_files), desc="Adding Pose") as pbar:
             for future in as_completed(futures):
                 result = future.result()
+                if 'quality' in result:
+                    quality_results[result['path']] = result['quality']
                 
                 if result['status'] == 'success':
                     success_count += 1
+                    if result['quality']['keypoint_quality'] == "flagged":
+                        flagged_count += 1
+                elif result['status'] == 'gated':
+                    gated_count += 1
                 elif result['status'] == 'skipped':
                     skipped_count += 1
                 else:
@@ -103,9 +157,18 @@ def main():
                     tqdm.write(f"Error processing {result['path']}: {result.get('msg')}")
                 
                 pbar.update(1)
+    
+    if quality_results:
+        write_quality_csv(quality_results, KEYPOINT_QUALITY_CSV)
+        if SCENE_METADATA_CSV.exists():
+            updated = add_quality_column(SCENE_METADATA_CSV, quality_results)
+            print(f"Keypoint quality written to {SCENE_METADATA_CSV} ({updated} rows) and {KEYPOINT_QUALITY_CSV}")
+        else:
+            print(f"{SCENE_METADATA_CSV} not found; keypoint quality written to {KEYPOINT_QUALITY_CSV} only")
                 
     print("\n--- Summary ---")
-    print(f"Success: {success_count}")
+    print(f"Success: {success_count} ({flagged_count} flagged)")
+    print(f"Gated (low keypoint quality, not rendered): {gated_count}")
     print(f"Skipped: {skipped_count}")
     print(f"Errors: {error_count}")
     print(f"Done.")
@@ -6,21 +6,29 @@ import cv2
 from pathlib import Path
 from tqdm import tqdm
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.roi_calibration import load_roi_cache, get_cached_roi
+
 # --- CONFIGURATION ---
 BASE_DIR = "/workspace/datdq/SignWeather"
 METADATA_DIR = f"{BASE_DIR}/data/metadata"
 SCENE_METADATA_CSV = f"{METADATA_DIR}/scene_metadata_realtime.csv"
 INPUT_SCENE_DIR = f"{BASE_DIR}/data/scene_videos"
 OUTPUT_SCENE_DIR = f"{BASE_DIR}/data/scene_videos_cropped"
+VIDEO_ID_MAPPING_CSV = f"{METADATA_DIR}/mapping/video_id_mapping.csv"
+ROI_CACHE_PATH = f"{METADATA_DIR}/roi_cache.json" # Written by utils/roi_calibration.py
 
-# Crop parameters (Relative)
+# Crop parameters (Relative), fallback for videos without a calibrated ROI
 CROP_PARAMS = {
     'x': 0.0816,
     'y': 0.6837,
     'w': 0.1525,
     'h': 0.2033
 }
-SCALE_FACTOR = 5
+# Output height of every cropped scene (width follows the ROI aspect ratio).
+# Calibrated ROIs differ in size per video, so a fixed scale factor would give
+# clips of different resolutions; ~1080 matches the old 5x scale of CROP_PARAMS.
+TARGET_HEIGHT = 1080
 
 def get_video_dims(video_path):
     cap = cv2.VideoCapture(str(video_path))
@@ -31,7 +39,24 @@ def get_video_dims(video_path):
     cap.release()
     return w, h
 
-def crop_and_scale_ffmpeg(input_path, output_path, crop_params, scale_factor):
+def load_video_id_mapping(csv_path):
+    """Map new_video_id (v003) to original_video_id (0Gw4diTa1xA)"""
+    mapping = {}
+    if not os.path.exists(csv_path):
+        return mapping
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            mapping[row['new_video_id']] = row['original_video_id']
+    return mapping
+
+def resolve_crop_params(rel_path, id_mapping, roi_cache):
+    """Per-video calibrated ROI for a scene path like 'v001/scene_001.mp4', else CROP_PARAMS"""
+    new_id = rel_path.split('/')[0]
+    original_id = id_mapping.get(new_id)
+    return get_cached_roi(original_id, roi_cache, default=CROP_PARAMS)
+
+def crop_and_scale_ffmpeg(input_path, output_path, crop_params, target_height=TARGET_HEIGHT):
     """
     Use ffmpeg to crop and scale video.
     Ensures H.264 encoding for better compatibility.
@@ -46,9 +71,9 @@ def crop_and_scale_ffmpeg(input_path, output_path, crop_params, scale_factor):
     crop_x = int(crop_params['x'] * w_orig)
     crop_y = int(crop_params['y'] * h_orig)
     
-    # Calculate final scaled dims
-    final_w = crop_w * scale_factor
-    final_h = crop_h * scale_factor
+    # Calculate final scaled dims (fixed height, ROI aspect ratio)
+    final_h = int(target_height)
+    final_w = int(round(crop_w * final_h / crop_h))
     
     # Ensure even dimensions for ffmpeg/libx264
     if final_w % 2 != 0: final_w -= 1
@@ -88,6 +113,10 @@ def main():
     # Ensure output directory exists
     Path(OUTPUT_SCENE_DIR).mkdir(parents=True, exist_ok=True)
     
+    id_mapping = load_video_id_mapping(VIDEO_ID_MAPPING_CSV)
+    roi_cache = load_roi_cache(ROI_CACHE_PATH)
+    print(f"Calibrated ROIs available for {len(roi_cache)} raw videos.")
+    
     success_count = 0
     error_count = 0
     
@@ -110,8 +139,8 @@ def main():
             crop_and_scale_ffmpeg(
                 input_path=input_path,
                 output_path=output_path,
-                crop_params=CROP_PARAMS,
-                scale_factor=SCALE_FACTOR
+                crop_params=resolve_crop_params(rel_path, id_mapping, roi_cache),
+                target_height=TARGET_HEIGHT
             )
             success_count += 1
         except Exception as e:
@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.roi_calibration import load_roi_cache
+from run_full_pipeline import (
+    CASCADE_MARGIN, CONFIDENCE_THRESHOLD, MIN_EVENT_FRAMES, SEGMENTATION_INPUT_MODE,
+    ROI_CACHE_PATH, VIDEO_CHANNEL_CSV, PipelineUtils,
+    build_scenes, group_events, make_classifier, make_frame_source,
+)
+
+# --- CONFIGURATION ---
+# Decode mode, ROI, scale, threshold and margin all come from run_full_pipeline,
+# so the cascade is evaluated on exactly what the pipeline would run.
+BASE_DIR = "/workspace/datdq/SignWeather"
+RAW_VIDEO_DIR = f"{BASE_DIR}/data/raw_videos"
+OUTPUT_REPORT = f"{BASE_DIR}/data/metadata/cascade_evaluation.json"
+VIDEO_IDS = ["0Gw4diTa1xA", "1-iUEsz_srY"]
+MAX_FRAMES = None # Limit frames per video for a quick check
+BOUNDARY_TOLERANCE = 0.2 # Seconds; scene boundaries closer than this count as the same
+
+def diff_ranges(reference, candidate, tolerance_frames):
+    """
+    Match (start, end) frame ranges whose boundaries are within tolerance_frames.
+    Returns (matched, only_in_reference, only_in_candidate).
+    """
+    unmatched = list(candidate)
+    matched, missing = 0, []
+    for start, end in reference:
+        hit = next((c for c in unmatched
+                    if abs(c[0] - start) <= tolerance_frames and abs(c[1] - end) <= tolerance_frames), None)
+        if hit is None:
+            missing.append([start, end])
+        else:
+            unmatched.remove(hit)
+            matched += 1
+    return matched, missing, [list(c) for c in unmatched]
+
+def evaluate_video(video_path, roi=None, max_frames=MAX_FRAMES):
+    """
+    Run the Holistic-only detector (reference) and the cascade side by side on
+    the same decoded frames, with the pipeline's decoder and classifier settings,
+    and compare per-frame decisions, YES events and the resulting scenes.
+
+    Each detector owns its Holistic instance, so the cascade's Holistic only sees
+    the frames it is asked about, as in the pipeline. Disagreements on "full"
+    frames right after a lite run show what that gap in tracking costs.
+    """
+    confusion = {"yes_yes": 0, "yes_no": 0, "no_yes": 0, "no_no": 0} # reference_cascade
+    disagreements_by_stage = {"lite": 0, "full": 0}
+    full_after_lite = {"frames": 0, "disagreements": 0}
+    ref_yes_indices, cas_yes_indices = [], []
+    ref_seconds = 0.0
+    cascade_seconds = 0.0
+    frames = 0
+
+    with make_frame_source(video_path, roi) as source:
+        reference = make_classifier(source, cascade=False)
+        cascade = make_classifier(source, cascade=True)
+        fps = source.fps
+        total_frames = source.frame_count
+
+        prev_stage = None
+        for frame_idx, frame in source:
+            if max_frames is not None and frame_idx >= max_frames:
+                break
+
+            t0 = time.perf_counter()
+            ref_yes, _ = reference.predict(frame, do_crop=True, threshold=CONFIDENCE_THRESHOLD)
+            t1 = time.perf_counter()
+            cas_yes, _ = cascade.predict(frame, do_crop=True, threshold=CONFIDENCE_THRESHOLD)
+            t2 = time.perf_counter()
+
+            ref_seconds += t1 - t0
+            cascade_seconds += t2 - t1
+            frames += 1
+
+            key = f"{'yes' if ref_yes else 'no'}_{'yes' if cas_yes else 'no'}"
+            confusion[key] += 1
+            if ref_yes:
+                ref_yes_indices.append(frame_idx)
+            if cas_yes:
+                cas_yes_indices.append(frame_idx)
+            if ref_yes != cas_yes:
+                disagreements_by_stage[cascade.last_stage] += 1
+            if cascade.last_stage == "full" and prev_stage == "lite":
+                full_after_lite["frames"] += 1
+                full_after_lite["disagreements"] += int(ref_yes != cas_yes)
+            prev_stage = cascade.last_stage
+
+    if max_frames is not None:
+        total_frames = min(total_frames, frames)
+    tolerance = int(BOUNDARY_TOLERANCE * fps)
+    ref_events = group_events(ref_yes_indices, fps, MIN_EVENT_FRAMES)
+    cas_events = group_events(cas_yes_indices, fps, MIN_EVENT_FRAMES)
+    ref_scenes = [(s["frame_start"], s["frame_end"]) for s in build_scenes(ref_events, total_frames, fps)]
+    cas_scenes = [(s["frame_start"], s["frame_end"]) for s in build_scenes(cas_events, total_frames, fps)]
+    events_matched, events_missing, events_extra = diff_ranges(ref_events, cas_events, tolerance)
+    scenes_matched, scenes_missing, scenes_extra = diff_ranges(ref_scenes, cas_scenes, tolerance)
+
+    ref_positives = confusion["yes_yes"] + confusion["yes_no"]
+    cas_positives = confusion["yes_yes"] + confusion["no_yes"]
+    return {
+        "frames": frames,
+        "confusion": confusion,
+        "agreement": round((confusion["yes_yes"] + confusion["no_no"]) / frames, 4) if frames else None,
+        "yes_recall": round(confusion["yes_yes"] / ref_positives, 4) if ref_positives else None,
+        "yes_precision": round(confusion["yes_yes"] / cas_positives, 4) if cas_positives else None,
+        "stage_counts": cascade.stage_counts,
+        "lite_fraction": round(cascade.stage_counts["lite"] / frames, 4) if frames else None,
+        "disagreements_by_stage": disagreements_by_stage,
+        "full_after_lite": full_after_lite,
+        "events": {"reference": len(ref_events), "cascade": len(cas_events), "matched": events_matched,
+                   "only_reference": events_missing, "only_cascade": events_extra},
+        "scenes": {"reference": len(ref_scenes), "cascade": len(cas_scenes), "matched": scenes_matched,
+                   "only_reference": scenes_missing, "only_cascade": scenes_extra},
+        "scenes_identical": not scenes_missing and not scenes_extra,
+        "ms_per_frame_reference": round(1000 * ref_seconds / frames, 2) if frames else None,
+        "ms_per_frame_cascade": round(1000 * cascade_seconds / frames, 2) if frames else None,
+    }
+
+def main():
+    report = {
+        "cascade_margin": CASCADE_MARGIN,
+        "segmentation_input_mode": SEGMENTATION_INPUT_MODE,
+        "confidence_threshold": CONFIDENCE_THRESHOLD,
+        "boundary_tolerance": BOUNDARY_TOLERANCE,
+        "videos": {},
+    }
+    video_channels = PipelineUtils.get_video_channels(VIDEO_CHANNEL_CSV)
+    roi_cache = load_roi_cache(ROI_CACHE_PATH)
+
+    for vid in VIDEO_IDS:
+        video_path = Path(RAW_VIDEO_DIR) / f"{vid}.mp4"
+        if not video_path.exists():
+            print(f"Skip (missing): {video_path}")
+            continue
+
+        roi = None
+        if SEGMENTATION_INPUT_MODE == "roi":
+            roi = PipelineUtils.get_segmentation_roi(vid, video_channels, roi_cache)
+
+        print(f"Evaluating {vid} (mode={SEGMENTATION_INPUT_MODE})...")
+        result = evaluate_video(video_path, roi=roi)
+        result["roi"] = roi
+        report["videos"][vid] = result
+        print(f"  agreement={result['agreement']} yes_recall={result['yes_recall']} "
+              f"yes_precision={result['yes_precision']} lite={result['lite_fraction']} "
+              f"({result['ms_per_frame_reference']} -> {result['ms_per_frame_cascade']} ms/frame)")
+        print(f"  events {result['events']['reference']} -> {result['events']['cascade']} "
+              f"(matched {result['events']['matched']}), scenes {result['scenes']['reference']} -> "
+              f"{result['scenes']['cascade']} (matched {result['scenes']['matched']})"
+              f"{'' if result['scenes_identical'] else '  SCENES DIFFER'}")
+
+    with open(OUTPUT_REPORT, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Saved report to {OUTPUT_REPORT}")
+
+if __name__ == "__main__":
+    main()
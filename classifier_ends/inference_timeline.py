@@ -0,0 +1,248 @@
+"""
+Debug timeline for one broadcast's segmentation, without re-encoding video.
+
+Reads the labeled JSON and the per-frame signals that run_full_pipeline writes
+(<id>_labeled.json / <id>_labeled_signals.npz) plus the clip intervals from
+clip_mapping_final.csv, seeks a few thumbnails from the raw video, and writes
+one self-contained HTML file with an SVG timeline:
+
+    confidence curve + threshold, YES decisions, events, scenes, VSWD clips
+
+    python classifier_ends/inference_timeline.py v003 [v004 ...]   # new or original video IDs
+"""
+
+import base64
+import csv
+import html
+import json
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# --- CONFIGURATION ---
+BASE_DIR = "/workspace/datdq/SignWeather"
+RAW_VIDEO_DIR = f"{BASE_DIR}/data/raw_videos"
+LABELED_JSON_DIR = f"{BASE_DIR}/data/labeled_videos"
+CLIP_MAPPING_CSV = f"{BASE_DIR}/data/metadata/clip_mapping_final.csv"
+OUTPUT_DIR = f"{BASE_DIR}/data/labeled_videos/timelines"
+NUM_THUMBNAILS = 8
+THUMBNAIL_HEIGHT = 90
+MIN_CLIP_OVERLAP_PCT = 30 # Same rule as run_full_pipeline's scene matching
+
+WIDTH = 1600
+MARGIN = 40
+ROW = {"confidence": (10, 120), "decision": (140, 12), "events": (160, 14), "scenes": (182, 22), "clips": (212, 22)}
+AXIS_Y = 250
+
+def load_id_mapping(csv_path):
+    """(new_id -> original_id, original_id -> new_id) from clip_mapping_final.csv"""
+    new_to_orig = {}
+    if Path(csv_path).exists():
+        with open(csv_path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                nid, oid = row.get("new_video_id"), row.get("original_video_id")
+                if nid and oid:
+                    new_to_orig.setdefault(nid, oid)
+    return new_to_orig, {v: k for k, v in new_to_orig.items()}
+
+def load_clip_intervals(csv_path, new_id):
+    clips = []
+    if not Path(csv_path).exists():
+        return clips
+    with open(csv_path, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("new_video_id") == new_id:
+                clips.append({"clip_id": row["clip_id"], "start": float(row["start"]), "end": float(row["end"])})
+    return sorted(clips, key=lambda c: c["start"])
+
+def load_signals(npz_path):
+    """dict with confidence, decision, stage, stage_names, fps, threshold, or None if not saved"""
+    if not Path(npz_path).exists():
+        return None
+    with np.load(npz_path) as data:
+        return {k: data[k] for k in data.files}
+
+def match_clips(clips, scenes):
+    """Best scene per clip by overlap (as in run_full_pipeline), None below MIN_CLIP_OVERLAP_PCT."""
+    for clip in clips:
+        dur = clip["end"] - clip["start"]
+        best, best_pct = None, 0.0
+        for scene in scenes:
+            overlap = max(0.0, min(scene["end"], clip["end"]) - max(scene["start"], clip["start"]))
+            pct = overlap / dur * 100 if dur > 0 else 0.0
+            if pct > best_pct:
+                best, best_pct = scene["scene_id"], pct
+        clip["scene_id"] = best if best_pct > MIN_CLIP_OVERLAP_PCT else None
+    return clips
+
+def seek_thumbnails(video_path, times, height=THUMBNAIL_HEIGHT):
+    """[(time, jpeg_bytes)] for each time in seconds, seeking instead of decoding the whole video."""
+    thumbs = []
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return thumbs
+    try:
+        for t in times:
+            cap.set(cv2.CAP_PROP_POS_MSEC, t * 1000.0)
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            h, w = frame.shape[:2]
+            frame = cv2.resize(frame, (max(1, int(w * height / h)), height), interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            if ok:
+                thumbs.append((t, buf.tobytes()))
+    finally:
+        cap.release()
+    return thumbs
+
+def thumbnail_times(scenes, duration, count=NUM_THUMBNAILS):
+    """Scene midpoints (evenly subsampled), or evenly spaced times if there are no scenes."""
+    if scenes:
+        mids = [(s["start"] + s["end"]) / 2 for s in scenes]
+        picks = np.linspace(0, len(mids) - 1, min(count, len(mids))).round().astype(int)
+        return [mids[i] for i in sorted(set(picks.tolist()))]
+    return list(np.linspace(0, duration, count + 2)[1:-1]) if duration > 0 else []
+
+def _runs(mask):
+    """[(start, end_exclusive)] of True runs in a boolean array."""
+    padded = np.concatenate([[False], mask, [False]]).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+def build_timeline_svg(duration, signals, events, scenes, clips, thumbs):
+    plot_w = WIDTH - 2 * MARGIN
+    x = lambda t: MARGIN + plot_w * (t / duration if duration else 0.0)
+    parts = []
+
+    def rect(t0, t1, row, color, title="", opacity=1.0):
+        y, h = ROW[row]
+        parts.append(f'<rect x="{x(t0):.1f}" y="{y}" width="{max(1.0, x(t1) - x(t0)):.1f}" height="{h}" '
+                     f'fill="{color}" fill-opacity="{opacity}"><title>{html.escape(title)}</title></rect>')
+
+    for name, (y, h) in ROW.items():
+        parts.append(f'<text x="{MARGIN - 4}" y="{y + h / 2 + 4}" text-anchor="end" font-size="10">{name}</text>')
+        parts.append(f'<rect x="{MARGIN}" y="{y}" width="{plot_w}" height="{h}" fill="#f4f4f4"/>')
+
+    if signals is not None:
+        conf = signals["confidence"].astype(np.float64)
+        fps = float(signals["fps"]) or 25.0
+        y, h = ROW["confidence"]
+        # One min/max pair per pixel column keeps spikes visible at any video length
+        n_cols = min(len(conf), plot_w)
+        if n_cols:
+            bounds = np.linspace(0, len(conf), n_cols + 1).astype(int)
+            starts = bounds[:-1][np.diff(bounds) > 0]
+            hi = np.maximum.reduceat(conf, starts)
+            lo = np.minimum.reduceat(conf, starts)
+            xs = MARGIN + plot_w * (starts / len(conf))
+            top = " ".join(f"{a:.1f},{y + h * (1 - v):.1f}" for a, v in zip(xs, hi))
+            bottom = " ".join(f"{a:.1f},{y + h * (1 - v):.1f}" for a, v in zip(xs[::-1], lo[::-1]))
+            parts.append(f'<polygon points="{top} {bottom}" fill="#4a78c2" fill-opacity="0.35" stroke="#4a78c2" stroke-width="0.6"/>')
+        ty = y + h * (1 - float(signals["threshold"]))
+        parts.append(f'<line x1="{MARGIN}" x2="{MARGIN + plot_w}" y1="{ty:.1f}" y2="{ty:.1f}" stroke="#d33" stroke-dasharray="4 3"/>')
+        for a, b in _runs(signals["decision"]):
+            rect(a / fps, b / fps, "decision", "#2a2", f"YES frames {a}-{b - 1}")
+
+    for start, end, title in events:
+        rect(start, end, "events", "#e0a000", title)
+    for scene in scenes:
+        rect(scene["start"], scene["end"], "scenes", "#7a5", f"scene {scene['scene_id']}: {scene['start']:.2f}-{scene['end']:.2f}s", 0.8)
+        y, h = ROW["scenes"]
+        parts.append(f'<text x="{x(scene["start"]) + 2:.1f}" y="{y + h - 6}" font-size="9">{scene["scene_id"]}</text>')
+    for clip in clips:
+        matched = clip["scene_id"] is not None
+        rect(clip["start"], clip["end"], "clips", "#36c" if matched else "#c33",
+             f"{clip['clip_id']}: {clip['start']:.2f}-{clip['end']:.2f}s -> "
+             + (f"scene {clip['scene_id']}" if matched else "unmatched"), 0.7)
+
+    # Time axis
+    step = next((s for s in (5, 10, 30, 60, 120, 300, 600) if duration / s <= 20), 1200)
+    for t in np.arange(0, duration + 1e-9, step):
+        parts.append(f'<line x1="{x(t):.1f}" x2="{x(t):.1f}" y1="{AXIS_Y - 4}" y2="{AXIS_Y}" stroke="#333"/>')
+        parts.append(f'<text x="{x(t):.1f}" y="{AXIS_Y + 12}" text-anchor="middle" font-size="10">{int(t // 60)}:{int(t % 60):02d}</text>')
+
+    # Thumbnails, each linked to its position on the timeline
+    thumb_y = AXIS_Y + 30
+    if thumbs:
+        slot = plot_w / len(thumbs)
+        for i, (t, jpeg) in enumerate(thumbs):
+            tx = MARGIN + i * slot
+            data = base64.b64encode(jpeg).decode("ascii")
+            parts.append(f'<line x1="{x(t):.1f}" y1="{AXIS_Y}" x2="{tx + slot / 2:.1f}" y2="{thumb_y}" stroke="#999" stroke-width="0.6"/>')
+            parts.append(f'<image x="{tx + 2:.1f}" y="{thumb_y}" width="{slot - 4:.1f}" height="{THUMBNAIL_HEIGHT}" '
+                         f'preserveAspectRatio="xMidYMin meet" href="data:image/jpeg;base64,{data}"/>')
+            parts.append(f'<text x="{tx + slot / 2:.1f}" y="{thumb_y + THUMBNAIL_HEIGHT + 12}" text-anchor="middle" '
+                         f'font-size="10">{int(t // 60)}:{t % 60:04.1f}</text>')
+
+    height = thumb_y + (THUMBNAIL_HEIGHT + 20 if thumbs else 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}" '
+            f'font-family="sans-serif">{"".join(parts)}</svg>')
+
+def build_timeline(new_id, original_id, output_dir=OUTPUT_DIR):
+    """
+    Write <output_dir>/<new_id>_timeline.html.
+
+    Returns:
+        Path to the HTML file, or None if the video has no labeled JSON
+    """
+    labeled_json = Path(LABELED_JSON_DIR) / f"{original_id}_labeled.json"
+    if not labeled_json.exists():
+        print(f"[{new_id}] No labeled JSON ({labeled_json}); run the pipeline first.")
+        return None
+    with open(labeled_json, "r", encoding="utf-8") as f:
+        labeled = json.load(f)
+    scenes = labeled.get("scenes", [])
+    signals = load_signals(labeled_json.with_name(f"{labeled_json.stem}_signals.npz"))
+    clips = match_clips(load_clip_intervals(CLIP_MAPPING_CSV, new_id), scenes)
+
+    if signals is not None:
+        fps = float(signals["fps"]) or 25.0
+        duration = len(signals["confidence"]) / fps
+    else:
+        fps = 25.0
+        duration = max([s["end"] for s in scenes] + [c["end"] for c in clips] + [0.0])
+    events = [(a / fps, (b + 1) / fps, f"event frames {a}-{b}") for a, b in labeled.get("events", [])]
+
+    raw_video = Path(RAW_VIDEO_DIR) / f"{original_id}.mp4"
+    thumbs = seek_thumbnails(raw_video, thumbnail_times(scenes, duration)) if raw_video.exists() else []
+
+    unmatched = sum(1 for c in clips if c["scene_id"] is None)
+    summary = (f"{len(events)} events, {len(scenes)} scenes, {len(clips)} clips ({unmatched} unmatched), "
+               f"{duration / 60:.1f} min")
+    if signals is not None:
+        summary += (f", threshold {float(signals['threshold']):.2f}, "
+                    f"{int(signals['decision'].sum())} YES frames of {len(signals['decision'])}")
+    else:
+        summary += ", no per-frame signals saved (rerun inference with SAVE_SIGNALS)"
+
+    svg = build_timeline_svg(duration, signals, events, scenes, clips, thumbs)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    out_path = output_dir / f"{new_id}_timeline.html"
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{new_id} timeline</title></head>"
+                f"<body style='font-family:sans-serif'><h3>{new_id} ({html.escape(original_id)})</h3>"
+                f"<p>{summary}</p>{svg}</body></html>")
+    print(f"[{new_id}] {summary} -> {out_path}")
+    return out_path
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python classifier_ends/inference_timeline.py <video_id> [<video_id> ...]")
+        return
+    new_to_orig, orig_to_new = load_id_mapping(CLIP_MAPPING_CSV)
+    for vid in sys.argv[1:]:
+        if vid in new_to_orig:
+            build_timeline(vid, new_to_orig[vid])
+        elif vid in orig_to_new:
+            build_timeline(orig_to_new[vid], vid)
+        else:
+            print(f"{vid}: not found in {CLIP_MAPPING_CSV}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
+import sys
 import cv2
 import mediapipe as mp
 import numpy as np
 from PIL import Image
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.profiling import frame_span
 
 class RuleBasedClassifier:
-    def __init__(self, scale_factor=1.5, dist_threshold=0.07, y_threshold=0.15, vis_threshold=0.4):
+    def __init__(self, scale_factor=1.5, dist_threshold=0.07, y_threshold=0.15, vis_threshold=0.4, roi=None,
+                 cascade=False, cascade_margin=0.25):
+        """
+        Arguments:
+            roi: Optional dict with keys 'x', 'y', 'w', 'h' (0-1 range of the full frame).
+                 When set, predict() expects frames that were already cropped to this
+                 region (e.g. by the decoder) and maps landmarks back to full-frame
+                 normalized coordinates, so the thresholds keep their meaning.
+            cascade: Run a pose-only model (complexity 0) first and only re-check frames
+                     whose rule inputs fall near a threshold with the Holistic model.
+            cascade_margin: Relative distance to a threshold below which the lite
+                            result is considered ambiguous (0.25 = within 25%).
+        """
         self.scale_factor = scale_factor
         self.dist_threshold = dist_threshold
         self.y_threshold = y_threshold
         self.vis_threshold = vis_threshold
+        self.cascade = cascade
+        self.cascade_margin = cascade_margin
         
         self.mp_holistic = mp.solutions.holistic
         # model_complexity=1 is a good balance. 2 is heavy, 0 is lite.
@@ -18,26 +37,36 @@ class RuleBasedClassifier:
             model_complexity=1,
             static_image_mode=False
         )
+        # First cascade stage: pose only, no face mesh / hand models
+        self.pose_lite = None
+        if cascade:
+            self.pose_lite = mp.solutions.pose.Pose(
+                min_detection_confidence=0.2,
+                min_tracking_confidence=0.5,
+                model_complexity=0,
+                static_image_mode=False
+            )
         self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         
-        # Mock attributes to match EndClassifier interface (used for visualization cropping)
-        # These are dummy values since we look at the whole body
-        self.crop_rel_x = 0
-        self.crop_rel_y = 0
-        self.crop_rel_w = 1
-        self.crop_rel_h = 1
+        # Which stage decided each frame ("lite" or "full")
+        self.last_stage = None
+        self.stage_counts = {"lite": 0, "full": 0}
+        
+        # Region of the full frame that predict() receives (also used for visualization cropping)
+        # Defaults to the whole frame
+        roi = roi or {'x': 0, 'y': 0, 'w': 1, 'h': 1}
+        self.crop_rel_x = roi['x']
+        self.crop_rel_y = roi['y']
+        self.crop_rel_w = roi['w']
+        self.crop_rel_h = roi['h']
 
-    def predict(self, img, do_crop=False, threshold=0.5):
-        """
-        Predict if the frame contains the 'clasped hands' pose.
-        Arguments:
-            img: PIL Image or numpy array
-            do_crop: Ignored, we generally need full context
-            threshold: Ignored, logic is hard-coded threshold
-        Returns:
-            is_yes (bool): True if clasped
-            confidence (float): Pseudo-confidence [0-1]
-        """
+    def to_frame_coords(self, lm):
+        """Map a landmark from input-normalized to full-frame normalized (x, y)."""
+        return np.array([self.crop_rel_x + lm.x * self.crop_rel_w,
+                         self.crop_rel_y + lm.y * self.crop_rel_h])
+
+    def preprocess(self, img):
+        """CLAHE + scaling. Returns the RGB image fed to MediaPipe."""
         # Convert PIL to CV2 BGR if needed
         if isinstance(img, Image.Image):
             frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
@@ -46,66 +75,125 @@ class RuleBasedClassifier:
 
         # Contrast Enhancement
         try:
-            lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            l2 = self.clahe.apply(l)
-            lab = cv2.merge((l2, a, b))
-            enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+            with frame_span("cvtColor"):
+                lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
+                l, a, b = cv2.split(lab)
+            with frame_span("clahe"):
+                l2 = self.clahe.apply(l)
+            with frame_span("cvtColor"):
+                lab = cv2.merge((l2, a, b))
+                enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
         except Exception:
             # Fallback if color conversion fails
             enhanced_frame = frame
         
         # Scaling
         if self.scale_factor != 1.0:
-            frame_input = cv2.resize(enhanced_frame, None, fx=self.scale_factor, fy=self.scale_factor, interpolation=cv2.INTER_LINEAR)
+            with frame_span("resize"):
+                frame_input = cv2.resize(enhanced_frame, None, fx=self.scale_factor, fy=self.scale_factor, interpolation=cv2.INTER_LINEAR)
         else:
             frame_input = enhanced_frame
             
-        # MediaPipe Process
-        image_rgb = cv2.cvtColor(frame_input, cv2.COLOR_BGR2RGB)
+        with frame_span("cvtColor"):
+            image_rgb = cv2.cvtColor(frame_input, cv2.COLOR_BGR2RGB)
         image_rgb.flags.writeable = False
-        results = self.holistic.process(image_rgb)
+        return image_rgb
+
+    def evaluate_pose(self, pose_landmarks):
+        """
+        Apply the clasped-hands rule to a set of pose landmarks.
+        Returns:
+            is_clasped (bool), confidence (float),
+            ambiguous (bool): True if any deciding input is within cascade_margin of its threshold
+        """
+        if not pose_landmarks:
+            return False, 0.0, True
+        
+        pose_lm = pose_landmarks.landmark
+        m = self.cascade_margin
+        
+        lw = pose_lm[self.mp_holistic.PoseLandmark.LEFT_WRIST]
+        rw = pose_lm[self.mp_holistic.PoseLandmark.RIGHT_WRIST]
+        lh = pose_lm[self.mp_holistic.PoseLandmark.LEFT_HIP]
+        rh = pose_lm[self.mp_holistic.PoseLandmark.RIGHT_HIP]
+        
+        # Visibility Check
+        min_vis = min(lw.visibility, rw.visibility)
+        if min_vis <= self.vis_threshold:
+            return False, 0.0, min_vis > self.vis_threshold * (1.0 - m)
+        vis_ambiguous = min_vis < self.vis_threshold * (1.0 + m)
+        
+        # Coords (x, y are normalized 0-1 in the full frame)
+        left_wrist = self.to_frame_coords(lw)
+        right_wrist = self.to_frame_coords(rw)
+        
+        # Logic
+        hip_avg_y = (self.to_frame_coords(lh)[1] + self.to_frame_coords(rh)[1]) / 2.0
+        wrist_dist = np.linalg.norm(left_wrist - right_wrist)
+        
+        # Check 1: Proximity
+        hands_close = wrist_dist < self.dist_threshold
+        
+        # Check 2: Level (Vertical distance to Hip line)
+        # We check distance of each wrist to the average hip Y line
+        dy_left = abs(left_wrist[1] - hip_avg_y)
+        dy_right = abs(right_wrist[1] - hip_avg_y)
+        stomach_level = (dy_left < self.y_threshold) and (dy_right < self.y_threshold)
+        
+        # Relative margins: > 0 means the check passes, < 0 means it fails
+        dist_margin = (self.dist_threshold - wrist_dist) / self.dist_threshold if self.dist_threshold > 0 else 1.0
+        y_margins = [(self.y_threshold - dy) / self.y_threshold if self.y_threshold > 0 else 1.0
+                     for dy in (dy_left, dy_right)]
         
         is_clasped = False
         confidence = 0.0
         
-        if results.pose_landmarks:
-            pose_lm = results.pose_landmarks.landmark
-            
-            # Helper to get landmark
-            def get_lm(idx):
-                return pose_lm[idx]
+        if hands_close and stomach_level:
+            is_clasped = True
+            # Pseudo confidence: Higher when hands are tighter
+            if self.dist_threshold > 0:
+                confidence = 1.0 - (wrist_dist / self.dist_threshold)
+                confidence = max(0.5, min(1.0, confidence)) # Clamp 0.5-1.0
+            else:
+                confidence = 1.0
+            # Robust only if every check (incl. visibility) passes by a clear margin
+            ambiguous = min([dist_margin] + y_margins) < m or vis_ambiguous
+        else:
+            # Robust if at least one check fails by a clear margin
+            ambiguous = min([dist_margin] + y_margins) > -m
+        
+        return is_clasped, confidence, ambiguous
 
-            lw = get_lm(self.mp_holistic.PoseLandmark.LEFT_WRIST)
-            rw = get_lm(self.mp_holistic.PoseLandmark.RIGHT_WRIST)
-            lh = get_lm(self.mp_holistic.PoseLandmark.LEFT_HIP)
-            rh = get_lm(self.mp_holistic.PoseLandmark.RIGHT_HIP)
-            
-            # Visibility Check
-            if lw.visibility > self.vis_threshold and rw.visibility > self.vis_threshold:
-                # Coords (x, y are normalized 0-1)
-                left_wrist = np.array([lw.x, lw.y])
-                right_wrist = np.array([rw.x, rw.y])
-                
-                # Logic
-                hip_avg_y = (lh.y + rh.y) / 2.0
-                wrist_dist = np.linalg.norm(left_wrist - right_wrist)
-                
-                # Check 1: Proximity
-                hands_close = wrist_dist < self.dist_threshold
-                
-                # Check 2: Level (Vertical distance to Hip line)
-                # We check distance of each wrist to the average hip Y line
-                stomach_level = (abs(left_wrist[1] - hip_avg_y) < self.y_threshold) and \
-                                (abs(right_wrist[1] - hip_avg_y) < self.y_threshold)
-                
-                if hands_close and stomach_level:
-                    is_clasped = True
-                    # Pseudo confidence: Higher when hands are tighter
-                    if self.dist_threshold > 0:
-                        confidence = 1.0 - (wrist_dist / self.dist_threshold)
-                        confidence = max(0.5, min(1.0, confidence)) # Clamp 0.5-1.0
-                    else:
-                        confidence = 1.0
+    def predict(self, img, do_crop=False, threshold=0.5):
+        """
+        Predict if the frame contains the 'clasped hands' pose.
+        Arguments:
+            img: PIL Image or numpy array
+            do_crop: Ignored, cropping is done by the decoder (see roi)
+            threshold: Ignored, logic is hard-coded threshold
+        Returns:
+            is_yes (bool): True if clasped
+            confidence (float): Pseudo-confidence [0-1]
+        The deciding stage is available in self.last_stage.
+        """
+        image_rgb = self.preprocess(img)
+        
+        if self.cascade:
+            with frame_span("pose_lite.process"):
+                results = self.pose_lite.process(image_rgb)
+            with frame_span("rule_check"):
+                is_clasped, confidence, ambiguous = self.evaluate_pose(results.pose_landmarks)
+            if not ambiguous:
+                self.last_stage = "lite"
+                self.stage_counts["lite"] += 1
+                return is_clasped, confidence
+        
+        # MediaPipe Process
+        with frame_span("holistic.process"):
+            results = self.holistic.process(image_rgb)
+        with frame_span("rule_check"):
+            is_clasped, confidence, _ = self.evaluate_pose(results.pose_landmarks)
+        self.last_stage = "full"
+        self.stage_counts["full"] += 1
         
         return is_clasped, confidence
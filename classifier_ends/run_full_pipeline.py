@@ -1,17 +1,22 @@
 import csv
 import json
 import os
+import sys
 import subprocess
-import cv2
 import threading
 import time
 import numpy as np
-from PIL import Image
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from rule_based_classifier import RuleBasedClassifier
 from datetime import datetime
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.frame_source import FrameSource, probe_video
+from utils.roi_calibration import load_roi_cache, get_cached_roi
+from utils.phash import PerceptualIndex, video_keyframe_hashes, KEYFRAME_MATCH_RATIO
+from utils import profiling
+
 # --- CONFIGURATION ---
 BASE_DIR = "/workspace/datdq/SignWeather"
 RAW_VIDEO_DIR = f"{BASE_DIR}/data/raw_videos"
@@ -20,6 +25,9 @@ LABELED_JSON_DIR = f"{BASE_DIR}/data/labeled_videos" # Fixed path to keep it sta
 METADATA_DIR = f"{BASE_DIR}/data/metadata"
 
 CLIP_MAPPING_CSV = f"{METADATA_DIR}/clip_mapping_final.csv"
+VIDEO_CHANNEL_CSV = f"{METADATA_DIR}/mapping/video_channel.csv" # original_video_id,channel (optional)
+ROI_CACHE_PATH = f"{METADATA_DIR}/roi_cache.json" # Per-video signer ROI (utils/roi_calibration.py)
+PHASH_INDEX_PATH = f"{METADATA_DIR}/phash_index.json" # Keyframe hashes (utils/phash.py)
 VSWD_CSV = f"{METADATA_DIR}/vswd_final_filtered.csv"
 OUTPUT_METADATA_CSV = f"{METADATA_DIR}/scene_metadata_realtime.csv"
 
@@ -27,6 +35,42 @@ OUTPUT_METADATA_CSV = f"{METADATA_DIR}/scene_metadata_realtime.csv"
 CONFIDENCE_THRESHOLD = 0.20
 MIN_EVENT_FRAMES = 5
 MAX_WORKERS = 2 
+FRAME_RING_SIZE = 16 # Decoded frames buffered ahead of the classifier
+
+# Segmentation input
+# "full": decode full frames, CLAHE + 1.5x upscale in Python (original behaviour)
+# "roi":  ffmpeg crops the signer region and rescales it to SEGMENTATION_INPUT_HEIGHT
+#         during decode, so the Python loop never sees full-HD frames
+# Keep "full" until "roi" has been shown to give the same scenes on known broadcasts
+# (run both modes on a few videos and compare the labeled JSON events)
+SEGMENTATION_INPUT_MODE = "full"
+SEGMENTATION_INPUT_HEIGHT = 480
+DECODE_THREADS = 2
+
+# Signer region per channel (relative to the full frame).
+# Must contain both wrists and the hip line of the signer.
+SEGMENTATION_ROIS = {
+    "default": {'x': 0.04, 'y': 0.62, 'w': 0.24, 'h': 0.36},
+}
+
+# Detection cascade: pose-only lite model first, Holistic only for frames near a threshold.
+# Off until classifier_ends/evaluate_cascade.py shows event/scene agreement with the
+# Holistic-only detector on this configuration: frames answered by the lite stage skip
+# holistic.process, so Holistic loses its tracking state between ambiguous frames.
+USE_DETECTION_CASCADE = False
+CASCADE_MARGIN = 0.25
+# Find raw videos whose keyframes match an earlier video (re-uploads, repeated bulletins).
+# The phash pass runs serially before any worker starts, so it only runs when a report is
+# requested (DEDUP_BROADCASTS, written to DUPLICATE_REPORT_CSV) or DROP_DUPLICATE_BROADCASTS
+# is set. Dropping should wait until the thresholds are checked on known duplicate / distinct pairs.
+DEDUP_BROADCASTS = False
+DROP_DUPLICATE_BROADCASTS = False
+DUPLICATE_REPORT_CSV = f"{METADATA_DIR}/duplicate_broadcast_candidates.csv"
+DUPLICATE_REPORT_RATIO = 0.5 # Near misses above this keyframe match ratio are reported too
+
+# Per-frame confidence / decision arrays saved next to each labeled JSON as
+# <id>_labeled_signals.npz (read by classifier_ends/inference_timeline.py)
+SAVE_SIGNALS = True
 
 # Globals
 csv_lock = threading.Lock()
@@ -54,6 +98,28 @@ class PipelineUtils:
                     mapping[nid] = oid
         return mapping
 
+    @staticmethod
+    def get_video_channels(csv_path):
+        """Map original_video_id to channel name (used to pick a segmentation ROI)"""
+        channels = {}
+        if not os.path.exists(csv_path):
+            return channels
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                oid = row.get('original_video_id')
+                channel = row.get('channel')
+                if oid and channel:
+                    channels[oid] = channel
+        return channels
+
+    @staticmethod
+    def get_segmentation_roi(original_id, channels, roi_cache=None):
+        """Calibrated per-video ROI if available, else the channel ROI"""
+        channel = channels.get(original_id, "default")
+        channel_roi = SEGMENTATION_ROIS.get(channel, SEGMENTATION_ROIS["default"])
+        return get_cached_roi(original_id, roi_cache or {}, default=channel_roi)
+
     @staticmethod
     def get_valid_videos_from_vswd(csv_path):
         valid_ids = set()
@@ -97,9 +163,20 @@ class PipelineUtils:
 
 # --- STEP 1: SEGMENTATION (INFERENCE) ---
 
-def analyze_scenes(yes_indices, total_frames, fps, output_json_path, min_event_frames=5):
+def run_length_stages(stages):
+    """['lite', 'lite', 'full'] -> [[0, 1, 'lite'], [2, 2, 'full']] (inclusive frame ranges)"""
+    runs = []
+    for idx, stage in enumerate(stages):
+        if runs and runs[-1][2] == stage:
+            runs[-1][1] = idx
+        else:
+            runs.append([idx, idx, stage])
+    return runs
+
+def group_events(yes_indices, fps, min_event_frames=5):
+    """Merge YES frames less than 1s apart into (start, end) frame ranges, dropping short ones."""
     if not yes_indices:
-        return
+        return []
 
     events = []
     merge_threshold = int(1.0 * fps)
@@ -118,7 +195,10 @@ def analyze_scenes(yes_indices, total_frames, fps, output_json_path, min_event_f
             curr_end = frame
     if (curr_end - curr_start + 1) >= min_event_frames:
         events.append((curr_start, curr_end))
-    
+    return events
+
+def build_scenes(events, total_frames, fps):
+    """Scenes are the gaps between YES events that are longer than 5 frames."""
     scenes = []
     curr_frame_idx = 0
     scene_counter = 1
@@ -151,43 +231,108 @@ def analyze_scenes(yes_indices, total_frames, fps, output_json_path, min_event_f
                 "frame_start": curr_frame_idx,
                 "frame_end": scene_end
             })
+    return scenes
+
+def analyze_scenes(yes_indices, total_frames, fps, output_json_path, min_event_frames=5, extra=None):
+    if not yes_indices:
+        return
+
+    events = group_events(yes_indices, fps, min_event_frames)
+    scenes = build_scenes(events, total_frames, fps)
 
     with open(output_json_path, 'w') as f:
         json.dump({
             "total_yes_events": len(events),
             "total_scenes": len(scenes),
-            "scenes": scenes
+            "scenes": scenes,
+            "events": [list(e) for e in events],
+            **(extra or {})
         }, f, indent=4)
 
-def run_inference(input_path, output_json_path):
+def signals_path(labeled_json_path):
+    path = Path(labeled_json_path)
+    return path.with_name(f"{path.stem}_signals.npz")
+
+def save_signals(path, confidences, yes_indices, stages, fps, roi=None):
+    """
+    Per-frame classifier output: confidence (float32), decision (bool), detector stage id,
+    plus the decode ROI the classifier saw as [x, y, w, h] (relative; empty = full frame).
+    """
+    decision = np.zeros(len(confidences), dtype=bool)
+    decision[yes_indices] = True
+    stage_names = sorted({s for s in stages if s is not None})
+    stage_ids = {name: i for i, name in enumerate(stage_names)}
+    np.savez_compressed(
+        path,
+        confidence=np.asarray(confidences, dtype=np.float32),
+        decision=decision,
+        stage=np.array([stage_ids.get(s, -1) for s in stages], dtype=np.int8),
+        stage_names=np.array(stage_names),
+        fps=fps,
+        threshold=CONFIDENCE_THRESHOLD,
+        min_event_frames=MIN_EVENT_FRAMES,
+        roi=np.array([roi[k] for k in ('x', 'y', 'w', 'h')] if roi else [], dtype=np.float64),
+    )
+
+def make_frame_source(input_path, roi=None):
+    """Decoder for the segmentation pass (ffmpeg crop/rescale when roi is given)."""
+    if roi is not None:
+        return FrameSource(input_path, crop=roi, size=(None, SEGMENTATION_INPUT_HEIGHT),
+                           backend="ffmpeg", ring_size=FRAME_RING_SIZE, threads=DECODE_THREADS)
+    return FrameSource(input_path, ring_size=FRAME_RING_SIZE)
+
+def make_classifier(source, cascade=USE_DETECTION_CASCADE):
+    """RuleBasedClassifier matching the frames produced by make_frame_source()."""
+    if source.crop_params is not None:
+        # Use the crop after pixel rounding so the coordinate mapping is exact
+        return RuleBasedClassifier(scale_factor=1.0, roi=source.crop_params,
+                                   cascade=cascade, cascade_margin=CASCADE_MARGIN)
     # RuleBased logic
-    classifier = RuleBasedClassifier(scale_factor=1.5)
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
-        raise Exception(f"Cannot open video {input_path}")
-
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return RuleBasedClassifier(scale_factor=1.5, cascade=cascade, cascade_margin=CASCADE_MARGIN)
+
+def run_inference(input_path, output_json_path, roi=None):
+    """
+    Classify every frame of a raw video and write the scene JSON.
+    If roi is given, frames are cropped/rescaled by ffmpeg during decode and
+    the classifier maps landmarks back to full-frame coordinates.
+    With SAVE_SIGNALS the per-frame confidences and decisions are kept too.
+    Returns the decoder stats of the FrameSource (decode- vs model-bound).
+    """
+    source = make_frame_source(input_path, roi)
+    classifier = make_classifier(source)
     
     yes_frames_indices = []
-    frame_idx = 0
+    frame_stages = []
+    confidences = []
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(rgb_frame)
-
-        is_yes, confidence = classifier.predict(pil_img, do_crop=True, threshold=CONFIDENCE_THRESHOLD)
-        if is_yes:
-            yes_frames_indices.append(frame_idx)
-            
-        frame_idx += 1
+    with source:
+        fps = source.fps
+        total_frames = source.frame_count
+        
+        for frame_idx, frame in profiling.profiled_iter(source, "decode"):
+            profiling.sample_frame(frame_idx)
+            # predict() takes BGR arrays directly, no PIL round-trip needed
+            with profiling.frame_span("predict"):
+                is_yes, confidence = classifier.predict(frame, do_crop=True, threshold=CONFIDENCE_THRESHOLD)
+            if is_yes:
+                yes_frames_indices.append(frame_idx)
+            frame_stages.append(classifier.last_stage)
+            confidences.append(confidence)
             
-    cap.release()
-    analyze_scenes(yes_frames_indices, total_frames, fps, output_json_path, MIN_EVENT_FRAMES)
+    extra = {
+        "roi": source.crop_params, # Region the classifier saw (None = full frame)
+        "detector": {
+            "stage_counts": classifier.stage_counts,
+            "stage_runs": run_length_stages(frame_stages),
+        }
+    }
+    analyze_scenes(yes_frames_indices, total_frames, fps, output_json_path, MIN_EVENT_FRAMES, extra=extra)
+    if SAVE_SIGNALS:
+        save_signals(signals_path(output_json_path), confidences, yes_frames_indices, frame_stages, fps,
+                     roi=source.crop_params)
+    stats = source.stats()
+    stats["stage_counts"] = classifier.stage_counts
+    return stats
 
 # --- STEP 2: MATCHING & CUTTING ---
 
@@ -201,7 +346,8 @@ def cut_video(input_path, output_path, start, end):
         '-c:v', 'libx264', '-c:a', 'aac', '-strict', 'experimental',
         str(output_path)
     ]
-    subprocess.run(cmd, check=True)
+    with profiling.span("ffmpeg.cut_video"):
+        subprocess.run(cmd, check=True)
 
 def append_to_csv(rows, csv_path, fieldnames):
     if not rows:
@@ -215,7 +361,8 @@ def append_to_csv(rows, csv_path, fieldnames):
             writer.writerows(rows)
             f.flush()
 
-def process_single_video_pipeline(new_id, original_id, all_clip_times):
+def process_single_video_pipeline(new_id, original_id, all_clip_times, roi=None):
+    profiling.set_context(video=new_id)
     try:
         raw_vid_path = Path(RAW_VIDEO_DIR) / f"{original_id}.mp4"
         labeled_json_path = Path(LABELED_JSON_DIR) / f"{original_id}_labeled.json"
@@ -231,8 +378,11 @@ def process_single_video_pipeline(new_id, original_id, all_clip_times):
         if not labeled_json_path.exists():
             log(f"[{new_id}] Generating JSON (Inference)...")
             try:
-                run_inference(raw_vid_path, labeled_json_path)
-                log(f"[{new_id}] JSON generated.")
+                with profiling.span("run_inference"):
+                    decode_stats = run_inference(raw_vid_path, labeled_json_path, roi=roi)
+                log(f"[{new_id}] JSON generated. Decoder stall {decode_stats['stall_seconds']}s / "
+                    f"{decode_stats['wall_seconds']}s ({decode_stats['bound']}-bound), "
+                    f"stages {decode_stats['stage_counts']}")
             except Exception as e:
                 log(f"[{new_id}] Inference Failed: {e}")
                 return 0
@@ -321,6 +471,39 @@ def process_single_video_pipeline(new_id, original_id, all_clip_times):
         log(f"[{new_id}] CRITICAL FAIL: {e}")
         return 0
 
+def find_duplicate_broadcasts(video_ids, index_path=PHASH_INDEX_PATH):
+    """
+    Keyframe-hash each raw video in order and return {original_id: earlier_original_id}
+    for near-duplicates, the frames / seconds of video they would cost, and candidate
+    rows (every best match at or above DUPLICATE_REPORT_RATIO) for DUPLICATE_REPORT_CSV.
+    """
+    index = PerceptualIndex(index_path)
+    duplicates = {}
+    candidates = []
+    avoided = {"frames": 0, "seconds": 0.0}
+    for original_id in video_ids:
+        raw_vid_path = Path(RAW_VIDEO_DIR) / f"{original_id}.mp4"
+        if not raw_vid_path.exists():
+            continue
+        try:
+            hashes = index.keyframes.get(original_id) or video_keyframe_hashes(raw_vid_path)
+            best, ratio = index.best_video_match(original_id, hashes) if hashes else (None, 0.0)
+            match = index.check_video(original_id, hashes)
+        except Exception as e:
+            log(f"[{original_id}] Keyframe hashing failed: {e}")
+            continue
+        if best is not None and ratio >= DUPLICATE_REPORT_RATIO:
+            candidates.append({"original_video_id": original_id, "match_video_id": best,
+                               "keyframes": len(hashes), "match_ratio": round(ratio, 4),
+                               "duplicate": match is not None})
+        if match is not None:
+            duplicates[original_id] = match
+            info = probe_video(raw_vid_path)
+            avoided["frames"] += info["frame_count"]
+            avoided["seconds"] += info["frame_count"] / info["fps"] if info["fps"] else 0.0
+    index.save()
+    return duplicates, avoided, candidates
+
 # --- MAIN ---
 
 def main():
@@ -331,6 +514,8 @@ def main():
     video_map = PipelineUtils.get_video_mapping(CLIP_MAPPING_CSV)
     valid_new_ids = PipelineUtils.get_valid_videos_from_vswd(VSWD_CSV)
     all_clip_times = PipelineUtils.load_clip_data(CLIP_MAPPING_CSV, VSWD_CSV)
+    video_channels = PipelineUtils.get_video_channels(VIDEO_CHANNEL_CSV)
+    roi_cache = load_roi_cache(ROI_CACHE_PATH)
     
     # Initialize CSV with header
     fieldnames = ["path", "text", "quality_level", "content_label", "thesis_score", "original_clips"]
@@ -346,6 +531,25 @@ def main():
         if special in sorted_ids:
             sorted_ids.insert(0, sorted_ids.pop(sorted_ids.index(special)))
     
+    if DEDUP_BROADCASTS or DROP_DUPLICATE_BROADCASTS:
+        duplicates, avoided, candidates = find_duplicate_broadcasts(
+            [video_map[n] for n in sorted_ids if video_map.get(n)])
+        for row in candidates:
+            log(f"[{row['original_video_id']}] Duplicate candidate of {row['match_video_id']} "
+                f"(keyframe match {row['match_ratio']:.2f}, threshold {KEYFRAME_MATCH_RATIO})")
+        with open(DUPLICATE_REPORT_CSV, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=["original_video_id", "match_video_id", "keyframes",
+                                                   "match_ratio", "duplicate"])
+            writer.writeheader()
+            writer.writerows(candidates)
+        if DROP_DUPLICATE_BROADCASTS:
+            sorted_ids = [n for n in sorted_ids if video_map.get(n) not in duplicates]
+            log(f"Broadcast dedup: {len(duplicates)} videos dropped, "
+                f"{avoided['frames']} frames ({avoided['seconds'] / 3600:.2f} h) of inference avoided")
+        else:
+            log(f"Broadcast dedup (report only): {len(duplicates)} likely duplicates, "
+                f"{avoided['frames']} frames ({avoided['seconds'] / 3600:.2f} h); see {DUPLICATE_REPORT_CSV}")
+
     log(f"Queueing {len(sorted_ids)} videos with {MAX_WORKERS} workers...")
     
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
@@ -355,7 +559,11 @@ def main():
             if not original_id:
                 continue
             
-            future = executor.submit(process_single_video_pipeline, new_id, original_id, all_clip_times)
+            roi = None
+            if SEGMENTATION_INPUT_MODE == "roi":
+                roi = PipelineUtils.get_segmentation_roi(original_id, video_channels, roi_cache)
+            
+            future = executor.submit(process_single_video_pipeline, new_id, original_id, all_clip_times, roi)
             futures[future] = new_id
             
         completed_count = 0
@@ -370,6 +578,10 @@ def main():
                 log(f"[{new_id}] Unhandled Exception: {e}")
 
     log("=== PIPELINE FINISHED ===")
+    if profiling.ENABLED:
+        log("\n" + profiling.summary())
+        log("\n" + profiling.summary(by=("video", "name")))
+        log(f"Trace written at exit to {profiling.PROFILE_DIR}/ (merge with: python utils/profiling.py {profiling.PROFILE_DIR})")
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,26 @@
 
+import sys
+import subprocess
+import tempfile
 import cv2
-import torch
 import numpy as np
 from PIL import Image
 from pathlib import Path
-from inference import EndClassifier
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.frame_source import FrameSource
+
+# ffmpeg overlay style (RGB), matching the cv2 colors of visualize_video
+CROP_BOX_COLOR = "0x00FFFF"
+YES_COLOR = "0x00FF00"
+NO_COLOR = "0xFF0000"
+LABEL_FONT_SIZE = 30
+LABEL_FONT_FILE = None # None = fontconfig default (ffmpeg built with fontconfig), else a .ttf path
 
 def visualize_video(input_path, output_path, model_path, confidence_threshold=0.5, min_event_frames=5):
+    """Run the classifier on every frame and draw its label in Python (slow; see visualize_video_ffmpeg)."""
+    from inference import EndClassifier
+    
     print(f"Processing: {input_path}")
     print(f"Config: Threshold={confidence_threshold}, Min Event Frames={min_event_frames}")
     
@@ -15,22 +29,21 @@ def visualize_video(input_path, output_path, model_path, confidence_threshold=0.
     print("Model loaded.")
 
     # Open Video
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
+    try:
+        source = FrameSource(input_path)
+    except ValueError:
         print(f"Error: Cannot open video {input_path}")
         return
 
     # Video Properties
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = source.source_width
+    height = source.source_height
+    fps = source.fps
+    total_frames = source.frame_count
     
     # Output Writer Replaced by FFmpeg Assembly
     # Create temp directory for frames
-    import tempfile
     import shutil
-    import subprocess
     
     temp_dir = tempfile.mkdtemp()
     print(f"Using temp dir: {temp_dir}")
@@ -54,15 +67,12 @@ def visualize_video(input_path, output_path, model_path, confidence_threshold=0.
     yes_frames_indices = []
     
     try:
-        while True:
+        source.start()
+        for frame_idx, frame in source:
             if frame_idx >= limit_frames:
                 print(f"\nReached limit ({frame_idx} frames). Stopping capture.")
                 break
 
-            ret, frame = cap.read()
-            if not ret:
-                break
-
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             pil_img = Image.fromarray(rgb_frame)
 
@@ -90,11 +100,11 @@ def visualize_video(input_path, output_path, model_path, confidence_threshold=0.
             frame_path = f"{temp_dir}/frame_{frame_idx:06d}.png"
             cv2.imwrite(frame_path, frame)
             
-            frame_idx += 1
-            if frame_idx % 50 == 0:
-                print(f"Processed {frame_idx}/{limit_frames} frames...", end='\r')
+            if (frame_idx + 1) % 50 == 0:
+                print(f"Processed {frame_idx + 1}/{limit_frames} frames...", end='\r')
                 
-        cap.release()
+        source.close()
+        print(f"\nDecoder: {source.format_stats()}")
         
         print(f"\nEncoding video with ffmpeg...")
         # Use ffmpeg to create video from frames
@@ -122,8 +132,108 @@ def visualize_video(input_path, output_path, model_path, confidence_threshold=0.
         analyze_scenes(yes_frames_indices, total_frames, fps, json_path, min_event_frames)
 
     finally:
+        source.close()
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+def _label_text(decision, confidence):
+    return f"{'YES' if decision else 'NO'} ({confidence:.2f})"
+
+def build_sendcmd(confidence, decision, fps, cmd_path):
+    """
+    Write an ffmpeg sendcmd script that re-initializes drawtext@label whenever the
+    label text changes (not once per frame).
+    
+    Returns:
+        Number of commands written
+    """
+    confidence = np.round(np.asarray(confidence, dtype=np.float64), 2)
+    decision = np.asarray(decision, dtype=bool)
+    changes = np.flatnonzero((np.diff(confidence) != 0) | (np.diff(decision) != 0)) + 1
+    
+    with open(cmd_path, 'w') as f:
+        for i in changes:
+            color = YES_COLOR if decision[i] else NO_COLOR
+            # Half a frame early so rounding never delays the change to the next frame
+            f.write(f"{max(0.0, (i - 0.5) / fps):.4f} drawtext@label reinit 'text={_label_text(decision[i], confidence[i])}:fontcolor={color}';\n")
+    return len(changes)
+
+def _escape_filter_value(value):
+    """Escape a path for use as an unquoted filter option value inside a filtergraph (two levels)."""
+    value = str(value)
+    for ch in "\\':":      # Option level
+        value = value.replace(ch, "\\" + ch)
+    for ch in "\\'[],;":   # Filtergraph level
+        value = value.replace(ch, "\\" + ch)
+    return value
+
+def visualize_video_ffmpeg(input_path, output_path, signals_path, crop=None, preset="medium", crf=23):
+    """
+    Same overlay as visualize_video, rendered by ffmpeg in a single run from the
+    decisions saved during inference (run_full_pipeline SAVE_SIGNALS). No frame
+    is decoded in Python, so throughput is bounded by the encoder.
+    
+    Args:
+        input_path: Raw broadcast
+        output_path: Annotated MP4
+        signals_path: <id>_labeled_signals.npz written by run_inference
+        crop: Optional dict with keys 'x', 'y', 'w', 'h' (0-1 range) drawn as the crop box.
+              Defaults to the ROI stored with the signals (the region the classifier saw);
+              pass False for no box.
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    with np.load(signals_path) as data:
+        confidence = data["confidence"]
+        decision = data["decision"]
+        fps = float(data["fps"])
+        stored_roi = data["roi"] if "roi" in data.files else np.array([])
+    if crop is None and stored_roi.size == 4:
+        crop = dict(zip(('x', 'y', 'w', 'h'), map(float, stored_roi)))
+    if len(confidence) == 0:
+        print(f"No per-frame signals in {signals_path}")
+        return False
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.cmd', delete=False) as f:
+        cmd_path = f.name
+    try:
+        n_commands = build_sendcmd(confidence, decision, fps, cmd_path)
+        
+        filters = [f"sendcmd=f={_escape_filter_value(cmd_path)}"]
+        if crop:
+            # Same rounding/clamping as the Python mode
+            filters.append(
+                f"drawbox=x='max(0,min(trunc({crop['x']}*iw),iw-1))':y='max(0,min(trunc({crop['y']}*ih),ih-1))'"
+                f":w='trunc({crop['w']}*iw)':h='trunc({crop['h']}*ih)':color={CROP_BOX_COLOR}:t=2")
+        font = f"fontfile={_escape_filter_value(LABEL_FONT_FILE)}:" if LABEL_FONT_FILE else ""
+        filters.append(
+            f"drawtext@label={font}text='{_label_text(decision[0], round(float(confidence[0]), 2))}'"
+            f":fontcolor={YES_COLOR if decision[0] else NO_COLOR}:fontsize={LABEL_FONT_SIZE}"
+            f":x=30:y=30:box=1:boxcolor=black:boxborderw=10")
+        
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-i', str(input_path),
+            '-vf', ",".join(filters),
+            '-map', '0:v:0', '-map', '0:a?',
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-pix_fmt', 'yuv420p',
+            '-c:a', 'copy',
+            '-y',
+            str(output_path)
+        ]
+        print(f"Rendering {len(confidence)} frames with {n_commands} label changes in one ffmpeg run...")
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"ffmpeg error: {result.stderr}")
+            return False
+        print(f"Done! Video saved to {output_path}")
+        return True
+    finally:
+        Path(cmd_path).unlink(missing_ok=True)
+
 def analyze_scenes(yes_indices, total_frames, fps, output_json_path, min_event_frames=5):
     import json
     
@@ -229,7 +339,17 @@ if __name__ == "__main__":
     THRESH = 0.20 
     MIN_FRAMES = 5 # ~0.2s at 25fps
     
+    # "ffmpeg": draw the decisions saved by run_full_pipeline (SAVE_SIGNALS) in one ffmpeg run
+    # "python": re-run the classifier and draw every frame in Python
+    MODE = "ffmpeg"
+    SIGNALS_NPZ = OUTPUT_DIR / "1-iUEsz_srY_labeled_signals.npz" # Also holds the ROI the run used (drawn as the box)
+    
     if not Path(INPUT_VIDEO).exists():
         print(f"File not found: {INPUT_VIDEO}")
+    elif MODE == "ffmpeg":
+        if not SIGNALS_NPZ.exists():
+            print(f"Signals not found: {SIGNALS_NPZ} (run classifier_ends/run_full_pipeline.py with SAVE_SIGNALS)")
+        else:
+            visualize_video_ffmpeg(INPUT_VIDEO, OUTPUT_VIDEO, SIGNALS_NPZ)
     else:
         visualize_video(INPUT_VIDEO, OUTPUT_VIDEO, MODEL_PATH, confidence_threshold=THRESH, min_event_frames=MIN_FRAMES)
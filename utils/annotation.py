@@ -0,0 +1,165 @@
+"""
+Fused per-segment annotation: one JSON call returns what classify_quality,
+classify_weather_segment, score_segment_for_thesis and audit_one_segment
+produce separately.
+"""
+
+import json
+
+from config import Config
+from utils.gpt_utils import chat_completion
+from utils.openai_client import get_async_client
+
+ANNOTATE_SYSTEM_PROMPT = """
+Bạn là chuyên gia gán nhãn dữ liệu cho bộ dữ liệu bản tin thời tiết VTV.
+Với mỗi câu thoại (RAW = câu ASR, FINAL = câu đã biên tập), trả về MỘT object JSON với các trường được yêu cầu:
+
+- quality_level: "HIGH" | "MEDIUM" | "LOW"
+  HIGH: rõ, mạch lạc, chính xác. MEDIUM: còn vài lỗi nhưng ý vẫn rõ. LOW: mơ hồ, lỗi nhiều, không liên quan thời tiết.
+
+- content_label: "WEATHER_CORE" | "WEATHER_SUPPORT" | "NON_WEATHER"
+  WEATHER_CORE: nói trực tiếp về thời tiết/thiên tai, có số liệu hoặc thông tin chính.
+  WEATHER_SUPPORT: lời dẫn, chuyển mạch, chào hỏi trong chương trình thời tiết.
+  NON_WEATHER: quảng cáo, kêu gọi đăng ký kênh, không liên quan thời tiết.
+
+- thesis_score: số nguyên 0-100, mức độ HỮU ÍCH cho dataset.
+  Nội dung càng cụ thể (hiện tượng, địa điểm, thời gian, mức độ) và câu càng tốt → điểm càng cao.
+  WEATHER_CORE thường cao hơn WEATHER_SUPPORT. Câu chung chung → điểm thấp.
+
+- audit_flag: "OK" | "WARN" | "REMOVE"
+- audit_score: số nguyên 0-100, mức độ phù hợp để huấn luyện
+  (xét: liên quan thời tiết, tự nhiên/đúng ngữ pháp, lượng thông tin, lặp lại).
+- audit_note: ghi chú ngắn, tiếng Việt.
+
+Chỉ trả về JSON, không giải thích.
+"""
+
+# field -> (type, allowed values or (min, max) range, fallback used when the model never returns it)
+ANNOTATION_SCHEMA = {
+    "quality_level": (str, ("HIGH", "MEDIUM", "LOW"), "MEDIUM"),
+    "content_label": (str, ("WEATHER_CORE", "WEATHER_SUPPORT", "NON_WEATHER"), "NON_WEATHER"),
+    "thesis_score": (int, (0, 100), 50),
+    "audit_flag": (str, ("OK", "WARN", "REMOVE"), "WARN"),
+    "audit_score": (int, (0, 100), 70),
+    "audit_note": (str, None, ""),
+}
+ANNOTATION_FIELDS = list(ANNOTATION_SCHEMA)
+MAX_ATTEMPTS = 3
+
+def _coerce_field(field: str, value):
+    """Validated value for one field, or None if it does not match the schema."""
+    kind, allowed, _ = ANNOTATION_SCHEMA[field]
+    if value is None:
+        return None
+    if kind is int:
+        try:
+            value = int(round(float(value)))
+        except (TypeError, ValueError):
+            return None
+        lo, hi = allowed
+        return value if lo <= value <= hi else None
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if allowed is None:
+        return value
+    value = value.upper()
+    return value if value in allowed else None
+
+def validate_annotation(raw: str, fields=ANNOTATION_FIELDS) -> tuple:
+    """
+    Parse and validate a JSON response.
+
+    Returns:
+        valid: {field: value} for requested fields that passed validation
+        missing: requested fields that were absent or invalid
+    """
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        return {}, list(fields)
+
+    valid, missing = {}, []
+    for field in fields:
+        value = _coerce_field(field, data.get(field))
+        if value is None:
+            missing.append(field)
+        else:
+            valid[field] = value
+    return valid, missing
+
+def annotation_complete(raw: str, fields=ANNOTATION_FIELDS) -> bool:
+    """True if every requested field is valid (only such responses are cached)."""
+    return not validate_annotation(raw, fields)[1]
+
+def _annotate_user(text_raw: str, text_final: str, duration: float, fields) -> str:
+    return f"""[RAW]
+{text_raw}
+
+[FINAL]
+{text_final}
+
+duration_seconds: {duration:.2f}
+
+Trả về JSON với đúng các trường: {", ".join(fields)}
+"""
+
+def _fallback(annotation: dict) -> dict:
+    for field in ANNOTATION_FIELDS:
+        annotation.setdefault(field, ANNOTATION_SCHEMA[field][2])
+    return annotation
+
+def _empty_annotation() -> dict:
+    annotation = _fallback({})
+    annotation.update({"content_label": "NON_WEATHER", "audit_flag": "REMOVE", "audit_score": 0, "audit_note": "Câu trống."})
+    return annotation
+
+def annotate_segment(text_raw: str, text_final: str, duration: float = 0.0,
+                     model: str = Config.OPENAI_MODEL_MINI, max_attempts: int = MAX_ATTEMPTS) -> dict:
+    """
+    All annotation fields for one segment in one request.
+    Fields that fail validation are re-requested alone (up to max_attempts calls);
+    anything still missing falls back to the same defaults as the single-task parsers.
+    Incomplete responses are not cached, so a retry asks the model again.
+    """
+    if not (text_final or "").strip():
+        return _empty_annotation()
+
+    annotation, missing = {}, ANNOTATION_FIELDS
+    for _ in range(max_attempts):
+        fields = missing
+        raw = chat_completion(ANNOTATE_SYSTEM_PROMPT, _annotate_user(text_raw, text_final, duration, fields),
+                              model=model, temperature=0.0, response_format={"type": "json_object"},
+                              validate=lambda out: annotation_complete(out, fields))
+        valid, missing = validate_annotation(raw, missing)
+        annotation.update(valid)
+        if not missing:
+            break
+    return _fallback(annotation)
+
+async def aannotate_segment(text_raw: str, text_final: str, duration: float = 0.0,
+                            model: str = Config.OPENAI_MODEL_MINI, max_attempts: int = MAX_ATTEMPTS) -> dict:
+    if not (text_final or "").strip():
+        return _empty_annotation()
+
+    annotation, missing = {}, ANNOTATION_FIELDS
+    for _ in range(max_attempts):
+        fields = missing
+        raw = await get_async_client().chat(
+            ANNOTATE_SYSTEM_PROMPT, _annotate_user(text_raw, text_final, duration, fields),
+            model=model, temperature=0.0, response_format={"type": "json_object"},
+            validate=lambda out: annotation_complete(out, fields))
+        valid, missing = validate_annotation(raw, missing)
+        annotation.update(valid)
+        if not missing:
+            break
+    return _fallback(annotation)
+
+def annotate_segments(rows: list[dict]) -> list[dict]:
+    """
+    Annotate many segments concurrently, results in input order.
+    rows: dicts with keys text_raw, text_final and optionally duration
+    """
+    return get_async_client().map(lambda row: aannotate_segment(**row), rows)
@@ -1,6 +1,9 @@
 from utils.gpt_utils import call_gpt
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 import pandas as pd
+from utils.common import normalize_text
 
 AUDIT_SYSTEM_PROMPT = """
 Bạn là chuyên gia kiểm định dữ liệu cho bộ dữ liệu huấn luyện
@@ -29,13 +32,11 @@ SCORE: 0-100 (mức độ phù hợp để huấn luyện)
 NOTE: ghi chú ngắn, tiếng Việt.
 """
 
-from utils.gpt_utils import client
+from utils.gpt_utils import chat_completion
+from utils.openai_client import get_async_client
 
-def audit_one_segment(video_id: str, clip_id: str, text: str, content_label: str, quality_level: str, thesis_score: int, duration: float) -> tuple:
-    if not text or not text.strip():
-        return "REMOVE", 0, "Câu trống."
-
-    user_prompt = f"""
+def _audit_user(video_id: str, clip_id: str, text: str, content_label: str, quality_level: str, thesis_score: int, duration: float) -> str:
+    return f"""
 VIDEO_ID: {video_id}
 CLIP_ID: {clip_id}
 DURATION: {duration}
@@ -48,17 +49,9 @@ TEXT:
 
 Hãy trả về đúng format: FLAG|SCORE|NOTE
 """
-    
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": AUDIT_SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.0
-    )
-    
-    raw = response.choices[0].message.content.strip()
+
+def parse_audit_response(raw: str) -> tuple:
+    raw = raw.strip()
     flag = "OK"
     score = 70
     note = ""
@@ -84,6 +77,31 @@ Hãy trả về đúng format: FLAG|SCORE|NOTE
     
     return flag, score, note
 
+def audit_one_segment(video_id: str, clip_id: str, text: str, content_label: str, quality_level: str, thesis_score: int, duration: float) -> tuple:
+    if not text or not text.strip():
+        return "REMOVE", 0, "Câu trống."
+
+    user_prompt = _audit_user(video_id, clip_id, text, content_label, quality_level, thesis_score, duration)
+    
+    raw = chat_completion(AUDIT_SYSTEM_PROMPT, user_prompt, model=Config.OPENAI_MODEL, temperature=0.0)
+    return parse_audit_response(raw)
+
+async def aaudit_one_segment(video_id: str, clip_id: str, text: str, content_label: str, quality_level: str, thesis_score: int, duration: float) -> tuple:
+    if not text or not text.strip():
+        return "REMOVE", 0, "Câu trống."
+    raw = await get_async_client().chat(
+        AUDIT_SYSTEM_PROMPT,
+        _audit_user(video_id, clip_id, text, content_label, quality_level, thesis_score, duration),
+        model=Config.OPENAI_MODEL, temperature=0.0)
+    return parse_audit_response(raw)
+
+def audit_segments(rows: list[dict]) -> list[tuple]:
+    """
+    Audit many segments concurrently, results in input order.
+    rows: dicts with the keyword arguments of audit_one_segment
+    """
+    return get_async_client().map(lambda row: aaudit_one_segment(**row), rows)
+
 DEDUP_SYSTEM_PROMPT = """
 Bạn là chuyên gia xử lý dữ liệu thời tiết VTV.
 Bạn được đưa 2 câu thoại A và B thuộc cùng timestamp.
@@ -98,8 +116,8 @@ KEEP_B    → nếu B tốt hơn
 Không giải thích, không bình luận.
 """
 
-def ask_agent_dedup(text_a: str, text_b: str) -> str:
-    user_prompt = f"""
+def _dedup_user(text_a: str, text_b: str) -> str:
+    return f"""
 CÂU A:
 {text_a}
 
@@ -108,56 +126,144 @@ CÂU B:
 
 Hãy chọn KEEP_A hoặc KEEP_B.
 """
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_MINI,
-        messages=[
-            {"role": "system", "content": DEDUP_SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.0
-    )
-    return response.choices[0].message.content.strip().upper()
-
-def detect_and_resolve_duplicates(df: pd.DataFrame) -> pd.DataFrame:
-    # Logic from stage4.ipynb: 
-    # Group by [video_id, start, end] -> filter len > 1 -> Group by again
-    
-    dup_groups = (
-        df.groupby(["video_id", "start", "end"])
-        .filter(lambda g: len(g) > 1)
-        .groupby(["video_id", "start", "end"])
-    )
-    
-    print(f"Số timestamp có ≥ 2 câu: {len(dup_groups)}")
-    
+
+def ask_agent_dedup(text_a: str, text_b: str) -> str:
+    user_prompt = _dedup_user(text_a, text_b)
+    out = chat_completion(DEDUP_SYSTEM_PROMPT, user_prompt, model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return out.upper()
+
+async def aask_agent_dedup(text_a: str, text_b: str) -> str:
+    out = await get_async_client().chat(
+        DEDUP_SYSTEM_PROMPT, _dedup_user(text_a, text_b), model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return out.upper()
+
+def local_dedup_decision(text_a: str, text_b: str, folded_a: str, folded_b: str):
+    """
+    Resolve a pair without the API when possible.
+    Returns KEEP_A / KEEP_B, or None if the pair is ambiguous.
+    """
+    if not folded_b:
+        return "KEEP_A"
+    if not folded_a:
+        return "KEEP_B"
+    if folded_a == folded_b:
+        # Same sentence modulo case/punctuation/diacritics: keep the better-formed one
+        return "KEEP_B" if len(text_b.strip()) > len(text_a.strip()) else "KEEP_A"
+    # Containment: the longer sentence carries everything the shorter one says.
+    # Compare whole words, so "lo" does not match inside "lon".
+    padded_a, padded_b = f" {' '.join(folded_a.split())} ", f" {' '.join(folded_b.split())} "
+    if padded_b in padded_a:
+        return "KEEP_A"
+    if padded_a in padded_b:
+        return "KEEP_B"
+    return None
+
+def _resolve_step(champion_idx: int, idx: int, decision: str, to_drop: list) -> int:
+    """Apply one pair decision. Returns the new champion."""
+    if decision == "KEEP_B":
+        to_drop.append(champion_idx)
+        return idx
+    # KEEP_A, or fallback: keep A
+    to_drop.append(idx)
+    return champion_idx
+
+def _resolve_group_locally(idxs: list, texts: dict, folded: dict, stats: dict, log: list):
+    """
+    Champion loop over one timestamp group while every pair resolves locally.
+    Returns (to_drop, champion, pos): pos is the position in idxs of the first
+    ambiguous member, or None if the whole group was resolved.
+    """
     to_drop = []
-    
-    for (vid, s, e), group in dup_groups:
-        idxs = list(group.index)
-        
-        # 'champion' strategy for group >= 2
-        champion_idx = idxs[0]
-        for idx in idxs[1:]:
-            text_A = df.loc[champion_idx, "text_final"]
-            text_B = df.loc[idx, "text_final"]
-            
-            decision = ask_agent_dedup(text_A, text_B)
-            
+    champion_idx = idxs[0]
+    for pos in range(1, len(idxs)):
+        idx = idxs[pos]
+        decision = local_dedup_decision(texts[champion_idx], texts[idx], folded[champion_idx], folded[idx])
+        if decision is None:
+            return to_drop, champion_idx, pos
+        stats["local"] += 1
+        log.append((texts[champion_idx], texts[idx], decision, "local"))
+        champion_idx = _resolve_step(champion_idx, idx, decision, to_drop)
+    return to_drop, champion_idx, None
+
+async def _aresolve_group(idxs: list, texts: dict, folded: dict, stats: dict, log: list,
+                          to_drop: list, champion_idx: int, start: int) -> list:
+    """Continue the champion loop from idxs[start], asking GPT for ambiguous pairs. Returns the indices to drop."""
+    for idx in idxs[start:]:
+        text_A, text_B = texts[champion_idx], texts[idx]
+        decision = local_dedup_decision(text_A, text_B, folded[champion_idx], folded[idx])
+        if decision is None:
+            decision = await aask_agent_dedup(text_A, text_B)
+            stats["gpt"] += 1
+            source = "agent"
+        else:
+            stats["local"] += 1
+            source = "local"
+        log.append((text_A, text_B, decision, source))
+        champion_idx = _resolve_step(champion_idx, idx, decision, to_drop)
+    return to_drop
+
+def _run_coroutine(coro):
+    """asyncio.run, or in a worker thread when the caller already runs an event loop (e.g. Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+def detect_and_resolve_duplicates(df: pd.DataFrame, verbose: bool = False) -> pd.DataFrame:
+    """
+    Keep one sentence per (video_id, start, end).
+    Exact, normalized (case/punctuation/diacritics) and containment duplicates are
+    resolved locally; only ambiguous pairs go to GPT, concurrently across groups.
+    """
+    keys = ["video_id", "start", "end"]
+    dup_mask = df.duplicated(keys, keep=False)
+    dups = df[dup_mask]
+    groups = dups.groupby(keys, sort=False).indices  # one pass: key -> positions in dups
+
+    print(f"Số timestamp có ≥ 2 câu: {len(groups)}")
+    if not groups:
+        df_clean = df.reset_index(drop=True)
+        df_clean['is_duplicate'] = False
+        return df_clean
+
+    texts = dups["text_final"].fillna("").astype(str)
+    folded = texts.map(lambda t: normalize_text(t, fold=True))
+    texts, folded = texts.to_dict(), folded.to_dict()
+
+    stats = {"local": 0, "gpt": 0}
+    logs = {key: [] for key in groups}
+
+    # Resolve locally first; only groups stuck on an ambiguous pair need the event loop
+    to_drop, pending = [], []
+    for key, pos in groups.items():
+        idxs = list(dups.index[pos])
+        group_drop, champion_idx, start = _resolve_group_locally(idxs, texts, folded, stats, logs[key])
+        if start is None:
+            to_drop.extend(group_drop)
+        else:
+            pending.append((key, idxs, group_drop, champion_idx, start))
+
+    if pending:
+        async def resolve_pending():
+            return await asyncio.gather(*(
+                _aresolve_group(idxs, texts, folded, stats, logs[key], group_drop, champion_idx, start)
+                for key, idxs, group_drop, champion_idx, start in pending
+            ))
+
+        to_drop += [idx for group_drop in _run_coroutine(resolve_pending()) for idx in group_drop]
+
+    if verbose:
+        for (vid, s, e), log in logs.items():
             print(f"\n====== DUP TIMESTAMP ======")
             print(f"VIDEO: {vid} | {s} → {e}")
-            print(f"A: {text_A}")
-            print(f"B: {text_B}")
-            print(f"Agent: {decision}")
-            
-            if decision == "KEEP_A":
-                to_drop.append(idx)
-            elif decision == "KEEP_B":
-                to_drop.append(champion_idx)
-                champion_idx = idx
-            else:
-                # fallback: keep A
-                to_drop.append(idx)
-                
+            for text_A, text_B, decision, source in log:
+                print(f"A: {text_A}")
+                print(f"B: {text_B}")
+                print(f"{source}: {decision}")
+    print(f"Resolved {stats['local'] + stats['gpt']} pairs: {stats['local']} locally, {stats['gpt']} by agent")
+
     df_clean = df.drop(to_drop).reset_index(drop=True)
     df_clean['is_duplicate'] = False # For compatibility if needed downstream, but we are dropping them here.
     
@@ -0,0 +1,541 @@
+"""
+Offline batch mode for the per-segment annotation prompts.
+
+    python utils/batch_jobs.py submit    # write pending requests to JSONL and submit them
+    python utils/batch_jobs.py collect   # poll, then merge finished results into clip_metadata.csv
+
+Every request carries a stable custom_id "<clip_id>:<task>", so resubmitting
+only adds what is still missing and results can be merged in any order.
+Tasks that depend on other outputs (score, audit; quality/classify/annotate
+when refine is in the same run) become pending once those columns are filled
+by an earlier collect. Requests whose prompt inputs are empty are not sent.
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import Config
+from utils.gpt_utils import REFINE_PROMPT_SYSTEM, QUALITY_PROMPT_SYSTEM, _refine_user, _quality_user, parse_quality_level
+from utils.classification import CLASSIFY_SYSTEM_PROMPT, SCORE_SYSTEM_PROMPT, _classify_user, _score_user, parse_content_label, parse_thesis_score
+from utils.audit import AUDIT_SYSTEM_PROMPT, _audit_user, parse_audit_response
+from utils.annotation import ANNOTATE_SYSTEM_PROMPT, ANNOTATION_FIELDS, _annotate_user, validate_annotation, annotation_complete
+from utils.llm_cache import get_llm_cache, chat_key
+
+# --- CONFIGURATION ---
+BASE_DIR = "/workspace/datdq/SignWeather"
+METADATA_DIR = f"{BASE_DIR}/data/metadata"
+CLIP_METADATA_CSV = f"{METADATA_DIR}/clip_metadata.csv"
+ASR_DIR = f"{BASE_DIR}/data/asr"                 # <original_video_id>/segments_whisper.csv and <id>_segments_final.csv
+BATCH_DIR = f"{METADATA_DIR}/batch_jobs"          # JSONL inputs/outputs and job state
+BATCH_BACKEND = "openai"                          # "openai" or "local"
+TASKS = ["refine", "quality", "classify", "score", "audit"]  # or ["refine", "annotate"] for the fused call
+POLL_INTERVAL = 60                                # Seconds between status checks
+MAX_REQUESTS_PER_FILE = 50000                     # OpenAI batch input limit
+
+def _text_final(row) -> str:
+    for col in ("text_final", "final_text", "text_refined", "text"):
+        if col in row and isinstance(row[col], str) and row[col].strip():
+            return row[col]
+    return ""
+
+def _text_raw(row) -> str:
+    for col in ("text_whisper", "text_raw", "text"):
+        if col in row and isinstance(row[col], str) and row[col].strip():
+            return row[col]
+    return ""
+
+def _text_input(row, ctx) -> str:
+    """Text the quality/classify/annotate prompts judge: the refine output when refine runs too."""
+    if ctx.get("after_refine"):
+        return row["text_refined"] if _filled(row, "text_refined") else ""
+    return _text_final(row)
+
+def _filled(row, col) -> bool:
+    return col in row and not pd.isna(row[col]) and str(row[col]).strip() != ""
+
+def _annotation_fields(row) -> list:
+    """Annotation fields still empty on the row (the ones an annotate request asks for)."""
+    return [f for f in ANNOTATION_FIELDS if not _filled(row, f)] or ANNOTATION_FIELDS
+
+# task -> prompt builder, parser and the columns it reads / writes
+TASK_SPECS = {
+    "refine": {
+        "system": REFINE_PROMPT_SYSTEM,
+        "model": Config.OPENAI_MODEL_MINI,
+        "temperature": 0.15,
+        "requires": [],
+        "outputs": ["text_refined"],
+        "inputs": lambda row, ctx: [_text_raw(row), ctx["transcripts"].get(row.get("original_video_id"), "")],
+        "user": lambda row, ctx: _refine_user(_text_raw(row), ctx["transcripts"].get(row.get("original_video_id"), "")),
+        "parse": lambda out: [out.strip()],
+    },
+    "quality": {
+        "system": QUALITY_PROMPT_SYSTEM,
+        "model": Config.OPENAI_MODEL_MINI,
+        "temperature": 0.0,
+        "requires": [],
+        "after": ["refine"],
+        "outputs": ["quality_level"],
+        "inputs": lambda row, ctx: [_text_raw(row), _text_input(row, ctx)],
+        "user": lambda row, ctx: _quality_user(_text_raw(row), _text_input(row, ctx)),
+        "parse": lambda out: [parse_quality_level(out)],
+    },
+    "classify": {
+        "system": CLASSIFY_SYSTEM_PROMPT,
+        "model": Config.OPENAI_MODEL_MINI,
+        "temperature": 0.0,
+        "requires": [],
+        "after": ["refine"],
+        "outputs": ["content_label"],
+        "inputs": lambda row, ctx: [_text_input(row, ctx)],
+        "user": lambda row, ctx: _classify_user(_text_input(row, ctx)),
+        "parse": lambda out: [parse_content_label(out)],
+    },
+    "score": {
+        "system": SCORE_SYSTEM_PROMPT,
+        "model": Config.OPENAI_MODEL_MINI,
+        "temperature": 0.0,
+        "requires": ["content_label", "quality_level"],
+        "outputs": ["thesis_score"],
+        "inputs": lambda row, ctx: [_text_final(row)],
+        "user": lambda row, ctx: _score_user(_text_final(row), row["content_label"], row["quality_level"],
+                                             float(row.get("duration", 0.0) or 0.0)),
+        "parse": lambda out: [parse_thesis_score(out)],
+    },
+    "audit": {
+        "system": AUDIT_SYSTEM_PROMPT,
+        "model": Config.OPENAI_MODEL,
+        "temperature": 0.0,
+        "requires": ["content_label", "quality_level", "thesis_score"],
+        "outputs": ["audit_flag", "audit_score", "audit_note"],
+        "inputs": lambda row, ctx: [_text_final(row)],
+        "user": lambda row, ctx: _audit_user(row.get("original_video_id", ""), row["clip_id"], _text_final(row),
+                                             row["content_label"], row["quality_level"], int(float(row["thesis_score"])),
+                                             float(row.get("duration", 0.0) or 0.0)),
+        "parse": lambda out: list(parse_audit_response(out)),
+    },
+    # Fused quality/classify/score/audit call (utils/annotation.py)
+    "annotate": {
+        "system": ANNOTATE_SYSTEM_PROMPT,
+        "model": Config.OPENAI_MODEL_MINI,
+        "temperature": 0.0,
+        "params": {"response_format": {"type": "json_object"}},
+        "requires": [],
+        "after": ["refine"],
+        "outputs": ANNOTATION_FIELDS,
+        "inputs": lambda row, ctx: [_text_raw(row), _text_input(row, ctx)],
+        "user": lambda row, ctx: _annotate_user(_text_raw(row), _text_input(row, ctx),
+                                                float(row.get("duration", 0.0) or 0.0), _annotation_fields(row)),
+        # Invalid or absent fields stay empty (None is not merged) and are re-requested on the next submit
+        "parse": lambda out: [validate_annotation(out)[0].get(f) for f in ANNOTATION_FIELDS],
+        "validate": lambda out, row: annotation_complete(out, _annotation_fields(row)),
+    },
+}
+
+def make_custom_id(clip_id: str, task: str) -> str:
+    return f"{clip_id}:{task}"
+
+def parse_custom_id(custom_id: str) -> tuple:
+    clip_id, task = custom_id.rsplit(":", 1)
+    return clip_id, task
+
+def clip_segment_id(clip_id: str) -> int:
+    """'v000_c012' -> 12, the segment_id of the clip in <id>_segments_final.csv"""
+    return int(str(clip_id).rsplit("_c", 1)[1])
+
+def load_transcripts(asr_dir=ASR_DIR) -> dict:
+    """original_video_id -> full Whisper transcript (for the refine task)."""
+    transcripts = {}
+    for path in Path(asr_dir).glob("*/segments_whisper.csv"):
+        try:
+            seg = pd.read_csv(path).sort_values("start")
+        except (OSError, ValueError, KeyError):
+            continue
+        text = " ".join(t.strip() for t in seg["text"].dropna().astype(str) if t.strip())
+        if text:
+            transcripts[path.parent.name] = text
+    return transcripts
+
+def attach_whisper_text(df: pd.DataFrame, asr_dir=ASR_DIR) -> pd.DataFrame:
+    """
+    Fill a text_whisper column from data/asr/<id>/<id>_segments_final.csv
+    (clip c### is segment_id ###). Rows without an ASR file keep an empty value.
+    """
+    if "original_video_id" not in df.columns:
+        return df
+    texts = {}
+    for video_id in df["original_video_id"].dropna().unique():
+        path = Path(asr_dir) / video_id / f"{video_id}_segments_final.csv"
+        if not path.exists():
+            continue
+        seg = pd.read_csv(path)
+        for segment_id, text in zip(seg["segment_id"], seg["text_whisper"]):
+            texts[(video_id, int(segment_id))] = text
+    df = df.copy()
+    whisper = [texts.get((vid, clip_segment_id(cid))) for vid, cid in zip(df["original_video_id"], df["clip_id"])]
+    if "text_whisper" in df.columns:
+        df["text_whisper"] = df["text_whisper"].where(df["text_whisper"].notna(), pd.Series(whisper, index=df.index))
+    else:
+        df["text_whisper"] = whisper
+    return df
+
+def build_requests(df: pd.DataFrame, tasks=TASKS, transcripts: dict = None) -> tuple:
+    """
+    Collect every pending (clip, task) request.
+
+    Returns:
+        requests: list of batch-API request dicts
+        cached: {custom_id: response text} for requests already in the LLM cache
+        skipped: {task: count} of requests not built because a prompt input was empty
+    """
+    cache = get_llm_cache()
+    ctx = {"transcripts": transcripts or {}, "after_refine": "refine" in tasks}
+    requests, cached = [], {}
+    skipped = {task: 0 for task in tasks}
+
+    for _, row in df.iterrows():
+        row = row.to_dict()
+        for task in tasks:
+            spec = TASK_SPECS[task]
+            if all(_filled(row, col) for col in spec["outputs"]):
+                continue
+            # Outputs of earlier tasks in this run must be merged first
+            requires = spec["requires"] + [col for dep in spec.get("after", []) if dep in tasks
+                                           for col in TASK_SPECS[dep]["outputs"]]
+            if not all(_filled(row, col) for col in requires):
+                continue
+            if not all(str(text).strip() for text in spec["inputs"](row, ctx)):
+                skipped[task] += 1
+                continue
+
+            custom_id = make_custom_id(row["clip_id"], task)
+            user = spec["user"](row, ctx)
+            params = spec.get("params", {})
+            hit = cache.get(chat_key(spec["model"], spec["system"], user, spec["temperature"], **params)) if cache.mode != "cache_only" else None
+            if hit is not None and ("validate" not in spec or spec["validate"](hit, row)):
+                cached[custom_id] = hit
+                continue
+
+            requests.append({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": spec["model"],
+                    "messages": [
+                        {"role": "system", "content": spec["system"]},
+                        {"role": "user", "content": user}
+                    ],
+                    "temperature": spec["temperature"],
+                    **params,
+                },
+            })
+    return requests, cached, skipped
+
+def write_jsonl(records, path) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+def read_jsonl(path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# --- BACKENDS ---
+
+class OpenAIBatchBackend:
+    """Submits through the OpenAI Batch API (files + batches endpoints)."""
+
+    def __init__(self, client=None):
+        if client is None:
+            from utils.gpt_utils import client
+        if not hasattr(client, "batches"):
+            raise RuntimeError("The installed openai package has no Batch API support; upgrade openai or use BATCH_BACKEND='local'.")
+        self.client = client
+
+    def submit(self, jsonl_path) -> str:
+        with open(jsonl_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        """One of: validating, in_progress, finalizing, completed, failed, expired, cancelled."""
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> list:
+        batch = self.client.batches.retrieve(batch_id)
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = self.client.files.content(file_id).text
+                records.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        return records
+
+def chat_responder(body: dict) -> str:
+    """LocalBatchBackend responder that sends each request through the (cached) live chat_completion."""
+    from utils.gpt_utils import chat_completion
+    messages = {m["role"]: m["content"] for m in body["messages"]}
+    params = {k: v for k, v in body.items() if k not in ("model", "messages", "temperature")}
+    return chat_completion(messages["system"], messages["user"], model=body["model"],
+                           temperature=body.get("temperature", 0.0), **params)
+
+class LocalBatchBackend:
+    """
+    File-based stand-in with the same interface, for tests and small runs.
+    Jobs are processed on the first status() call after submit.
+
+    Args:
+        responder: fn(request_body) -> assistant content. Required, so a test
+                   run never reaches the API by accident; pass chat_responder
+                   to make live (cached) calls.
+        work_dir: Directory holding <batch_id>/input.jsonl and output.jsonl
+    """
+
+    def __init__(self, responder, work_dir=BATCH_DIR):
+        if responder is None:
+            raise ValueError("LocalBatchBackend needs an explicit responder (e.g. chat_responder)")
+        self.work_dir = Path(work_dir)
+        self.responder = responder
+
+    def submit(self, jsonl_path) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        job_dir = self.work_dir / batch_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(jsonl_path, job_dir / "input.jsonl")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        job_dir = self.work_dir / batch_id
+        if not (job_dir / "input.jsonl").exists():
+            return "failed"
+        if not (job_dir / "output.jsonl").exists():
+            self._process(job_dir)
+        return "completed"
+
+    def _process(self, job_dir: Path) -> None:
+        out = []
+        for i, req in enumerate(read_jsonl(job_dir / "input.jsonl")):
+            try:
+                content = self.responder(req["body"])
+                out.append({
+                    "id": f"local_req_{i}",
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": 200, "body": {
+                        "model": req["body"]["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    }},
+                    "error": None,
+                })
+            except Exception as e:
+                out.append({"id": f"local_req_{i}", "custom_id": req["custom_id"], "response": None,
+                            "error": {"code": type(e).__name__, "message": str(e)}})
+        write_jsonl(out, job_dir / "output.jsonl")
+
+    def results(self, batch_id: str) -> list:
+        return read_jsonl(self.work_dir / batch_id / "output.jsonl")
+
+def get_backend(name=BATCH_BACKEND, responder=None):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(responder)
+    raise ValueError(f"Unknown batch backend: {name}")
+
+# --- SUBMIT / COLLECT ---
+
+def _state_path(batch_dir=BATCH_DIR) -> Path:
+    return Path(batch_dir) / "jobs.json"
+
+def load_jobs(batch_dir=BATCH_DIR) -> list:
+    path = _state_path(batch_dir)
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_jobs(jobs, batch_dir=BATCH_DIR) -> None:
+    path = _state_path(batch_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(tmp_path, path)
+
+def submit_pending(backend, csv_path=CLIP_METADATA_CSV, tasks=TASKS, batch_dir=BATCH_DIR) -> list:
+    """
+    Serialize pending requests (excluding ones already submitted and not yet
+    collected) and submit them. Cache hits are merged into the CSV right away.
+
+    Returns:
+        Newly created job records
+    """
+    df = attach_whisper_text(pd.read_csv(csv_path))
+    requests, cached, skipped = build_requests(df, tasks, load_transcripts())
+    for task, count in skipped.items():
+        if count:
+            print(f"Skipped {count} {task} requests with an empty input (missing ASR text or transcript)")
+
+    if cached:
+        merge_results(csv_path, cached)
+        print(f"Merged {len(cached)} responses from the LLM cache")
+
+    jobs = load_jobs(batch_dir)
+    in_flight = {cid for job in jobs if job["state"] == "submitted" for cid in job["custom_ids"]}
+    requests = [r for r in requests if r["custom_id"] not in in_flight]
+    if not requests:
+        print("No pending requests.")
+        return []
+
+    new_jobs = []
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    for part, i in enumerate(range(0, len(requests), MAX_REQUESTS_PER_FILE)):
+        chunk = requests[i:i + MAX_REQUESTS_PER_FILE]
+        jsonl_path = Path(batch_dir) / f"requests_{stamp}_{part:03d}.jsonl"
+        write_jsonl(chunk, jsonl_path)
+        batch_id = backend.submit(jsonl_path)
+        new_jobs.append({
+            "batch_id": batch_id,
+            "input": str(jsonl_path),
+            "custom_ids": [r["custom_id"] for r in chunk],
+            "submitted_at": time.time(),
+            "state": "submitted",
+        })
+        print(f"Submitted {len(chunk)} requests as {batch_id}")
+
+    save_jobs(jobs + new_jobs, batch_dir)
+    return new_jobs
+
+def parse_batch_record(record: dict):
+    """Assistant content of one output line, or None if the request failed."""
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"].strip()
+    except (KeyError, IndexError, TypeError):
+        return None
+
+def merge_results(csv_path, responses: dict) -> int:
+    """
+    Write {custom_id: content} into the CSV columns of each task.
+
+    Returns:
+        Number of (clip, task) results merged
+    """
+    df = pd.read_csv(csv_path)
+    row_of = {cid: i for i, cid in enumerate(df["clip_id"])}
+    # Object dtype once per output column, not once per merged value
+    tasks = {parse_custom_id(cid)[1] for cid in responses}
+    for col in dict.fromkeys(c for t in tasks if t in TASK_SPECS for c in TASK_SPECS[t]["outputs"]):
+        df[col] = df[col].astype(object) if col in df.columns else pd.Series([None] * len(df), dtype=object)
+
+    merged = 0
+    for custom_id, content in responses.items():
+        clip_id, task = parse_custom_id(custom_id)
+        if clip_id not in row_of or task not in TASK_SPECS:
+            continue
+        spec = TASK_SPECS[task]
+        for col, value in zip(spec["outputs"], spec["parse"](content)):
+            if value is not None:
+                df.at[row_of[clip_id], col] = value
+        merged += 1
+
+    tmp_path = f"{csv_path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, csv_path)
+    return merged
+
+def _cache_response(record: dict, content: str, requests_by_id: dict, rows: dict) -> None:
+    """
+    Store a batch result in the LLM cache so interactive reruns reuse it.
+    Responses the task's validate rejects are not stored (rows: clip_id -> CSV row before the merge).
+    """
+    req = requests_by_id.get(record["custom_id"])
+    if req is None:
+        return
+    clip_id, task = parse_custom_id(record["custom_id"])
+    spec = TASK_SPECS.get(task, {})
+    if "validate" in spec and not spec["validate"](content, rows.get(clip_id, {})):
+        return
+    body = req["body"]
+    messages = {m["role"]: m["content"] for m in body["messages"]}
+    params = {k: v for k, v in body.items() if k not in ("model", "messages", "temperature")}
+    key = chat_key(body["model"], messages["system"], messages["user"], body.get("temperature", 0.0), **params)
+    get_llm_cache().put(key, content, kind="chat")
+
+def collect(backend, csv_path=CLIP_METADATA_CSV, batch_dir=BATCH_DIR, wait=True, poll_interval=POLL_INTERVAL) -> dict:
+    """
+    Poll submitted jobs and merge finished ones into the CSV.
+
+    Returns:
+        Counts: merged, failed, pending jobs
+    """
+    jobs = load_jobs(batch_dir)
+    summary = {"merged": 0, "failed": 0, "pending_jobs": 0}
+
+    while True:
+        pending = [job for job in jobs if job["state"] == "submitted"]
+        for job in pending:
+            status = backend.status(job["batch_id"])
+            if status in ("failed", "expired", "cancelled"):
+                job["state"] = status
+                print(f"{job['batch_id']}: {status}")
+                continue
+            if status != "completed":
+                continue
+
+            requests_by_id = {r["custom_id"]: r for r in read_jsonl(job["input"])}
+            rows = {r["clip_id"]: r for r in pd.read_csv(csv_path).to_dict("records")}
+            responses = {}
+            for record in backend.results(job["batch_id"]):
+                content = parse_batch_record(record)
+                if content is None:
+                    summary["failed"] += 1
+                    continue
+                responses[record["custom_id"]] = content
+                _cache_response(record, content, requests_by_id, rows)
+
+            merged = merge_results(csv_path, responses)
+            summary["merged"] += merged
+            job["state"] = "collected"
+            job["collected_at"] = time.time()
+            print(f"{job['batch_id']}: merged {merged}/{len(job['custom_ids'])} results")
+        save_jobs(jobs, batch_dir)
+
+        still_pending = [job for job in jobs if job["state"] == "submitted"]
+        summary["pending_jobs"] = len(still_pending)
+        if not still_pending or not wait:
+            return summary
+        time.sleep(poll_interval)
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("submit", "collect"):
+        print("Usage: python utils/batch_jobs.py submit|collect")
+        return
+
+    backend = get_backend()
+    if sys.argv[1] == "submit":
+        submit_pending(backend)
+    else:
+        summary = collect(backend)
+        print(f"Merged: {summary['merged']}, failed: {summary['failed']}, pending jobs: {summary['pending_jobs']}")
+        print("Run 'submit' again to queue tasks that became ready (score, audit) or failed requests.")
+
+if __name__ == "__main__":
+    main()
@@ -33,30 +33,42 @@ Hãy cho điểm từ 0 đến 100 dựa trên:
 Chỉ trả về MỘT số nguyên từ 0 đến 100.
 """
 
-from utils.gpt_utils import client
+from utils.gpt_utils import chat_completion
+from utils.openai_client import get_async_client
 
-def classify_weather_segment(text: str) -> str:
-    text = (text or "").strip()
-    if not text:
-        return "NON_WEATHER"
+def _classify_user(text: str) -> str:
+    return f"Văn bản:\n{text}\n\nPhân loại:"
 
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_MINI,
-        messages=[
-            {"role": "system", "content": CLASSIFY_SYSTEM_PROMPT},
-            {"role": "user", "content": f"Văn bản:\n{text}\n\nPhân loại:"}
-        ],
-        temperature=0.0
-    )
-    out = response.choices[0].message.content.strip().upper()
+def parse_content_label(out: str) -> str:
+    out = out.strip().upper()
     if "WEATHER_CORE" in out:
         return "WEATHER_CORE"
     if "WEATHER_SUPPORT" in out:
         return "WEATHER_SUPPORT"
     return "NON_WEATHER"
 
-def score_segment_for_thesis(text: str, content_label: str, quality_level: str = "MEDIUM", duration: float = 0.0) -> int:
-    user = f"""
+def classify_weather_segment(text: str) -> str:
+    text = (text or "").strip()
+    if not text:
+        return "NON_WEATHER"
+
+    out = chat_completion(CLASSIFY_SYSTEM_PROMPT, _classify_user(text), model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_content_label(out)
+
+async def aclassify_weather_segment(text: str) -> str:
+    text = (text or "").strip()
+    if not text:
+        return "NON_WEATHER"
+    out = await get_async_client().chat(
+        CLASSIFY_SYSTEM_PROMPT, _classify_user(text), model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_content_label(out)
+
+def classify_weather_segments(texts: list[str]) -> list[str]:
+    """Classify many segments concurrently, results in input order."""
+    return get_async_client().map(aclassify_weather_segment, texts)
+
+def _score_user(text: str, content_label: str, quality_level: str, duration: float) -> str:
+    return f"""
 TEXT_FINAL: {text}
 content_label: {content_label}
 quality_level: {quality_level}
@@ -64,18 +76,29 @@ duration_seconds: {duration:.2f}
 
 Cho điểm 0–100 (chỉ 1 số).
 """
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_MINI,
-        messages=[
-            {"role": "system", "content": SCORE_SYSTEM_PROMPT},
-            {"role": "user", "content": user}
-        ],
-        temperature=0.0
-    )
-    raw = response.choices[0].message.content.strip()
-    digits = "".join(ch for ch in raw if ch.isdigit())
+
+def parse_thesis_score(raw: str) -> int:
+    digits = "".join(ch for ch in raw.strip() if ch.isdigit())
     try:
         score = int(digits)
         return max(0, min(100, score))
     except Exception:
         return 50
+
+def score_segment_for_thesis(text: str, content_label: str, quality_level: str = "MEDIUM", duration: float = 0.0) -> int:
+    user = _score_user(text, content_label, quality_level, duration)
+    raw = chat_completion(SCORE_SYSTEM_PROMPT, user, model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_thesis_score(raw)
+
+async def ascore_segment_for_thesis(text: str, content_label: str, quality_level: str = "MEDIUM", duration: float = 0.0) -> int:
+    raw = await get_async_client().chat(
+        SCORE_SYSTEM_PROMPT, _score_user(text, content_label, quality_level, duration),
+        model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_thesis_score(raw)
+
+def score_segments_for_thesis(rows: list[dict]) -> list[int]:
+    """
+    Score many segments concurrently.
+    rows: dicts with keys text, content_label and optionally quality_level, duration
+    """
+    return get_async_client().map(lambda row: ascore_segment_for_thesis(**row), rows)
@@ -1,9 +1,14 @@
+import re
 import subprocess
+import unicodedata
 from pathlib import Path
 from typing import Optional
 
+from utils.profiling import span
+
 def run_cmd(cmd: list[str]) -> None:
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    with span(f"subprocess.{Path(cmd[0]).name}"):
+        result = subprocess.run(cmd, capture_output=True, text=True)
     if result.returncode != 0:
         raise RuntimeError(f"Command failed: {' '.join(cmd)}\n{result.stderr}")
     return result
@@ -19,7 +24,29 @@ def get_file_size(file_path: Path) -> int:
         return 0
     return file_path.stat().st_size
 
-def normalize_text(text: str) -> str:
+def normalize_text(text: str, fold: bool = False) -> str:
+    """
+    Collapse whitespace. With fold=True also lowercase, drop punctuation and
+    remove Vietnamese diacritics ("Mưa lớn!" -> "mua lon") for duplicate matching.
+    """
     text = text.strip()
+    if fold:
+        text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+        text = "".join(
+            ch if unicodedata.category(ch)[0] in ("L", "N") else " "
+            for ch in text
+            if unicodedata.category(ch) != "Mn"
+        )
     text = ' '.join(text.split())
     return text
+
+def parse_video_id(url: str) -> Optional[str]:
+    patterns = [
+        r'(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)',
+        r'youtube\.com/embed/([a-zA-Z0-9_-]+)',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
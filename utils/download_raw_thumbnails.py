@@ -1,6 +1,8 @@
-
+import csv
 import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
@@ -8,71 +10,128 @@ from tqdm import tqdm
 # --- CONFIGURATION ---
 INPUT_FILE = "/workspace/datdq/SignWeather/data_collection/ids_2020_2024.txt"
 OUTPUT_DIR = "/workspace/datdq/SignWeather/data/raw/thumbnails/origin"
+FAILURE_MANIFEST = "/workspace/datdq/SignWeather/data/raw/thumbnails/failed_ids.csv"
+BASE_URL = "https://img.youtube.com/vi"  # Point at a local server for testing
+THUMBNAIL_NAMES = ["maxresdefault.jpg", "hqdefault.jpg"]  # Tried in order
 MAX_WORKERS = 50  # High concurrency for I/O
+MIN_THUMBNAIL_BYTES = 2000  # YouTube's "no thumbnail" placeholder is ~1 KB
+TIMEOUT = 5
+CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+def get_session():
+    """One keep-alive Session per worker thread, so connections to the host are reused."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
 
-def download_single(video_id):
+def _too_small(resp):
+    length = resp.headers.get("Content-Length")
+    return length is not None and int(length) < MIN_THUMBNAIL_BYTES
+
+def download_single(video_id, output_dir, base_url=BASE_URL):
     """
     Downloads thumbnail for a video_id. Tries maxresdefault first, then hqdefault.
-    Returns (video_id, content_bytes, success_boolean)
+    A candidate is rejected from its status and Content-Length before the body
+    is read; accepted bodies are streamed to <id>.jpg.part and renamed.
+    Returns (video_id, status, detail) with status in "ok", "skipped", "failed"
     """
-    urls = [
-        f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg",
-        f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-    ]
-    
-    for url in urls:
+    save_path = Path(output_dir) / f"{video_id}.jpg"
+    if save_path.exists() and save_path.stat().st_size >= MIN_THUMBNAIL_BYTES:
+        return video_id, "skipped", str(save_path)
+
+    tmp_path = save_path.with_name(save_path.name + ".part")
+    session = get_session()
+    reasons = []
+
+    for name in THUMBNAIL_NAMES:
+        url = f"{base_url}/{video_id}/{name}"
         try:
-            resp = requests.get(url, timeout=5)
-            if resp.status_code == 200:
-                return video_id, resp.content, True
-        except Exception:
+            with session.get(url, timeout=TIMEOUT, stream=True) as resp:
+                if resp.status_code != 200:
+                    reasons.append(f"{name}:{resp.status_code}")
+                    continue
+                if _too_small(resp):
+                    reasons.append(f"{name}:placeholder")
+                    continue
+
+                written = 0
+                with open(tmp_path, "wb") as f_out:
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        f_out.write(chunk)
+                        written += len(chunk)
+
+            if written < MIN_THUMBNAIL_BYTES:
+                reasons.append(f"{name}:placeholder")
+                tmp_path.unlink(missing_ok=True)
+                continue
+            os.replace(tmp_path, save_path)
+            return video_id, "ok", name
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            reasons.append(f"{name}:{type(e).__name__}")
             continue
-            
-    return video_id, None, False
+
+    return video_id, "failed", ";".join(reasons)
+
+def write_failure_manifest(failures, manifest_path=FAILURE_MANIFEST):
+    """failures: list of (video_id, reason). Overwritten on every run, so it lists current failures only."""
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["video_id", "reason"])
+        writer.writerows(sorted(failures))
+
+def download_thumbnails(video_ids, output_dir, base_url=BASE_URL, max_workers=MAX_WORKERS,
+                        manifest_path=FAILURE_MANIFEST):
+    """
+    Returns:
+        Counts per status ("ok", "skipped", "failed")
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    counts = {"ok": 0, "skipped": 0, "failed": 0}
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download_single, vid, output_dir, base_url) for vid in video_ids]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
+            vid, status, detail = future.result()
+            counts[status] += 1
+            if status == "failed":
+                failures.append((vid, detail))
+
+    write_failure_manifest(failures, manifest_path)
+    return counts
 
 def main():
     input_path = Path(INPUT_FILE)
     output_dir = Path(OUTPUT_DIR)
-    
-    # Create output directory
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
+
     if not input_path.exists():
         print(f"Error: Input file not found at {input_path}")
         return
 
     # Read IDs
     with open(input_path, 'r') as f:
-        video_ids = [line.strip() for line in f if line.strip()]
-        
+        video_ids = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
     print(f"Loaded {len(video_ids)} IDs.")
     print(f"Downloading images to: {output_dir}")
-    
-    success_count = 0
-    fail_count = 0
-    
-    # Use ThreadPool for fast parallel downloading
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_vid = {executor.submit(download_single, vid): vid for vid in video_ids}
-        
-        for future in tqdm(as_completed(future_to_vid), total=len(video_ids), desc="Downloading"):
-            vid, content, success = future.result()
-            
-            if success and content:
-                try:
-                    save_path = output_dir / f"{vid}.jpg"
-                    with open(save_path, "wb") as f_out:
-                        f_out.write(content)
-                    success_count += 1
-                except Exception as e:
-                    print(f"Error saving {vid}: {e}")
-                    fail_count += 1
-            else:
-                fail_count += 1
-                
+
+    counts = download_thumbnails(video_ids, output_dir)
+
     print(f"\nDownload Completed.")
-    print(f"Success: {success_count}")
-    print(f"Failed: {fail_count}")
+    print(f"Success: {counts['ok']}")
+    print(f"Skipped (already downloaded): {counts['skipped']}")
+    print(f"Failed: {counts['failed']} (see {FAILURE_MANIFEST})")
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,20 @@
+import io
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from utils.common import run_cmd, ensure_dir_exists
 from config import Config
 
+# Speech codecs for ASR upload: codec -> (encoder args, muxer, file suffix)
+# ~24-32 kbps instead of 256 kbps for 16 kHz mono PCM
+AUDIO_CODECS = {
+    "opus": (["-c:a", "libopus", "-b:a", "24k", "-application", "voip"], "ogg", ".ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "32k"], "mp3", ".mp3"),
+}
+
 def extract_audio_to_wav(video_path: Path, audio_path: Path) -> None:
     ensure_dir_exists(audio_path.parent)
     
@@ -18,6 +31,106 @@ def extract_audio_to_wav(video_path: Path, audio_path: Path) -> None:
     print(f"Extracting audio: {video_path.name} -> {audio_path.name}")
     run_cmd(cmd)
 
+def stream_audio(video_path: Path, sink, codec: str = "opus", chunk_size: int = 1 << 16) -> int:
+    """
+    Encode the audio track with a speech codec and write ffmpeg's stdout to sink
+    (a binary file object) chunk by chunk. Output is bit-exact so it can be content-hashed.
+
+    Returns:
+        Number of bytes written. Raises RuntimeError with ffmpeg's stderr on failure.
+    """
+    codec_args, muxer, _ = AUDIO_CODECS[codec]
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", str(video_path),
+        "-vn", "-map_metadata", "-1",
+        "-ac", str(Config.AUDIO_CHANNELS),
+        "-ar", str(Config.AUDIO_SAMPLE_RATE),
+        *codec_args,
+        "-fflags", "+bitexact", "-flags:a", "+bitexact",
+        "-f", muxer, "pipe:1"
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Drain stderr on the side so a chatty ffmpeg cannot block on a full pipe
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+    written = 0
+    try:
+        for chunk in iter(lambda: proc.stdout.read(chunk_size), b""):
+            sink.write(chunk)
+            written += len(chunk)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        stderr_reader.join()
+    if returncode != 0 or not written:
+        stderr = b"".join(stderr_chunks).decode(errors="replace")
+        raise RuntimeError(f"Command failed ({returncode}): {' '.join(cmd)}\n{stderr}")
+    return written
+
+def encode_audio_bytes(video_path: Path, codec: str = "opus") -> bytes:
+    """Encoded audio track as bytes, without writing anything to disk (see stream_audio)."""
+    buf = io.BytesIO()
+    stream_audio(video_path, buf, codec)
+    return buf.getvalue()
+
+def extract_audio_compressed(video_path: Path, codec: str = "opus", cache_dir: Path = None) -> tuple:
+    """
+    Compressed audio for upload, optionally cached on disk as <cache_dir>/<stem><suffix>.
+    With a cache_dir the encoder output is streamed straight into the cache file.
+
+    Returns:
+        (file name for the upload, encoded bytes)
+    """
+    name = f"{Path(video_path).stem}{AUDIO_CODECS[codec][2]}"
+    if cache_dir is None:
+        return name, encode_audio_bytes(video_path, codec)
+
+    cache_path = Path(cache_dir) / name
+    if not (cache_path.exists() and cache_path.stat().st_mtime >= Path(video_path).stat().st_mtime):
+        ensure_dir_exists(Path(cache_dir))
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                stream_audio(video_path, f, codec)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, cache_path)
+    return name, cache_path.read_bytes()
+
+def _extract_one(video_path: Path, out_dir: Path, codec: str) -> dict:
+    t0 = time.perf_counter()
+    name, data = extract_audio_compressed(video_path, codec, cache_dir=out_dir)
+    return {"video": Path(video_path).name, "audio": name, "bytes": len(data), "seconds": time.perf_counter() - t0}
+
+def extract_audio_batch(video_paths: list, out_dir: Path, codec: str = "opus", max_workers: int = None) -> list:
+    """
+    Extract compressed audio for many videos in a bounded process pool
+    (ffmpeg is single-threaded for these codecs). Already cached files are skipped.
+
+    Returns:
+        Per-video results (failures carry an 'error' key)
+    """
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    results = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_extract_one, Path(p), Path(out_dir), codec): p for p in video_paths}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"video": Path(futures[future]).name, "error": str(e)})
+                print(f"Error extracting audio from {Path(futures[future]).name}: {e}")
+
+    ok = [r for r in results if "error" not in r]
+    total_mb = sum(r["bytes"] for r in ok) / 1e6
+    print(f"Extracted {len(ok)}/{len(results)} audio files ({codec}, {total_mb:.1f} MB) "
+          f"in {time.perf_counter() - t0:.1f}s with {max_workers} workers")
+    return results
+
 def cut_video_segment(video_path: Path, start: float, end: float, output_path: Path) -> None:
     ensure_dir_exists(output_path.parent)
     
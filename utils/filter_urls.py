@@ -2,6 +2,8 @@
 import os
 import sys
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
@@ -18,6 +20,101 @@ from inference import SignerClassifier
 INPUT_ID_FILE = "/workspace/datdq/SignWeather/data_collection/ids_2020_2024.txt"
 OUTPUT_FILE = "/workspace/datdq/SignWeather/data/lists/vtv_weather_filtered.txt"
 LOCAL_THUMB_DIR = Path("/workspace/datdq/SignWeather/data/raw/thumbnails/origin")
+CHECKPOINT_FILE = "/workspace/datdq/SignWeather/data/lists/vtv_weather_filtered.done.txt"  # IDs already classified
+
+SCAN_MODE = "batched"   # "batched" or "sequential" (one image at a time in the main thread)
+RESUME = True           # Skip IDs in CHECKPOINT_FILE and append to OUTPUT_FILE (truncated anyway if there is no checkpoint)
+BATCH_SIZE = 64
+DECODE_WORKERS = 8
+PREFETCH_BATCHES = 2    # Batches decoded ahead of the one being classified
+DRAFT_SIZE = None       # e.g. (320, 180): let libjpeg decode at a reduced scale >= this size
+
+def load_image(img_path, draft_size=DRAFT_SIZE):
+    """Fully decoded RGB image (decoding happens here, in the worker), or None."""
+    try:
+        img = Image.open(img_path)
+        if draft_size is not None:
+            img.draft("RGB", draft_size)
+        img.load()
+        return img.convert("RGB")
+    except Exception:
+        return None
+
+def iter_decoded_batches(items, batch_size=BATCH_SIZE, workers=DECODE_WORKERS, prefetch=PREFETCH_BATCHES):
+    """
+    items: list of (video_id, img_path)
+    Yields lists of (video_id, image or None) in input order, with up to
+    `prefetch` further batches being decoded in the pool meanwhile.
+    """
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) <= prefetch:
+                batch = batches[next_batch]
+                pending.append([(vid, pool.submit(load_image, path)) for vid, path in batch])
+                next_batch += 1
+            yield [(vid, future.result()) for vid, future in pending.popleft()]
+
+def predict_batch(classifier, images):
+    """Use the classifier's batch API when it has one, else predict image by image."""
+    batch_fn = getattr(classifier, "predict_batch", None)
+    if batch_fn is not None:
+        return list(batch_fn(images))
+    return [classifier.predict(img) for img in images]
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+def scan_batched(classifier, video_ids, output_path, checkpoint_path=CHECKPOINT_FILE, resume=RESUME):
+    """
+    Decode in a worker pool, classify fixed-size batches and append results in
+    input order. Every classified ID (positive or not) is appended to the
+    checkpoint after its batch's results are written.
+    """
+    # Without a checkpoint nothing in the output is accounted for: start it over
+    # rather than append every positive a second time
+    resume = resume and os.path.exists(checkpoint_path)
+    done = load_checkpoint(checkpoint_path) if resume else set()
+    if not resume:
+        open(output_path, "w", encoding="utf-8").close()
+        open(checkpoint_path, "w", encoding="utf-8").close()
+
+    items = []
+    for vid in video_ids:
+        img_path = LOCAL_THUMB_DIR / f"{vid}.jpg"
+        if vid not in done and img_path.exists():
+            items.append((vid, img_path))
+    print(f"{len(done)} IDs already classified, {len(items)} thumbnails to scan.")
+
+    found = 0
+    with open(output_path, "a", encoding="utf-8") as f_out, \
+         open(checkpoint_path, "a", encoding="utf-8") as f_done, \
+         tqdm(total=len(items), desc="Scanning") as pbar:
+        for batch in iter_decoded_batches(items):
+            valid = [(vid, img) for vid, img in batch if img is not None]
+            try:
+                preds = predict_batch(classifier, [img for _, img in valid])
+            except Exception as e:
+                tqdm.write(f"Error classifying batch starting at {batch[0][0]}: {e}")
+                pbar.update(len(batch))
+                continue
+
+            for (vid, _), (has_signer, pos) in zip(valid, preds):
+                if has_signer:
+                    f_out.write(f"https://www.youtube.com/watch?v={vid}\n")
+                    tqdm.write(f"✅ FOUND ({pos}): {vid}")
+                    found += 1
+            f_out.flush()
+            # Undecodable images are checkpointed too, they would fail again on a rerun
+            f_done.write("".join(f"{vid}\n" for vid, _ in batch))
+            f_done.flush()
+            pbar.update(len(batch))
+    return found
 
 def main():
     # 0. Load IDs
@@ -47,6 +144,12 @@ def main():
     # 2. Setup Output File
     output_path = Path(OUTPUT_FILE)
     output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if SCAN_MODE == "batched":
+        print(f"Output will be appended to: {OUTPUT_FILE}")
+        found = scan_batched(classifier, video_ids, output_path)
+        print(f"\nScanning Complete. {found} new matches saved to {OUTPUT_FILE}")
+        return
     
     # We will APPEND to the file to preserve previous results if any, 
     # but the user might want a fresh run. 
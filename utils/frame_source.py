@@ -0,0 +1,317 @@
+import queue
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# ffmpeg scaler flags matching the OpenCV interpolation modes used in this repo
+FFMPEG_SCALE_FLAGS = {
+    cv2.INTER_NEAREST: "neighbor",
+    cv2.INTER_LINEAR: "bilinear",
+    cv2.INTER_AREA: "area",
+    cv2.INTER_CUBIC: "bicubic",
+    cv2.INTER_LANCZOS4: "lanczos",
+}
+
+
+def probe_video(video_path):
+    """
+    Read basic stream properties without decoding frames.
+
+    Returns:
+        Dict with width, height, fps and frame_count
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {video_path}")
+    info = {
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": cap.get(cv2.CAP_PROP_FPS),
+        "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+    }
+    cap.release()
+    return info
+
+
+def crop_to_pixels(crop_params, width, height):
+    """
+    Convert relative crop params ('x', 'y', 'w', 'h' in 0-1 range) to an
+    even-sized pixel rectangle (x, y, w, h).
+    """
+    x = int(crop_params['x'] * width)
+    y = int(crop_params['y'] * height)
+    w = int(crop_params['w'] * width)
+    h = int(crop_params['h'] * height)
+
+    if w % 2 != 0: w -= 1
+    if h % 2 != 0: h -= 1
+
+    return x, y, w, h
+
+
+class FrameSource:
+    """
+    Decode a video on a background thread into a bounded ring of preallocated
+    frame buffers, so decoding overlaps with whatever the caller does per frame.
+
+    Iterating yields (frame_idx, frame) where frame is a BGR uint8 array owned
+    by the ring. A frame stays valid until the next iteration step; copy it if
+    it has to outlive the loop body.
+
+    Args:
+        video_path: Path to input video
+        crop: Optional dict with keys 'x', 'y', 'w', 'h' (0-1 range), applied at decode time
+        size: Optional (width, height) output size. Either value may be None to
+              keep the aspect ratio of the (cropped) source.
+        backend: "opencv" (cv2.VideoCapture) or "ffmpeg" (rawvideo pipe, crop/scale
+                 done inside ffmpeg)
+        ring_size: Number of preallocated frame buffers
+        threads: Decoder threads (0 = decoder default)
+        interpolation: OpenCV interpolation used for the scale filter
+    """
+
+    def __init__(self, video_path, crop=None, size=None, backend="opencv", ring_size=8,
+                 threads=0, interpolation=cv2.INTER_LINEAR):
+        if backend not in ("opencv", "ffmpeg"):
+            raise ValueError(f"Unknown FrameSource backend: {backend}")
+
+        self.video_path = str(video_path)
+        self.backend = backend
+        self.threads = threads
+        self.interpolation = interpolation
+
+        info = probe_video(video_path)
+        self.source_width = info["width"]
+        self.source_height = info["height"]
+        self.fps = info["fps"]
+        self.frame_count = info["frame_count"]
+
+        if crop is not None:
+            self.crop_rect = crop_to_pixels(crop, self.source_width, self.source_height)
+        else:
+            self.crop_rect = None
+
+        in_w, in_h = (self.crop_rect[2], self.crop_rect[3]) if self.crop_rect else (self.source_width, self.source_height)
+        self.width, self.height = self._resolve_size(size, in_w, in_h)
+        self._needs_resize = (self.width, self.height) != (in_w, in_h)
+
+        self._buffers = np.empty((ring_size, self.height, self.width, 3), dtype=np.uint8)
+        self._free = queue.Queue()
+        for slot in range(ring_size):
+            self._free.put(slot)
+        self._filled = queue.Queue()
+
+        self._stop = threading.Event()
+        self._closed = False
+        self._thread = None
+        self._error = None
+        self._cap = None
+        self._proc = None
+        self._scratch = None
+
+        self._frames = 0
+        self._decode_seconds = 0.0
+        self._stall_seconds = 0.0
+        self._backpressure_seconds = 0.0
+        self._started_at = None
+        self._finished_at = None
+
+    @property
+    def crop_params(self):
+        """The applied crop as relative params (after pixel rounding), or None."""
+        if self.crop_rect is None:
+            return None
+        x, y, w, h = self.crop_rect
+        return {
+            'x': x / self.source_width,
+            'y': y / self.source_height,
+            'w': w / self.source_width,
+            'h': h / self.source_height,
+        }
+
+    @staticmethod
+    def _resolve_size(size, in_w, in_h):
+        if size is None:
+            return in_w, in_h
+        out_w, out_h = size
+        if out_w is None and out_h is None:
+            return in_w, in_h
+        # Derived sides are rounded down to even for libx264/yuv420p
+        if out_w is None:
+            out_w = int(round(in_w * out_h / in_h))
+            if out_w % 2 != 0: out_w -= 1
+        if out_h is None:
+            out_h = int(round(in_h * out_w / in_w))
+            if out_h % 2 != 0: out_h -= 1
+        return out_w, out_h
+
+    # --- Decoder side ---
+
+    def _open(self):
+        if self.backend == "ffmpeg":
+            filters = []
+            if self.crop_rect:
+                x, y, w, h = self.crop_rect
+                filters.append(f"crop={w}:{h}:{x}:{y}")
+            if self._needs_resize:
+                flags = FFMPEG_SCALE_FLAGS.get(self.interpolation, "bilinear")
+                filters.append(f"scale={self.width}:{self.height}:flags={flags}")
+
+            cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+            if self.threads:
+                cmd += ['-threads', str(self.threads)]
+            cmd += ['-i', self.video_path]
+            if filters:
+                cmd += ['-vf', ",".join(filters)]
+            cmd += ['-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+            self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                          bufsize=self.width * self.height * 3)
+        else:
+            self._cap = cv2.VideoCapture(self.video_path)
+            if not self._cap.isOpened():
+                raise ValueError(f"Cannot open video: {self.video_path}")
+            if self.threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+                self._cap.set(cv2.CAP_PROP_N_THREADS, self.threads)
+            if self.crop_rect or self._needs_resize:
+                self._scratch = np.empty((self.source_height, self.source_width, 3), dtype=np.uint8)
+
+    def _read_into(self, buf):
+        if self._proc is not None:
+            view = memoryview(buf).cast("B")
+            filled = 0
+            while filled < len(view):
+                n = self._proc.stdout.readinto(view[filled:])
+                if not n:
+                    return False
+                filled += n
+            return True
+
+        if self._scratch is None:
+            ok, frame = self._cap.read(buf)
+            if ok and frame is not buf:
+                np.copyto(buf, frame)
+            return ok
+
+        ok, frame = self._cap.read(self._scratch)
+        if not ok:
+            return False
+        if self.crop_rect:
+            x, y, w, h = self.crop_rect
+            frame = frame[y:y+h, x:x+w]
+        if self._needs_resize:
+            cv2.resize(frame, (self.width, self.height), dst=buf, interpolation=self.interpolation)
+        else:
+            np.copyto(buf, frame)
+        return True
+
+    def _run(self):
+        idx = 0
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                slot = self._free.get()
+                t1 = time.perf_counter()
+                self._backpressure_seconds += t1 - t0
+                if self._stop.is_set():
+                    break
+
+                ok = self._read_into(self._buffers[slot])
+                self._decode_seconds += time.perf_counter() - t1
+                if not ok:
+                    break
+
+                self._filled.put((slot, idx))
+                idx += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            self._filled.put(None)
+
+    # --- Consumer side ---
+
+    def start(self):
+        if self._thread is None:
+            self._open()
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __iter__(self):
+        self.start()
+        prev_slot = None
+        while True:
+            if prev_slot is not None:
+                self._free.put(prev_slot)
+                prev_slot = None
+
+            t0 = time.perf_counter()
+            item = self._filled.get()
+            self._stall_seconds += time.perf_counter() - t0
+            if item is None:
+                break
+
+            slot, idx = item
+            prev_slot = slot
+            self._frames += 1
+            yield idx, self._buffers[slot]
+
+        self._finished_at = time.perf_counter()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        # Idempotent: a second close() must not push another wake-up slot onto the free queue
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        # Unblock the decoder if it is waiting for a free slot
+        self._free.put(0)
+        if self._proc is not None:
+            self._proc.kill()
+        if self._thread is not None:
+            self._thread.join()
+        if self._proc is not None:
+            self._proc.stdout.close()
+            self._proc.wait()
+            self._proc = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+        if self._finished_at is None and self._started_at is not None:
+            self._finished_at = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def stats(self):
+        """
+        Decoder timing for the frames consumed so far.
+
+        stall_seconds is time the consumer waited on the decoder,
+        backpressure_seconds is time the decoder waited on the consumer.
+        """
+        end = self._finished_at if self._finished_at is not None else time.perf_counter()
+        wall = end - self._started_at if self._started_at is not None else 0.0
+        return {
+            "frames": self._frames,
+            "wall_seconds": round(wall, 3),
+            "decode_seconds": round(self._decode_seconds, 3),
+            "stall_seconds": round(self._stall_seconds, 3),
+            "backpressure_seconds": round(self._backpressure_seconds, 3),
+            "bound": "decode" if self._stall_seconds > self._backpressure_seconds else "model",
+        }
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"{s['frames']} frames in {s['wall_seconds']}s "
+                f"(decode {s['decode_seconds']}s, stall {s['stall_seconds']}s, "
+                f"backpressure {s['backpressure_seconds']}s) -> {s['bound']}-bound")
@@ -1,30 +1,59 @@
+import asyncio
 import json
+import time
 from pathlib import Path
 from openai import OpenAI
 from config import Config
+from utils.openai_client import get_async_client, estimate_tokens
+from utils.llm_cache import get_llm_cache, chat_key, audio_key
+from utils.profiling import span
 
 client = OpenAI(api_key=Config.OPENAI_API_KEY)
 
+def chat_completion(system_prompt: str, user_message: str, model: str = Config.OPENAI_MODEL_MINI,
+                    temperature: float = 0.0, validate=None, **kwargs) -> str:
+    """
+    Single blocking chat call behind the response cache. All sync GPT helpers go through here.
+    validate: optional fn(content) -> bool; rejected responses are returned but not cached.
+    """
+    def compute():
+        with span("openai.chat.request", model=model):
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                temperature=temperature,
+                **kwargs
+            )
+        return response.choices[0].message.content.strip()
+
+    key = chat_key(model, system_prompt, user_message, temperature, **kwargs)
+    with span("openai.chat", model=model):
+        return get_llm_cache().get_or_compute(key, compute, kind="chat", validate=validate)
+
 def call_gpt(system_prompt: str, user_message: str, model: str = Config.OPENAI_MODEL_MINI) -> str:
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ],
-        temperature=0.3
-    )
-    return response.choices[0].message.content.strip()
+    return chat_completion(system_prompt, user_message, model=model, temperature=0.3)
+
+async def acall_gpt(system_prompt: str, user_message: str, model: str = Config.OPENAI_MODEL_MINI) -> str:
+    return await get_async_client().chat(system_prompt, user_message, model=model, temperature=0.3)
+
+def call_gpt_batch(system_prompt: str, user_messages: list[str], model: str = Config.OPENAI_MODEL_MINI) -> list[str]:
+    return get_async_client().map(lambda msg: acall_gpt(system_prompt, msg, model), user_messages)
 
 def run_gpt4o_full_transcript(audio_path: Path, out_path: Path) -> dict:
-    with open(audio_path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            language="vi"
-        )
-    
-    full_text = transcription.text
+    def compute():
+        with open(audio_path, "rb") as audio_file, span("openai.transcribe.request"):
+            transcription = client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                language="vi"
+            )
+        return transcription.text
+
+    key = audio_key(audio_path, "whisper-1", language="vi", response_format="text")
+    full_text = get_llm_cache().get_or_compute(key, compute, kind="audio")
     result = {"text": full_text}
     
     with open(out_path, 'w', encoding='utf-8') as f:
@@ -85,8 +114,8 @@ LOW:
 Chỉ trả lời HIGH / MEDIUM / LOW.
 """
 
-def refine_with_gpt(text_whisper: str, full_transcript: str) -> str:
-    user = f"""
+def _refine_user(text_whisper: str, full_transcript: str) -> str:
+    return f"""
 Câu ASR:
 {text_whisper}
 
@@ -95,32 +124,165 @@ Transcript đầy đủ (tham chiếu):
 
 Hãy viết lại thành 1 câu rõ ràng, chuẩn VTV, giữ nguyên nghĩa.
 """
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_MINI,
-        messages=[
-            {"role": "system", "content": REFINE_PROMPT_SYSTEM},
-            {"role": "user", "content": user}
-        ],
-        temperature=0.15
-    )
-    return response.choices[0].message.content.strip()
+
+def refine_with_gpt(text_whisper: str, full_transcript: str) -> str:
+    user = _refine_user(text_whisper, full_transcript)
+    return chat_completion(REFINE_PROMPT_SYSTEM, user, model=Config.OPENAI_MODEL_MINI, temperature=0.15)
+
+async def arefine_with_gpt(text_whisper: str, full_transcript: str) -> str:
+    return await get_async_client().chat(
+        REFINE_PROMPT_SYSTEM, _refine_user(text_whisper, full_transcript),
+        model=Config.OPENAI_MODEL_MINI, temperature=0.15)
+
+def refine_batch(items: list[tuple[str, str]]) -> list[str]:
+    """Refine many (text_whisper, full_transcript) pairs concurrently."""
+    return get_async_client().map(lambda item: arefine_with_gpt(*item), items)
+
+# --- TRANSCRIPT CONTEXT FOR REFINEMENT ---
+
+REFINE_CONTEXT_TOKENS = getattr(Config, "REFINE_CONTEXT_TOKENS", 400)  # Window of neighbouring segments per request
+REFINE_VIDEO_TOKENS = getattr(Config, "REFINE_VIDEO_TOKENS", 3000)     # Segments per request in "video" mode
+
+REFINE_VIDEO_PROMPT_SYSTEM = REFINE_PROMPT_SYSTEM + """
+ĐỊNH DẠNG NHIỀU CÂU:
+Bạn nhận các câu ASR liên tiếp của cùng một bản tin, mỗi câu có chỉ số [i].
+Biên tập TỪNG câu riêng (dùng các câu xung quanh làm ngữ cảnh), không gộp hay tách câu.
+Trả về DUY NHẤT một object JSON: {"results": [{"i": <chỉ số>, "text": "<câu đã biên tập>"}, ...]}
+"""
+
+def transcript_window(texts: list[str], index: int, max_tokens: int = REFINE_CONTEXT_TOKENS) -> str:
+    """
+    Neighbouring segments around texts[index], grown alternately left and right
+    until max_tokens is reached. The target segment is always included.
+    """
+    lo, hi = index, index + 1
+    used = estimate_tokens(texts[index])
+    while lo > 0 or hi < len(texts):
+        grew = False
+        if lo > 0 and used + estimate_tokens(texts[lo - 1]) <= max_tokens:
+            lo -= 1
+            used += estimate_tokens(texts[lo])
+            grew = True
+        if hi < len(texts) and used + estimate_tokens(texts[hi]) <= max_tokens:
+            used += estimate_tokens(texts[hi])
+            hi += 1
+            grew = True
+        if not grew:
+            break
+    return " ".join(t.strip() for t in texts[lo:hi])
+
+def _plan_video_chunks(texts: list[str], max_tokens: int) -> list[range]:
+    chunks, start, used = [], 0, 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text) + 4
+        if i > start and used + cost > max_tokens:
+            chunks.append(range(start, i))
+            start, used = i, 0
+        used += cost
+    if start < len(texts):
+        chunks.append(range(start, len(texts)))
+    return chunks
+
+def _parse_chunk_response(raw: str, n: int) -> list:
+    """Refined texts by chunk index; None where the model skipped or garbled an entry."""
+    out = [None] * n
+    try:
+        for entry in json.loads(raw).get("results", []):
+            j = entry.get("i")
+            if isinstance(j, int) and 0 <= j < n and isinstance(entry.get("text"), str) and entry["text"].strip():
+                out[j] = entry["text"].strip()
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return out
+
+async def _arefine_chunk(texts: list[str], idxs: range, context_tokens: int) -> list[str]:
+    user = "\n".join(f"[{j}] {texts[i]}" for j, i in enumerate(idxs))
+    # Only answers covering every segment are cached; partial ones are retried on the next run
+    raw = await get_async_client().chat(
+        REFINE_VIDEO_PROMPT_SYSTEM, user, model=Config.OPENAI_MODEL_MINI, temperature=0.15,
+        validate=lambda out: None not in _parse_chunk_response(out, len(idxs)),
+        response_format={"type": "json_object"}, max_tokens=2 * estimate_tokens(user) + 100)
+
+    out = _parse_chunk_response(raw, len(idxs))
+
+    # Segments the model skipped fall back to a windowed single-segment request
+    missing = [j for j, text in enumerate(out) if text is None]
+    fixed = await asyncio.gather(*(arefine_with_gpt(texts[idxs[j]], transcript_window(texts, idxs[j], context_tokens))
+                                   for j in missing))
+    for j, text in zip(missing, fixed):
+        out[j] = text
+    return out
+
+async def _arefine_video(texts: list[str], mode: str, context_tokens: int, video_tokens: int) -> list[str]:
+    if mode == "full":
+        full_transcript = " ".join(t.strip() for t in texts)
+        return await asyncio.gather(*(arefine_with_gpt(t, full_transcript) for t in texts))
+    if mode == "window":
+        return await asyncio.gather(*(arefine_with_gpt(t, transcript_window(texts, i, context_tokens))
+                                      for i, t in enumerate(texts)))
+    if mode == "video":
+        chunks = _plan_video_chunks(texts, video_tokens)
+        parts = await asyncio.gather(*(_arefine_chunk(texts, idxs, context_tokens) for idxs in chunks))
+        return [text for part in parts for text in part]
+    raise ValueError(f"Unknown refine mode: {mode}")
+
+def refine_video_segments(segments: list[dict], mode: str = "window",
+                          context_tokens: int = REFINE_CONTEXT_TOKENS,
+                          video_tokens: int = REFINE_VIDEO_TOKENS) -> tuple[list[str], dict]:
+    """
+    Refine all Whisper segments of one video.
+
+    Args:
+        segments: Output of whisper_utils.extract_segments (dicts with 'text'), in time order
+        mode: "full"   - every request carries the whole transcript (previous behaviour)
+              "window" - every request carries only neighbouring segments within context_tokens
+              "video"  - consecutive segments are refined together, one request per video_tokens
+    Returns:
+        refined texts (same order as segments), stats with requests, tokens and latency
+    """
+    texts = [(s.get("text") or "").strip() for s in segments]
+    if not texts:
+        return [], {"segments": 0, "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+
+    async_client = get_async_client()
+    before = dict(async_client.stats)
+    t0 = time.perf_counter()
+    refined = asyncio.run(_arefine_video(texts, mode, context_tokens, video_tokens))
+    stats = {
+        "mode": mode,
+        "segments": len(texts),
+        "requests": async_client.stats["requests"] - before["requests"],
+        "prompt_tokens": async_client.stats["prompt_tokens"] - before["prompt_tokens"],
+        "completion_tokens": async_client.stats["completion_tokens"] - before["completion_tokens"],
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+    return refined, stats
 
 def review_ok_revert(original: str, cleaned: str) -> str:
     return "OK" if original.strip() == cleaned.strip() else "REVERT"
 
-def classify_quality(text_raw: str, text_final: str) -> str:
-    user = f"[RAW]\n{text_raw}\n\n[FINAL]\n{text_final}"
-    response = client.chat.completions.create(
-        model=Config.OPENAI_MODEL_MINI,
-        messages=[
-            {"role": "system", "content": QUALITY_PROMPT_SYSTEM},
-            {"role": "user", "content": user}
-        ],
-        temperature=0.0
-    )
-    ans = response.choices[0].message.content.strip().upper()
+def _quality_user(text_raw: str, text_final: str) -> str:
+    return f"[RAW]\n{text_raw}\n\n[FINAL]\n{text_final}"
+
+def parse_quality_level(ans: str) -> str:
+    ans = ans.strip().upper()
     if "HIGH" in ans:
         return "HIGH"
     if "LOW" in ans:
         return "LOW"
     return "MEDIUM"
+
+def classify_quality(text_raw: str, text_final: str) -> str:
+    user = _quality_user(text_raw, text_final)
+    ans = chat_completion(QUALITY_PROMPT_SYSTEM, user, model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_quality_level(ans)
+
+async def aclassify_quality(text_raw: str, text_final: str) -> str:
+    ans = await get_async_client().chat(
+        QUALITY_PROMPT_SYSTEM, _quality_user(text_raw, text_final),
+        model=Config.OPENAI_MODEL_MINI, temperature=0.0)
+    return parse_quality_level(ans)
+
+def classify_quality_batch(items: list[tuple[str, str]]) -> list[str]:
+    """Classify many (text_raw, text_final) pairs concurrently."""
+    return get_async_client().map(lambda item: aclassify_quality(*item), items)
@@ -0,0 +1,174 @@
+"""
+Per-clip quality metrics computed from saved keypoints (no video decoding).
+
+    hand_ratio        frames with at least one hand detected
+    left/right_ratio  frames with that hand detected
+    pose_ratio        frames with a pose detected
+    jitter            median frame-to-frame acceleration of hand/pose landmarks
+                      (normalized image units; high = unstable tracking)
+    out_of_frame      detected frames with a hand or visible pose landmark outside [0, 1]
+
+QualityAnalyzer accumulates them frame by frame while keypoints are extracted;
+analyze_keypoint_file() re-analyzes a saved file. check_quality() compares the
+metrics against thresholds so clips can be skipped or flagged before rendering.
+The verdict only lands in the keypoint_quality metadata column: utils/pose_preview.py
+refuses "skipped" clips, dataset exports do not filter on it.
+"""
+
+import csv
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from utils.pose_detection import load_keypoints
+
+# Default thresholds; a clip fails when any metric is on the wrong side
+THRESHOLDS = {
+    "min_hand_ratio": 0.5,
+    "min_pose_ratio": 0.8,
+    "max_jitter": 0.02,
+    "max_out_of_frame": 0.2,
+}
+POSE_VISIBILITY = 0.5  # Pose landmarks below this visibility are ignored for jitter / out-of-frame
+
+METRIC_FIELDS = ["frames", "hand_ratio", "left_hand_ratio", "right_hand_ratio", "pose_ratio",
+                 "jitter", "out_of_frame"]
+
+TRACKED_GROUPS = ("pose", "left_hand", "right_hand")
+
+class QualityAnalyzer:
+    """
+    Quality metrics accumulated one frame at a time, so a clip is analyzed while
+    its keypoints are streamed to disk. Frames may hold numpy arrays (as yielded
+    by iter_pose_landmarks) or nested lists (as loaded from JSON).
+    """
+
+    def __init__(self, schema):
+        self.shapes = {g: (spec["num_landmarks"], len(spec["fields"]))
+                       for g, spec in schema["groups"].items() if g in TRACKED_GROUPS}
+        self.frames = 0
+        self.present = {"hand": 0, "left_hand": 0, "right_hand": 0, "pose": 0}
+        self.detected = 0  # Frames with any tracked point
+        self.outside = 0   # ... of which some point lies outside [0, 1]
+        self.accelerations = []  # Mean second difference per frame, for the jitter median
+        self._recent = deque(maxlen=3)
+
+    def _group(self, frame, group):
+        """(num_landmarks, num_fields) array for one group, NaN when not detected."""
+        out = np.full(self.shapes[group], np.nan)
+        lms = frame.get(group)
+        if lms is not None and len(lms):
+            arr = np.asarray(lms, dtype=np.float64)
+            if arr.shape == out.shape:
+                out[:] = arr
+        return out
+
+    def add(self, frame):
+        self.frames += 1
+        arrays = {g: self._group(frame, g) for g in self.shapes}
+        present = {g: not np.isnan(a).all() for g, a in arrays.items()}
+        for g in present:
+            self.present[g] += present[g]
+        self.present["hand"] += present.get("left_hand", False) or present.get("right_hand", False)
+
+        # Tracked points: both hands plus visible pose landmarks, NaN elsewhere
+        tracked = [arrays[g][:, :2] for g in ("left_hand", "right_hand") if g in arrays]
+        if "pose" in arrays:
+            pose = arrays["pose"][:, :2].copy()
+            pose[~(arrays["pose"][:, 3] >= POSE_VISIBILITY)] = np.nan
+            tracked.append(pose)
+        if not tracked:
+            return
+        points = np.concatenate(tracked)
+
+        if not np.isnan(points).all():
+            self.detected += 1
+            self.outside += bool(((points < 0) | (points > 1)).any())  # NaN compares False
+
+        # |p[t] - 2p[t-1] + p[t-2]| (x, y only), averaged over points tracked in all three frames
+        self._recent.append(points)
+        if len(self._recent) == 3:
+            acc = np.linalg.norm(self._recent[2] - 2 * self._recent[1] + self._recent[0], axis=-1)
+            acc = acc[~np.isnan(acc)]
+            if acc.size:
+                self.accelerations.append(float(acc.mean()))
+
+    def metrics(self) -> dict:
+        n = self.frames
+        metrics = {"frames": n}
+        if n == 0:
+            metrics.update({k: 0.0 for k in METRIC_FIELDS if k != "frames"})
+            return metrics
+        metrics["hand_ratio"] = self.present["hand"] / n
+        metrics["left_hand_ratio"] = self.present["left_hand"] / n
+        metrics["right_hand_ratio"] = self.present["right_hand"] / n
+        metrics["pose_ratio"] = self.present["pose"] / n
+        metrics["jitter"] = float(np.median(self.accelerations)) if self.accelerations else 0.0
+        metrics["out_of_frame"] = self.outside / self.detected if self.detected else 0.0
+        return metrics
+
+def analyze_frames(schema, frames) -> dict:
+    """Quality metrics for one clip from the (schema, frames) pair returned by load_keypoints."""
+    analyzer = QualityAnalyzer(schema)
+    for frame in frames:
+        analyzer.add(frame)
+    return analyzer.metrics()
+
+def analyze_keypoint_file(path) -> dict:
+    """Re-analyze a saved keypoint file (extraction feeds a QualityAnalyzer directly)."""
+    schema, frames = load_keypoints(path)
+    return analyze_frames(schema, frames)
+
+def check_quality(metrics: dict, thresholds: dict = None) -> list:
+    """Names of the thresholds the clip fails (empty list = passes)."""
+    t = {**THRESHOLDS, **(thresholds or {})}
+    failed = []
+    if metrics["hand_ratio"] < t["min_hand_ratio"]:
+        failed.append("hands")
+    if metrics["pose_ratio"] < t["min_pose_ratio"]:
+        failed.append("pose")
+    if metrics["jitter"] > t["max_jitter"]:
+        failed.append("jitter")
+    if metrics["out_of_frame"] > t["max_out_of_frame"]:
+        failed.append("out_of_frame")
+    return failed
+
+def write_quality_csv(results: dict, csv_path):
+    """results: {rel_path: {"keypoint_quality": status, "keypoint_issues": ..., **metrics}}"""
+    fieldnames = ["path", "keypoint_quality", "keypoint_issues"] + METRIC_FIELDS
+    Path(csv_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for path in sorted(results):
+            row = {k: (round(v, 4) if isinstance(v, float) else v) for k, v in results[path].items()}
+            writer.writerow({"path": path, **row})
+
+def add_quality_column(metadata_csv, results: dict, column="keypoint_quality"):
+    """
+    Set column on every row of metadata_csv whose path was analyzed (other rows keep
+    their value). The file is rewritten through a temporary copy.
+    """
+    with open(metadata_csv, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(reader)
+    if column not in fieldnames:
+        fieldnames.append(column)
+
+    updated = 0
+    for row in rows:
+        res = results.get(row.get("path"))
+        if res is not None:
+            row[column] = res[column]
+            updated += 1
+
+    tmp_path = f"{metadata_csv}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, metadata_csv)
+    return updated
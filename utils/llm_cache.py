@@ -0,0 +1,202 @@
+"""
+Disk-backed, content-addressed cache for GPT and Whisper responses.
+
+Keys are sha256 hashes of everything that determines the answer (model,
+prompts, temperature, extra request params; audio bytes for Whisper), so a
+rerun of an annotation stage only pays for prompts it has not seen before.
+
+Modes (Config.LLM_CACHE_MODE):
+    "readwrite"  - serve hits, store misses (default)
+    "cache_only" - serve hits, raise CacheMissError on a miss
+    "off"        - bypass the cache entirely
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from config import Config
+
+CACHE_MODES = ("readwrite", "cache_only", "off")
+REPO_ROOT = Path(__file__).resolve().parent.parent  # Default cache path does not depend on the cwd
+
+class CacheMissError(RuntimeError):
+    """Raised in cache_only mode when a request is not in the cache."""
+
+def _hash(payload: dict) -> str:
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def chat_key(model: str, system_prompt: str, user_message: str, temperature: float, **params) -> str:
+    return _hash({
+        "kind": "chat",
+        "model": model,
+        "system": system_prompt,
+        "user": user_message,
+        "temperature": temperature,
+        "params": params,
+    })
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def audio_key(audio, model: str, **params) -> str:
+    """
+    Key on the audio content, not the path, so a re-extracted WAV still hits.
+    audio: file path or the encoded bytes themselves
+    """
+    digest = hashlib.sha256(audio).hexdigest() if isinstance(audio, (bytes, bytearray)) else file_sha256(audio)
+    return _hash({
+        "kind": "audio",
+        "model": model,
+        "audio_sha256": digest,
+        "params": params,
+    })
+
+class LLMCache:
+    """
+    SQLite key/value store with size-based LRU eviction.
+
+    Args:
+        path: SQLite file
+        max_bytes: Total size of stored values above which the least recently
+                   used entries are evicted (None = unbounded)
+        mode: One of CACHE_MODES
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, mode: str = "readwrite"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode} (expected one of {CACHE_MODES})")
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if mode != "off":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " kind TEXT,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries(last_used)")
+            self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def get(self, key: str):
+        """Stored value for key, or None. Raises CacheMissError in cache_only mode."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        if row is None:
+            if self.mode == "cache_only":
+                raise CacheMissError(f"No cached response for key {key[:12]}...")
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, value, kind: str = None) -> None:
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, value, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, data, len(data.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk entries from least to most recently used until under the limit
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC"):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+    def get_or_compute(self, key: str, compute, kind: str = None, validate=None):
+        """
+        Cached value for key, else compute() and store it.
+        validate: optional callable; computed values it rejects are returned but not
+                  stored, and cached values it rejects are recomputed.
+        """
+        value = self.get(key)
+        if value is not None and (validate is None or validate(value)):
+            return value
+        value = compute()
+        if validate is None or validate(value):
+            self.put(key, value, kind)
+        return value
+
+    def stats(self) -> dict:
+        entries, size = 0, 0
+        if self.enabled:
+            with self._lock:
+                entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+_default_cache = None
+
+def get_llm_cache() -> LLMCache:
+    global _default_cache
+    if _default_cache is None:
+        max_mb = getattr(Config, "LLM_CACHE_MAX_MB", 512)
+        _default_cache = LLMCache(
+            getattr(Config, "LLM_CACHE_PATH", REPO_ROOT / "data/metadata/llm_cache.sqlite"),
+            max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+            mode=getattr(Config, "LLM_CACHE_MODE", "readwrite"),
+        )
+    return _default_cache
@@ -0,0 +1,192 @@
+import asyncio
+import random
+import time
+from pathlib import Path
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
+from config import Config
+from utils.llm_cache import get_llm_cache, chat_key
+from utils.profiling import async_span
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for rate limiting (Vietnamese text averages ~3 chars/token)."""
+    return max(1, len(text or "") // 3)
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRY_STATUS_CODES
+    return False
+
+def _retry_after(exc: Exception) -> float:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute.
+    acquire() waits until enough budget is available.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class _LoopState:
+    """Objects that must be created inside the running event loop."""
+
+    def __init__(self, loop, api_key, base_url, max_concurrency):
+        self.loop = loop
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limit_lock = asyncio.Lock()
+
+class AsyncOpenAIClient:
+    """
+    Shared async OpenAI client for all GPT/Whisper calls.
+
+    - at most max_concurrency requests in flight
+    - token buckets for requests/minute and tokens/minute
+    - retries with jittered exponential backoff on 429, 5xx and connection errors
+    - map() runs a coroutine function over many items and returns results in order
+    """
+
+    def __init__(self, max_concurrency: int = None, requests_per_minute: int = None,
+                 tokens_per_minute: int = None, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0, api_key: str = None, base_url: str = None):
+        self.max_concurrency = max_concurrency or getattr(Config, "OPENAI_MAX_CONCURRENCY", 8)
+        self.request_bucket = TokenBucket(requests_per_minute or getattr(Config, "OPENAI_RPM", 500))
+        self.token_bucket = TokenBucket(tokens_per_minute or getattr(Config, "OPENAI_TPM", 200000))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.api_key = api_key or Config.OPENAI_API_KEY
+        self.base_url = base_url or getattr(Config, "OPENAI_BASE_URL", None)
+        self._state = None
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latency_seconds": 0.0,
+        }
+
+    def _loop_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        if self._state is None or self._state.loop is not loop:
+            self._state = _LoopState(loop, self.api_key, self.base_url, self.max_concurrency)
+        return self._state
+
+    async def _call(self, make_request, est_tokens: int = 1, name: str = "openai.request"):
+        state = self._loop_state()
+        for attempt in range(self.max_retries + 1):
+            with async_span("openai.rate_limit_wait"):
+                async with state.limit_lock:
+                    await self.request_bucket.acquire(1)
+                    await self.token_bucket.acquire(est_tokens)
+
+            async with state.semaphore:
+                t0 = time.perf_counter()
+                try:
+                    with async_span(name, attempt=attempt):
+                        response = await make_request(state.client)
+                except Exception as e:
+                    if not _is_retryable(e) or attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    error = e
+                else:
+                    self.stats["requests"] += 1
+                    self.stats["latency_seconds"] += time.perf_counter() - t0
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        self.stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                        self.stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+                    return response
+
+            # Full jitter backoff, never shorter than the server's Retry-After
+            self.stats["retries"] += 1
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            await asyncio.sleep(max(delay, _retry_after(error)))
+
+    async def chat(self, system_prompt: str, user_message: str, model: str = None,
+                   temperature: float = 0.0, validate=None, **kwargs) -> str:
+        """validate: optional fn(content) -> bool; rejected responses are returned but not cached."""
+        model = model or Config.OPENAI_MODEL_MINI
+        cache = get_llm_cache()
+        key = chat_key(model, system_prompt, user_message, temperature, **kwargs)
+        cached = cache.get(key)
+        if cached is not None and (validate is None or validate(cached)):
+            return cached
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+        est_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message) + kwargs.get("max_tokens", 256)
+
+        async def make_request(client):
+            return await client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, **kwargs)
+
+        response = await self._call(make_request, est_tokens, name="openai.chat.request")
+        content = response.choices[0].message.content.strip()
+        if validate is None or validate(content):
+            cache.put(key, content, kind="chat")
+        return content
+
+    async def transcribe(self, audio_path: Path, model: str = "whisper-1", **kwargs):
+        audio_bytes = Path(audio_path).read_bytes()
+
+        async def make_request(client):
+            return await client.audio.transcriptions.create(
+                model=model, file=(Path(audio_path).name, audio_bytes), **kwargs)
+
+        return await self._call(make_request, name="openai.transcribe.request")
+
+    async def amap(self, fn, items, return_exceptions: bool = False) -> list:
+        return await asyncio.gather(*(fn(item) for item in items), return_exceptions=return_exceptions)
+
+    def map(self, fn, items, return_exceptions: bool = False) -> list:
+        """
+        Run async fn over items concurrently (within the configured limits).
+        Results are returned in input order.
+        """
+        items = list(items)
+        if not items:
+            return []
+        return asyncio.run(self.amap(fn, items, return_exceptions=return_exceptions))
+
+_default_client = None
+
+def get_async_client() -> AsyncOpenAIClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncOpenAIClient()
+    return _default_client
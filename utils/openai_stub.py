@@ -0,0 +1,129 @@
+"""
+Local stand-in for the OpenAI chat and transcription endpoints, for exercising
+the client layer (concurrency, rate limits, retries) without network access.
+
+    with StubOpenAIServer(chat_responder=lambda body: "WEATHER_CORE", fail_first=3) as stub:
+        client = AsyncOpenAIClient(base_url=stub.base_url, api_key="stub")
+        client.map(...)
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _default_chat_responder(body: dict) -> str:
+    return "OK"
+
+def _default_transcription_responder(body: bytes) -> dict:
+    return {
+        "text": "Xin chào quý vị.",
+        "language": "vietnamese",
+        "duration": 2.0,
+        "segments": [{"id": 0, "start": 0.0, "end": 2.0, "text": "Xin chào quý vị."}],
+    }
+
+class StubOpenAIServer:
+    """
+    Args:
+        chat_responder: fn(request_json) -> assistant message content
+        transcription_responder: fn(raw_multipart_body) -> verbose_json dict
+        fail_first: Number of initial requests answered with fail_status
+        fail_status: Status code for injected failures (429 or 5xx)
+        latency: Seconds to sleep before answering each request
+    """
+
+    def __init__(self, chat_responder=None, transcription_responder=None, fail_first=0,
+                 fail_status=429, latency=0.0, host="127.0.0.1", port=0):
+        self.chat_responder = chat_responder or _default_chat_responder
+        self.transcription_responder = transcription_responder or _default_transcription_responder
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.latency = latency
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+
+                with stub._lock:
+                    stub.requests.append(self.path)
+                    n = len(stub.requests)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    if n <= stub.fail_first:
+                        self._send_json(stub.fail_status, {"error": {"message": "stub failure", "type": "stub"}})
+                        return
+
+                    if self.path.endswith("/chat/completions"):
+                        req = json.loads(body)
+                        content = stub.chat_responder(req)
+                        self._send_json(200, {
+                            "id": f"chatcmpl-stub-{n}",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": req.get("model", "stub"),
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }],
+                            "usage": {
+                                "prompt_tokens": len(body) // 3,
+                                "completion_tokens": len(content) // 3,
+                                "total_tokens": (len(body) + len(content)) // 3,
+                            },
+                        })
+                    elif self.path.endswith("/audio/transcriptions"):
+                        self._send_json(200, stub.transcription_responder(body))
+                    else:
+                        self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
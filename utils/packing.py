@@ -0,0 +1,211 @@
+"""
+Pack several segments of the same video into one LLM request.
+
+The system prompt is sent once per pack instead of once per sentence. Inputs
+are numbered [0]..[N-1] and the model answers {"results": [{"i": 0, ...}, ...]}.
+A pack whose answer cannot be parsed is split in half and retried; a single
+segment that still fails goes through the regular one-sentence call.
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+
+from config import Config
+from utils.openai_client import get_async_client, estimate_tokens
+from utils.classification import (CLASSIFY_SYSTEM_PROMPT, SCORE_SYSTEM_PROMPT,
+                                  aclassify_weather_segment, ascore_segment_for_thesis)
+from utils.audit import AUDIT_SYSTEM_PROMPT, aaudit_one_segment
+
+PACK_INPUT_TOKENS = getattr(Config, "PACK_INPUT_TOKENS", 1500)    # Budget for the numbered inputs of one pack
+PACK_OUTPUT_TOKENS = getattr(Config, "PACK_OUTPUT_TOKENS", 2000)  # Budget for the JSON answer of one pack
+PACK_MAX_ITEMS = getattr(Config, "PACK_MAX_ITEMS", 25)
+
+PACK_INSTRUCTION = """
+ĐỊNH DẠNG NHIỀU CÂU (thay cho định dạng đầu ra ở trên):
+Bạn nhận nhiều câu, mỗi câu có chỉ số [i]. Đánh giá TỪNG câu độc lập.
+Trả về DUY NHẤT một object JSON: {{"results": [{{"i": <chỉ số>, {fields}}}, ...]}}
+với đúng một phần tử cho mỗi chỉ số.
+"""
+
+def _label(entry):
+    value = str(entry.get("label", "")).strip().upper()
+    return value if value in ("WEATHER_CORE", "WEATHER_SUPPORT", "NON_WEATHER") else None
+
+def _int_0_100(value):
+    try:
+        value = int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+    return value if 0 <= value <= 100 else None
+
+def _audit(entry):
+    flag = str(entry.get("flag", "")).strip().upper()
+    score = _int_0_100(entry.get("score"))
+    if flag not in ("OK", "WARN", "REMOVE") or score is None:
+        return None
+    return flag, score, str(entry.get("note", "")).strip()
+
+# task -> prompt, item formatter, per-item parser, single-call fallback, answer for an
+# empty sentence (never sent to the API) and output estimate
+PACK_TASKS = {
+    "classify": {
+        "system": CLASSIFY_SYSTEM_PROMPT + PACK_INSTRUCTION.format(
+            fields='"label": "WEATHER_CORE" | "WEATHER_SUPPORT" | "NON_WEATHER"'),
+        "model": Config.OPENAI_MODEL_MINI,
+        "format": lambda row: row["text"],
+        "parse": _label,
+        "single": lambda row: aclassify_weather_segment(row["text"]),
+        "empty": "NON_WEATHER",  # Same as aclassify_weather_segment
+        "output_tokens": 20,
+    },
+    "score": {
+        "system": SCORE_SYSTEM_PROMPT + PACK_INSTRUCTION.format(fields='"score": <0-100>'),
+        "model": Config.OPENAI_MODEL_MINI,
+        "format": lambda row: (f"{row['text']}\n(content_label: {row['content_label']}, "
+                               f"quality_level: {row.get('quality_level', 'MEDIUM')}, "
+                               f"duration_seconds: {float(row.get('duration', 0.0)):.2f})"),
+        "parse": lambda entry: _int_0_100(entry.get("score")),
+        "single": lambda row: ascore_segment_for_thesis(row["text"], row["content_label"],
+                                                        row.get("quality_level", "MEDIUM"), row.get("duration", 0.0)),
+        "empty": 0,  # Nothing to train on
+        "output_tokens": 15,
+    },
+    "audit": {
+        "system": AUDIT_SYSTEM_PROMPT + PACK_INSTRUCTION.format(
+            fields='"flag": "OK" | "WARN" | "REMOVE", "score": <0-100>, "note": "<ghi chú ngắn>"'),
+        "model": Config.OPENAI_MODEL,
+        "format": lambda row: (f"{row['text']}\n(clip_id: {row['clip_id']}, content_label: {row['content_label']}, "
+                               f"quality_level: {row['quality_level']}, thesis_score: {row['thesis_score']}, "
+                               f"duration: {row['duration']})"),
+        "parse": _audit,
+        "single": lambda row: aaudit_one_segment(**row),
+        "empty": ("REMOVE", 0, "Câu trống."),  # Same as aaudit_one_segment
+        "output_tokens": 60,
+    },
+}
+
+def plan_packs(rows: list[dict], task: str, input_tokens: int = PACK_INPUT_TOKENS,
+               output_tokens: int = PACK_OUTPUT_TOKENS, max_items: int = PACK_MAX_ITEMS) -> list[list[int]]:
+    """
+    Group row indices into packs: same video_id only, consecutive in input order,
+    and N chosen so both the numbered inputs and the expected answer fit their budgets.
+    """
+    spec = PACK_TASKS[task]
+    max_by_output = max(1, output_tokens // spec["output_tokens"])
+    limit = max(1, min(max_items, max_by_output))
+
+    by_video = defaultdict(list)
+    for i, row in enumerate(rows):
+        by_video[row.get("video_id")].append(i)
+
+    packs = []
+    for idxs in by_video.values():
+        pack, used = [], 0
+        for i in idxs:
+            cost = estimate_tokens(spec["format"](rows[i])) + 4
+            if pack and (len(pack) >= limit or used + cost > input_tokens):
+                packs.append(pack)
+                pack, used = [], 0
+            pack.append(i)
+            used += cost
+        if pack:
+            packs.append(pack)
+    return packs
+
+def _pack_user(task: str, rows: list[dict]) -> str:
+    fmt = PACK_TASKS[task]["format"]
+    lines = [f"[{i}] {fmt(row)}" for i, row in enumerate(rows)]
+    return "\n\n".join(lines) + f"\n\nTrả về JSON cho {len(rows)} câu (i = 0..{len(rows) - 1})."
+
+def parse_pack_response(task: str, raw: str, n: int):
+    """List of n parsed results, or None if any item is missing or invalid."""
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    entries = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return None
+
+    parse = PACK_TASKS[task]["parse"]
+    results = [None] * n
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        i = entry.get("i")
+        if isinstance(i, int) and 0 <= i < n and results[i] is None:
+            results[i] = parse(entry)
+    return None if any(r is None for r in results) else results
+
+async def arun_pack(task: str, rows: list[dict], stats: dict = None) -> list:
+    """Results for one pack, splitting it on unparseable answers."""
+    spec = PACK_TASKS[task]
+    stats = stats if stats is not None else defaultdict(int)
+
+    # Unparseable answers are not cached, so a rerun does not replay them and split again
+    raw = await get_async_client().chat(
+        spec["system"], _pack_user(task, rows), model=spec["model"], temperature=0.0,
+        validate=lambda out: parse_pack_response(task, out, len(rows)) is not None,
+        response_format={"type": "json_object"},
+        max_tokens=spec["output_tokens"] * len(rows) + 50)
+    stats["requests"] += 1
+    results = parse_pack_response(task, raw, len(rows))
+    if results is not None:
+        return results
+
+    if len(rows) == 1:
+        stats["single_fallbacks"] += 1
+        return [await spec["single"](rows[0])]
+
+    stats["splits"] += 1
+    mid = len(rows) // 2
+    left, right = await asyncio.gather(arun_pack(task, rows[:mid], stats), arun_pack(task, rows[mid:], stats))
+    return left + right
+
+async def arun_packed(task: str, rows: list[dict], stats: dict = None) -> list:
+    stats = stats if stats is not None else defaultdict(int)
+    spec = PACK_TASKS[task]
+    results = [None] * len(rows)
+
+    # Empty sentences get the task's local default and are never sent
+    filled = []
+    for i, row in enumerate(rows):
+        if (row.get("text") or "").strip():
+            filled.append(i)
+        else:
+            results[i] = spec["empty"]
+
+    packs = plan_packs([rows[i] for i in filled], task)
+    outputs = await asyncio.gather(*(arun_pack(task, [rows[filled[j]] for j in pack], stats) for pack in packs))
+    for pack, out in zip(packs, outputs):
+        for j, value in zip(pack, out):
+            results[filled[j]] = value
+    return results
+
+def run_packed(task: str, rows: list[dict], verbose: bool = True) -> list:
+    """
+    Packed equivalent of running the task's single-segment call on every row.
+
+    rows: dicts with 'video_id' plus the task inputs:
+        classify: text
+        score: text, content_label, quality_level, duration
+        audit: the keyword arguments of audit_one_segment
+    """
+    if not rows:
+        return []
+    stats = defaultdict(int)
+    results = asyncio.run(arun_packed(task, rows, stats))
+    if verbose:
+        print(f"[{task}] {len(rows)} segments in {stats['requests']} requests "
+              f"({stats['splits']} splits, {stats['single_fallbacks']} single fallbacks)")
+    return results
+
+def classify_segments_packed(rows: list[dict]) -> list[str]:
+    return run_packed("classify", rows)
+
+def score_segments_packed(rows: list[dict]) -> list[int]:
+    return run_packed("score", rows)
+
+def audit_segments_packed(rows: list[dict]) -> list[tuple]:
+    return run_packed("audit", rows)
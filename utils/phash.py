@@ -0,0 +1,211 @@
+"""
+Perceptual hashes (dHash / pHash) and a BK-tree index for near-duplicate
+thumbnails and broadcasts.
+
+Thumbnails are compared by one 64-bit hash each. Videos are compared by the
+hashes of a few evenly spaced keyframes: a video is a near-duplicate of an
+indexed one when most of its keyframes have a close match in that video.
+"""
+
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.frame_source import probe_video
+
+HASH_SIZE = 8
+THUMB_MAX_DISTANCE = 6        # Hamming distance (of 64 bits) for duplicate thumbnails
+KEYFRAME_MAX_DISTANCE = 8     # Hamming distance for matching keyframes
+KEYFRAME_MATCH_RATIO = 0.75   # Fraction of keyframes that must match the same video
+NUM_KEYFRAMES = 8
+
+def _gray(image, size):
+    """Grayscale float array of the given (width, height) from a PIL image, path or BGR array."""
+    if isinstance(image, (str, Path)):
+        image = Image.open(image)
+    if isinstance(image, np.ndarray):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    return np.asarray(image.convert("L").resize(size, Image.LANCZOS), dtype=np.float32)
+
+def _bits_to_int(bits):
+    return int("".join("1" if b else "0" for b in bits.flatten()), 2)
+
+def dhash(image, hash_size=HASH_SIZE) -> int:
+    """Difference hash: sign of horizontal gradients on a (hash_size+1) x hash_size thumbnail."""
+    pixels = _gray(image, (hash_size + 1, hash_size))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] *= 1 / np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+_DCT_32 = _dct_matrix(32)
+
+def phash(image, hash_size=HASH_SIZE) -> int:
+    """DCT hash: low-frequency 2D DCT coefficients of a 32x32 thumbnail against their median."""
+    pixels = _gray(image, (32, 32))
+    dct = _DCT_32 @ pixels @ _DCT_32.T
+    low = dct[:hash_size, :hash_size]
+    median = np.median(low.flatten()[1:])  # Skip the DC term
+    return _bits_to_int(low > median)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """Metric tree over Hamming distance; range queries visit only a fraction of the nodes."""
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, item) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [h, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [item], {}]
+                return
+            node = child
+
+    def query(self, h: int, max_distance: int) -> list:
+        """All (distance, item) within max_distance of h."""
+        if self.root is None:
+            return []
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= max_distance:
+                found.extend((d, item) for item in node[1])
+            # Triangle inequality: only children with |edge - d| <= max_distance can match
+            for edge, child in node[2].items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+        return found
+
+def video_keyframe_hashes(video_path, num_frames=NUM_KEYFRAMES) -> list:
+    """pHash of evenly spaced frames (skipping the first and last 5%)."""
+    info = probe_video(video_path)
+    count = info["frame_count"]
+    if count <= 0:
+        return []
+    indices = np.linspace(int(count * 0.05), max(int(count * 0.05), int(count * 0.95) - 1), num_frames).astype(int)
+
+    hashes = []
+    cap = cv2.VideoCapture(str(video_path))
+    for idx in sorted(set(indices.tolist())):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ret, frame = cap.read()
+        if ret:
+            hashes.append(phash(frame))
+    cap.release()
+    return hashes
+
+class PerceptualIndex:
+    """
+    Persistent thumbnail / keyframe hash index (JSON, hashes as hex strings).
+    The first ID seen for a piece of content is the one that is kept.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.thumbnails = {}  # video_id -> hash
+        self.keyframes = {}   # video_id -> [hash, ...]
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.thumbnails = {k: int(v, 16) for k, v in data.get("thumbnails", {}).items()}
+            self.keyframes = {k: [int(h, 16) for h in v] for k, v in data.get("keyframes", {}).items()}
+
+        self._thumb_tree = BKTree()
+        for vid, h in self.thumbnails.items():
+            self._thumb_tree.add(h, vid)
+        self._frame_tree = BKTree()
+        for vid, hashes in self.keyframes.items():
+            for h in hashes:
+                self._frame_tree.add(h, vid)
+
+    def save(self):
+        if not self.path:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "thumbnails": {k: f"{v:016x}" for k, v in self.thumbnails.items()},
+                "keyframes": {k: [f"{h:016x}" for h in v] for k, v in self.keyframes.items()},
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def check_thumbnail(self, video_id, h, max_distance=THUMB_MAX_DISTANCE):
+        """ID of an indexed near-duplicate thumbnail, or None (then h is added under video_id)."""
+        if video_id in self.thumbnails:
+            return None
+        matches = [(d, vid) for d, vid in self._thumb_tree.query(h, max_distance) if vid != video_id]
+        if matches:
+            return min(matches)[1]
+        self.thumbnails[video_id] = h
+        self._thumb_tree.add(h, video_id)
+        return None
+
+    def best_video_match(self, video_id, hashes, max_distance=KEYFRAME_MAX_DISTANCE):
+        """(indexed video sharing the most keyframes, fraction of hashes it matches), or (None, 0.0)."""
+        votes = Counter()
+        for h in hashes:
+            # One vote per keyframe and candidate video
+            votes.update({vid for _, vid in self._frame_tree.query(h, max_distance) if vid != video_id})
+        if not votes:
+            return None, 0.0
+        vid, n = votes.most_common(1)[0]
+        return vid, n / len(hashes)
+
+    def check_video(self, video_id, hashes, max_distance=KEYFRAME_MAX_DISTANCE, match_ratio=KEYFRAME_MATCH_RATIO):
+        """ID of an indexed near-duplicate video, or None (then its keyframes are added)."""
+        if video_id in self.keyframes or not hashes:
+            return None
+        vid, ratio = self.best_video_match(video_id, hashes, max_distance)
+        if vid is not None and ratio >= match_ratio:
+            return vid
+        self.keyframes[video_id] = hashes
+        for h in hashes:
+            self._frame_tree.add(h, video_id)
+        return None
+
+def dedup_thumbnails(video_ids, thumb_dir, index: PerceptualIndex, max_distance=THUMB_MAX_DISTANCE):
+    """
+    Returns:
+        kept: video_ids without near-duplicate thumbnails (missing thumbnails are kept)
+        duplicates: {dropped_id: kept_id}
+    """
+    kept, duplicates = [], {}
+    for vid in video_ids:
+        path = Path(thumb_dir) / f"{vid}.jpg"
+        try:
+            h = index.thumbnails.get(vid)
+            if h is None and path.exists():
+                h = phash(path)
+        except Exception:
+            h = None
+        original = index.check_thumbnail(vid, h, max_distance) if h is not None else None
+        if original is None:
+            kept.append(vid)
+        else:
+            duplicates[vid] = original
+    return kept, duplicates
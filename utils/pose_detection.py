@@ -1,83 +1,331 @@
+import os
+import json
 import cv2
 import mediapipe as mp
 import numpy as np
 from pathlib import Path
 
+from utils.frame_source import FrameSource
+from utils.profiling import profiled_iter, sample_frame, frame_span
+
 mp_holistic = mp.solutions.holistic
 mp_drawing = mp.solutions.drawing_utils
 mp_drawing_styles = mp.solutions.drawing_styles
 
-def extract_pose_landmarks(video_path, min_detection_confidence=0.3, min_tracking_confidence=0.7):
+# --- LANDMARK GROUPS ---
+# landmark_config selects which groups extract_pose_landmarks computes, e.g.
+#   {"pose": {"model_complexity": 1, "subset": "upper_body"},
+#    "hands": {"model_complexity": 0},
+#    "face": {"subset": ["lips", "eyes"]}}
+# Groups that are not listed are not computed at all. None keeps the original
+# behaviour: full Holistic (pose, face, both hands) at model_complexity=2.
+
+def _connection_indices(connections):
+    return sorted({idx for conn in connections for idx in conn})
+
+POSE_SUBSETS = {
+    "upper_body": list(range(25)), # Face, shoulders, arms, hands, hips (no legs)
+}
+
+FACE_SUBSETS = {
+    "lips": _connection_indices(mp.solutions.face_mesh_connections.FACEMESH_LIPS),
+    "eyes": _connection_indices(mp.solutions.face_mesh_connections.FACEMESH_LEFT_EYE
+                                | mp.solutions.face_mesh_connections.FACEMESH_RIGHT_EYE),
+    "eyebrows": _connection_indices(mp.solutions.face_mesh_connections.FACEMESH_LEFT_EYEBROW
+                                    | mp.solutions.face_mesh_connections.FACEMESH_RIGHT_EYEBROW),
+    "contours": _connection_indices(mp.solutions.face_mesh_connections.FACEMESH_CONTOURS),
+}
+
+NUM_LANDMARKS = {"pose": 33, "face": 468, "hand": 21}
+
+def _subset_indices(subset, subsets, group):
+    if subset is None:
+        return None
+    names = [subset] if isinstance(subset, str) else list(subset)
+    indices = set()
+    for name in names:
+        if name not in subsets:
+            raise ValueError(f"Unknown {group} subset: {name} (choose from {sorted(subsets)})")
+        indices.update(subsets[name])
+    return sorted(indices)
+
+def landmark_schema(landmark_config=None):
+    """
+    Describe what extract_pose_landmarks stores for a given landmark_config.
+    Stored next to the frames so consumers know which groups/landmarks exist.
+    """
+    if landmark_config is None:
+        return {
+            "model": "holistic",
+            "groups": {
+                "pose": {"model_complexity": 2, "indices": None, "num_landmarks": 33, "fields": ["x", "y", "z", "visibility"]},
+                "face": {"indices": None, "num_landmarks": 468, "fields": ["x", "y", "z"]},
+                "left_hand": {"model_complexity": None, "indices": None, "num_landmarks": 21, "fields": ["x", "y", "z"]},
+                "right_hand": {"model_complexity": None, "indices": None, "num_landmarks": 21, "fields": ["x", "y", "z"]},
+            },
+        }
+
+    groups = {}
+    if "pose" in landmark_config:
+        cfg = landmark_config["pose"] or {}
+        indices = _subset_indices(cfg.get("subset"), POSE_SUBSETS, "pose")
+        groups["pose"] = {
+            "model_complexity": cfg.get("model_complexity", 1),
+            "indices": indices,
+            "num_landmarks": len(indices) if indices else NUM_LANDMARKS["pose"],
+            "fields": ["x", "y", "z", "visibility"],
+        }
+    if "hands" in landmark_config:
+        cfg = landmark_config["hands"] or {}
+        for side in ("left_hand", "right_hand"):
+            groups[side] = {
+                "model_complexity": cfg.get("model_complexity", 1),
+                "indices": None,
+                "num_landmarks": NUM_LANDMARKS["hand"],
+                "fields": ["x", "y", "z"],
+            }
+    if "face" in landmark_config:
+        cfg = landmark_config["face"] or {}
+        indices = _subset_indices(cfg.get("subset"), FACE_SUBSETS, "face")
+        groups["face"] = {
+            "indices": indices,
+            "num_landmarks": len(indices) if indices else NUM_LANDMARKS["face"],
+            "fields": ["x", "y", "z"],
+        }
+
+    unknown = set(landmark_config) - {"pose", "hands", "face"}
+    if unknown:
+        raise ValueError(f"Unknown landmark groups: {sorted(unknown)}")
+
+    return {"model": "solutions", "groups": groups}
+
+class LandmarkExtractor:
+    """
+    Runs only the MediaPipe models needed for the requested landmark groups.
+    With landmark_config=None a single Holistic model (complexity 2) is used.
     """
-    Extract pose landmarks from video using MediaPipe Holistic.
+
+    def __init__(self, landmark_config=None, min_detection_confidence=0.3, min_tracking_confidence=0.7):
+        self.schema = landmark_schema(landmark_config)
+        self.groups = self.schema["groups"]
+        self.holistic = None
+        self.pose = None
+        self.hands = None
+        self.face_mesh = None
+
+        conf = dict(min_detection_confidence=min_detection_confidence,
+                    min_tracking_confidence=min_tracking_confidence)
+
+        if landmark_config is None:
+            self.holistic = mp_holistic.Holistic(model_complexity=2, **conf)
+            return
+
+        if "pose" in self.groups:
+            self.pose = mp.solutions.pose.Pose(model_complexity=self.groups["pose"]["model_complexity"], **conf)
+        if "left_hand" in self.groups:
+            self.hands = mp.solutions.hands.Hands(
+                max_num_hands=2, model_complexity=min(1, self.groups["left_hand"]["model_complexity"]), **conf)
+        if "face" in self.groups:
+            self.face_mesh = mp.solutions.face_mesh.FaceMesh(max_num_faces=1, refine_landmarks=False, **conf)
+
+    def _pack(self, group, landmarks):
+        """Landmarks of one group as a float array of shape (num_landmarks, num_fields), (0, num_fields) if missing."""
+        num_fields = len(self.groups[group]["fields"])
+        if landmarks is None:
+            return np.empty((0, num_fields), dtype=np.float64)
+        lms = landmarks.landmark
+        indices = self.groups[group]["indices"]
+        if indices is not None:
+            lms = [lms[i] for i in indices]
+        if group == "pose":
+            return np.array([[lm.x, lm.y, lm.z, lm.visibility] for lm in lms], dtype=np.float64)
+        return np.array([[lm.x, lm.y, lm.z] for lm in lms], dtype=np.float64)
+
+    def process(self, image_rgb):
+        """
+        Returns:
+            Dict with one landmark array per requested group (empty if not detected)
+        """
+        frame_data = {}
+
+        if self.holistic is not None:
+            results = self.holistic.process(image_rgb)
+            for group, lms in (("pose", results.pose_landmarks), ("face", results.face_landmarks),
+                               ("left_hand", results.left_hand_landmarks),
+                               ("right_hand", results.right_hand_landmarks)):
+                frame_data[group] = self._pack(group, lms)
+            return frame_data
+
+        if self.pose is not None:
+            frame_data["pose"] = self._pack("pose", self.pose.process(image_rgb).pose_landmarks)
+
+        if self.hands is not None:
+            results = self.hands.process(image_rgb)
+            best = {}
+            for lms, handedness in zip(results.multi_hand_landmarks or [], results.multi_handedness or []):
+                cls = handedness.classification[0]
+                # Hands labels assume a mirrored (selfie) image; broadcast video is not
+                # mirrored, so "Left" is the signer's right hand (Holistic convention).
+                side = "right_hand" if cls.label == "Left" else "left_hand"
+                if side not in best or cls.score > best[side][0]:
+                    best[side] = (cls.score, lms)
+            for side in ("left_hand", "right_hand"):
+                frame_data[side] = self._pack(side, best[side][1] if side in best else None)
+
+        if self.face_mesh is not None:
+            results = self.face_mesh.process(image_rgb)
+            faces = results.multi_face_landmarks or []
+            frame_data["face"] = self._pack("face", faces[0] if faces else None)
+
+        return frame_data
+
+    def close(self):
+        for model in (self.holistic, self.pose, self.hands, self.face_mesh):
+            if model is not None:
+                model.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def iter_pose_landmarks(video_path, min_detection_confidence=0.3, min_tracking_confidence=0.7, landmark_config=None):
+    """
+    Generator variant of extract_pose_landmarks: yields one frame at a time so
+    memory use does not grow with clip length.
     
     Args:
         video_path: Path to input video
         min_detection_confidence: Detection confidence threshold
         min_tracking_confidence: Tracking confidence threshold
+        landmark_config: Landmark groups to compute (see LANDMARK GROUPS above),
+                         None for full Holistic
     
-    Returns:
-        List of frame data with pose, face, and hand landmarks
+    Yields:
+        Dict with "frame" (1-based index) and one numpy array per landmark group
     """
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video: {video_path}")
-    
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    all_frames_data = []
     
-    with mp_holistic.Holistic(
+    with FrameSource(video_path) as source, LandmarkExtractor(
+        landmark_config,
         min_detection_confidence=min_detection_confidence,
-        min_tracking_confidence=min_tracking_confidence,
-        model_complexity=2
-    ) as holistic:
-        frame_count = 0
-        
-        while cap.isOpened():
-            success, frame = cap.read()
-            if not success:
-                break
-            
-            frame_count += 1
-            
-            lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            l2 = clahe.apply(l)
-            lab = cv2.merge((l2, a, b))
-            enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-            
-            image = cv2.cvtColor(enhanced_frame, cv2.COLOR_BGR2RGB)
+        min_tracking_confidence=min_tracking_confidence
+    ) as extractor:
+        for frame_idx, frame in profiled_iter(source, "decode"):
+            sample_frame(frame_idx)
+            with frame_span("cvtColor"):
+                lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
+                l, a, b = cv2.split(lab)
+            with frame_span("clahe"):
+                l2 = clahe.apply(l)
+            with frame_span("cvtColor"):
+                lab = cv2.merge((l2, a, b))
+                enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+                image = cv2.cvtColor(enhanced_frame, cv2.COLOR_BGR2RGB)
             image.flags.writeable = False
-            results = holistic.process(image)
-            
-            frame_data = {
-                "frame": frame_count,
-                "pose": [],
-                "face": [],
-                "left_hand": [],
-                "right_hand": []
-            }
-            
-            if results.pose_landmarks:
-                for lm in results.pose_landmarks.landmark:
-                    frame_data["pose"].append([lm.x, lm.y, lm.z, lm.visibility])
-            
-            if results.face_landmarks:
-                for lm in results.face_landmarks.landmark:
-                    frame_data["face"].append([lm.x, lm.y, lm.z])
-            
-            if results.left_hand_landmarks:
-                for lm in results.left_hand_landmarks.landmark:
-                    frame_data["left_hand"].append([lm.x, lm.y, lm.z])
-            
-            if results.right_hand_landmarks:
-                for lm in results.right_hand_landmarks.landmark:
-                    frame_data["right_hand"].append([lm.x, lm.y, lm.z])
             
-            all_frames_data.append(frame_data)
+            frame_data = {"frame": frame_idx + 1}
+            with frame_span("landmarks.process"):
+                frame_data.update(extractor.process(image))
+            yield frame_data
+
+def frame_to_json(frame_data):
+    """Convert a frame from iter_pose_landmarks to the JSON layout (nested lists)."""
+    return {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in frame_data.items()}
+
+def extract_pose_landmarks(video_path, min_detection_confidence=0.3, min_tracking_confidence=0.7, landmark_config=None):
+    """
+    Extract pose landmarks from video using MediaPipe.
+    Holds every frame in memory; prefer iter_pose_landmarks + KeypointWriter for long videos.
     
-    cap.release()
-    return all_frames_data
+    Args:
+        video_path: Path to input video
+        min_detection_confidence: Detection confidence threshold
+        min_tracking_confidence: Tracking confidence threshold
+        landmark_config: Landmark groups to compute (see LANDMARK GROUPS above),
+                         None for full Holistic
+    
+    Returns:
+        List of frame data with the requested pose, face, and hand landmarks
+        (describe it with landmark_schema(landmark_config))
+    """
+    return [
+        frame_to_json(frame_data)
+        for frame_data in iter_pose_landmarks(video_path, min_detection_confidence,
+                                              min_tracking_confidence, landmark_config)
+    ]
+
+def save_keypoints(path, frames, landmark_config=None):
+    """Write keypoints as {"schema": ..., "frames": [...]}"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"schema": landmark_schema(landmark_config), "frames": frames}, f, indent=2)
+
+class KeypointWriter:
+    """
+    Incrementally write keypoints in the same {"schema", "frames"} layout as
+    save_keypoints. Frames are buffered and flushed every chunk_size frames,
+    so memory stays bounded regardless of clip length. The file is written
+    under a temporary name and renamed on successful close.
+    """
+
+    def __init__(self, path, landmark_config=None, chunk_size=256):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".part")
+        self.chunk_size = chunk_size
+        self.frames_written = 0
+        self._buffer = []
+        self.schema = landmark_schema(landmark_config)
+        self._f = open(self.tmp_path, 'w', encoding='utf-8')
+        self._f.write('{"schema": ' + json.dumps(self.schema) + ',\n"frames": [\n')
+
+    def write(self, frame_data):
+        self._buffer.append(json.dumps(frame_to_json(frame_data)))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        prefix = ",\n" if self.frames_written else ""
+        self._f.write(prefix + ",\n".join(self._buffer))
+        self._f.flush()
+        self.frames_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self, discard=False):
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.write("\n]}\n")
+        self._f.close()
+        if discard:
+            self.tmp_path.unlink(missing_ok=True)
+        else:
+            os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Do not leave a truncated keypoint file behind on errors
+        self.close(discard=exc_type is not None)
+        return False
+
+def load_keypoints(path):
+    """
+    Load a keypoint JSON file.
+    
+    Returns:
+        (schema, frames). Files written before schemas existed (a bare list of
+        frames) get the full Holistic schema.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return landmark_schema(None), data
+    return data["schema"], data["frames"]
 
 def visualize_pose_on_video(input_path, output_path, min_detection_confidence=0.3, min_tracking_confidence=0.7):
     """
@@ -97,14 +345,13 @@ def visualize_pose_on_video(input_path, output_path, min_detection_confidence=0.
     import tempfile
     import shutil
     
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
+    try:
+        source = FrameSource(input_path)
+    except ValueError:
         return False
     
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = int(source.fps)
+    total_frames = source.frame_count
     
     # Create temp directory for frames
     temp_dir = tempfile.mkdtemp()
@@ -112,29 +359,27 @@ def visualize_pose_on_video(input_path, output_path, min_detection_confidence=0.
     try:
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         
-        with mp_holistic.Holistic(
+        with source, mp_holistic.Holistic(
             min_detection_confidence=min_detection_confidence,
             min_tracking_confidence=min_tracking_confidence,
             model_complexity=1
         ) as holistic:
-            frame_count = 0
-            
-            while cap.isOpened():
-                success, frame = cap.read()
-                if not success:
-                    break
-                
-                frame_count += 1
-                
-                lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-                l, a, b = cv2.split(lab)
-                l2 = clahe.apply(l)
-                lab = cv2.merge((l2, a, b))
-                enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+            for frame_idx, frame in profiled_iter(source, "decode"):
+                frame_count = frame_idx + 1
+                sample_frame(frame_idx)
                 
-                image = cv2.cvtColor(enhanced_frame, cv2.COLOR_BGR2RGB)
+                with frame_span("cvtColor"):
+                    lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
+                    l, a, b = cv2.split(lab)
+                with frame_span("clahe"):
+                    l2 = clahe.apply(l)
+                with frame_span("cvtColor"):
+                    lab = cv2.merge((l2, a, b))
+                    enhanced_frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+                    image = cv2.cvtColor(enhanced_frame, cv2.COLOR_BGR2RGB)
                 image.flags.writeable = False
-                results = holistic.process(image)
+                with frame_span("holistic.process"):
+                    results = holistic.process(image)
                 
                 image.flags.writeable = True
                 image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
@@ -173,8 +418,6 @@ def visualize_pose_on_video(input_path, output_path, min_detection_confidence=0.
                 frame_path = f"{temp_dir}/frame_{frame_count:06d}.png"
                 cv2.imwrite(frame_path, image)
         
-        cap.release()
-        
         # Use ffmpeg to create video from frames
         cmd = [
             'ffmpeg',
@@ -200,6 +443,141 @@ def visualize_pose_on_video(input_path, output_path, min_detection_confidence=0.
         # Clean up temp directory
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+# --- RENDERING FROM SAVED KEYPOINTS ---
+# Connections and BGR colors per group; no model is run.
+OVERLAY_STYLE = {
+    "face": (mp_holistic.FACEMESH_CONTOURS, (192, 192, 192), 1),
+    "pose": (mp_holistic.POSE_CONNECTIONS, (245, 117, 66), 2),
+    "left_hand": (mp_holistic.HAND_CONNECTIONS, (121, 22, 76), 2),
+    "right_hand": (mp_holistic.HAND_CONNECTIONS, (66, 245, 230), 2),
+}
+
+def _overlay_edges(schema):
+    """
+    Per group: (a, b) index arrays into the stored landmark rows for every
+    connection whose both endpoints were stored (subsets drop the others).
+    """
+    edges = {}
+    for group, spec in schema["groups"].items():
+        if group not in OVERLAY_STYLE:
+            continue
+        indices = spec.get("indices")
+        position = {lm: i for i, lm in enumerate(indices)} if indices else None
+        pairs = []
+        for a, b in OVERLAY_STYLE[group][0]:
+            if position is None:
+                pairs.append((a, b))
+            elif a in position and b in position:
+                pairs.append((position[a], position[b]))
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        edges[group] = (pairs[:, 0], pairs[:, 1])
+    return edges
+
+def draw_keypoints(image, frame, edges, min_visibility=0.5):
+    """
+    Draw one frame of stored keypoints onto a BGR image in place.
+    All segments of a group go through a single cv2.polylines call.
+    """
+    h, w = image.shape[:2]
+    scale = np.array([w, h], dtype=np.float64)
+    for group, (a, b) in edges.items():
+        lms = frame.get(group)
+        if lms is None or len(lms) == 0:
+            continue
+        lms = np.asarray(lms, dtype=np.float64)
+        pts = np.rint(lms[:, :2] * scale).astype(np.int32)
+        keep = np.ones(len(lms), dtype=bool)
+        if group == "pose" and lms.shape[1] > 3:
+            keep = lms[:, 3] >= min_visibility
+        _, color, thickness = OVERLAY_STYLE[group]
+
+        ok = keep[a] & keep[b]
+        if ok.any():
+            segments = np.stack([pts[a[ok]], pts[b[ok]]], axis=1)  # (S, 2, 2)
+            cv2.polylines(image, list(segments.reshape(-1, 2, 1, 2)), False, color, thickness, cv2.LINE_AA)
+        if group != "face" and keep.any():
+            # Zero-length polylines render as round dots
+            dots = np.repeat(pts[keep][:, None, :], 2, axis=1)
+            cv2.polylines(image, list(dots.reshape(-1, 2, 1, 2)), False, (255, 255, 255), thickness * 2 + 1, cv2.LINE_AA)
+    return image
+
+def render_overlay_from_keypoints(input_path, keypoints_path, output_path, height=None, crf=23, preset="veryfast"):
+    """
+    Draw stored keypoints onto a video without running MediaPipe. Frames are
+    piped straight to ffmpeg (no temporary images).
+    
+    Args:
+        input_path: Clip the keypoints were extracted from
+        keypoints_path: Keypoint JSON (see load_keypoints)
+        output_path: Output MP4
+        height: Optional output height (keypoints are normalized, so any size works)
+        crf, preset: libx264 settings
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    import subprocess
+    
+    schema, frames = load_keypoints(keypoints_path)
+    by_index = {f["frame"]: f for f in frames}
+    edges = _overlay_edges(schema)
+    
+    try:
+        source = FrameSource(input_path, size=(None, height) if height else None)
+    except ValueError:
+        return False
+    
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.stem + ".part" + output_path.suffix)
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+        '-s', f'{source.width}x{source.height}',
+        '-r', str(source.fps),
+        '-i', 'pipe:0',
+        '-c:v', 'libx264',
+        '-preset', preset,
+        '-crf', str(crf),
+        '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart',
+        '-y',
+        str(tmp_path)
+    ]
+    proc = None
+    try:
+        # Inside the try: a missing ffmpeg binary raises OSError here
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        with source:
+            for frame_idx, image in profiled_iter(source, "decode"):
+                sample_frame(frame_idx)
+                frame = by_index.get(frame_idx + 1)
+                if frame is not None:
+                    with frame_span("draw_keypoints"):
+                        draw_keypoints(image, frame, edges)
+                with frame_span("ffmpeg.write"):
+                    proc.stdin.write(image.tobytes())
+        proc.stdin.close()
+        stderr = proc.stderr.read().decode(errors="replace")
+        if proc.wait() != 0:
+            print(f"ffmpeg error: {stderr}")
+            tmp_path.unlink(missing_ok=True)
+            return False
+    except BaseException as e:
+        source.close()
+        stderr = ""
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+            stderr = proc.stderr.read().decode(errors='replace')
+        tmp_path.unlink(missing_ok=True)
+        if not isinstance(e, OSError): # e.g. a decode error: do not leave ffmpeg waiting on stdin
+            raise
+        print(f"ffmpeg error: {stderr or e}")
+        return False
+    
+    os.replace(tmp_path, output_path)
+    return True
+
 def enhance_frame_contrast(frame):
     """
     Enhance frame contrast using CLAHE.
@@ -0,0 +1,169 @@
+"""
+On-demand pose-overlay previews with a size-bounded LRU cache.
+
+A preview is rendered from the stored keypoints (render_overlay_from_keypoints,
+no MediaPipe) the first time a clip is requested and kept in the cache
+directory. Hits refresh the file's mtime; when the cache grows past its limit
+the least recently used previews are deleted. Re-extracted keypoints change
+the cache key, so stale overlays are never served. Clips whose keypoint_quality
+is "skipped" in the scene metadata (classifier_ends/add_pose_to_scenes.py) get no preview.
+
+    python utils/pose_preview.py v001/scene_001.mp4   # prints the preview path
+"""
+
+import csv
+import hashlib
+import os
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import Config
+from utils.pose_detection import render_overlay_from_keypoints
+
+# --- CONFIGURATION ---
+# Same base as classifier_ends/add_pose_to_scenes.py, which writes the clips and keypoints read here
+BASE_DIR = Path(getattr(Config, "BASE_DIR", "/workspace/datdq/SignWeather"))
+SCENE_VIDEO_DIR = getattr(Config, "SCENE_VIDEO_DIR", BASE_DIR / "data/scene_videos_cropped")
+KEYPOINT_DIR = getattr(Config, "KEYPOINT_DIR", BASE_DIR / "data/scene_keypoints")
+POSE_PREVIEW_DIR = getattr(Config, "POSE_PREVIEW_DIR", BASE_DIR / "data/cache/pose_previews")
+SCENE_METADATA_CSV = getattr(Config, "SCENE_METADATA_CSV", BASE_DIR / "data/metadata/scene_metadata.csv")
+POSE_PREVIEW_MAX_MB = getattr(Config, "POSE_PREVIEW_MAX_MB", 2048)
+PREVIEW_HEIGHT = getattr(Config, "POSE_PREVIEW_HEIGHT", 480)  # Previews are downscaled; None keeps clip size
+PREVIEW_CRF = 26
+
+class PreviewCache:
+    """
+    Args:
+        video_dir: Root of the clips (rel paths like "v001/scene_001.mp4")
+        keypoint_dir: Root of the keypoint JSON files (same layout, .json)
+        cache_dir: Where rendered previews are kept
+        max_bytes: Total preview size above which LRU entries are evicted (None = unbounded)
+        metadata_csv: Scene metadata with a keypoint_quality column; "skipped" clips are
+                      not rendered (None = no quality check)
+    """
+
+    def __init__(self, video_dir=SCENE_VIDEO_DIR, keypoint_dir=KEYPOINT_DIR, cache_dir=POSE_PREVIEW_DIR,
+                 max_bytes=POSE_PREVIEW_MAX_MB * 1024 * 1024, height=PREVIEW_HEIGHT, crf=PREVIEW_CRF,
+                 metadata_csv=SCENE_METADATA_CSV):
+        self.video_dir = Path(video_dir)
+        self.keypoint_dir = Path(keypoint_dir)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.height = height
+        self.crf = crf
+        self.metadata_csv = Path(metadata_csv) if metadata_csv else None
+        self._skipped = set()
+        self._skipped_mtime = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _stem(self, rel_path):
+        return Path(rel_path).with_suffix("").as_posix().replace("/", "__")
+
+    def _entry(self, rel_path, keypoints_path):
+        """Cache file for rel_path, keyed on the keypoint file version and render settings."""
+        st = keypoints_path.stat()
+        version = f"{st.st_mtime_ns}:{st.st_size}:{self.height}:{self.crf}"
+        digest = hashlib.sha1(version.encode()).hexdigest()[:10]
+        return self.cache_dir / f"{self._stem(rel_path)}.{digest}.mp4"
+
+    def skipped(self, rel_path):
+        """True if the scene metadata marks the clip's keypoints as "skipped" (re-read when the CSV changes)."""
+        if self.metadata_csv is None or not self.metadata_csv.exists():
+            return False
+        mtime = self.metadata_csv.stat().st_mtime_ns
+        with self._lock:
+            if mtime != self._skipped_mtime:
+                with open(self.metadata_csv, "r", encoding="utf-8") as f:
+                    self._skipped = {row.get("path") for row in csv.DictReader(f)
+                                     if row.get("keypoint_quality") == "skipped"}
+                self._skipped_mtime = mtime
+            return rel_path in self._skipped
+
+    def _key_lock(self, rel_path):
+        with self._lock:
+            return self._key_locks.setdefault(rel_path, threading.Lock())
+
+    def get(self, rel_path):
+        """
+        Path of the overlay preview for a clip, rendering it on a miss.
+
+        Returns:
+            Path to the cached MP4, or None if the clip or its keypoints are missing,
+            the clip failed the keypoint quality gate, or rendering failed
+        """
+        video_path = self.video_dir / rel_path
+        keypoints_path = (self.keypoint_dir / rel_path).with_suffix(".json")
+        if not video_path.exists() or not keypoints_path.exists() or self.skipped(rel_path):
+            return None
+
+        # One render per clip even if it is requested concurrently
+        with self._key_lock(rel_path):
+            entry = self._entry(rel_path, keypoints_path)
+            if entry.exists():
+                self.hits += 1
+                os.utime(entry)  # mtime = last use
+                return entry
+
+            self.misses += 1
+            for stale in self.cache_dir.glob(f"{self._stem(rel_path)}.*.mp4"):
+                stale.unlink(missing_ok=True)
+            if not render_overlay_from_keypoints(video_path, keypoints_path, entry,
+                                                 height=self.height, crf=self.crf):
+                return None
+
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep=None):
+        """Delete least recently used previews until the cache fits max_bytes."""
+        if self.max_bytes is None:
+            return 0
+        with self._lock:
+            entries = []
+            for p in self.cache_dir.glob("*.mp4"):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, p in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if p == keep:
+                    continue
+                p.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            return removed
+
+    def stats(self):
+        sizes = [p.stat().st_size for p in self.cache_dir.glob("*.mp4")]
+        return {"hits": self.hits, "misses": self.misses, "entries": len(sizes), "bytes": sum(sizes)}
+
+_default_cache = None
+
+def get_preview_cache() -> PreviewCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = PreviewCache()
+    return _default_cache
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python utils/pose_preview.py <rel_path> [<rel_path> ...]")
+        return
+    cache = get_preview_cache()
+    for rel_path in sys.argv[1:]:
+        path = cache.get(rel_path)
+        print(path if path else f"No preview for {rel_path} (clip or keypoints missing, quality gate, or render failed)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Named-span profiler for the hot paths (decode, color conversion, CLAHE, resize,
+MediaPipe, rule check, ffmpeg subprocesses, OpenAI calls).
+
+Switched by environment variables, read once at import:
+    VSWD_PROFILE=1              enable (unset / 0 = off: span() returns a shared
+                                no-op context and profiled_iter() the iterable itself)
+    VSWD_PROFILE_SAMPLE=10      per-frame spans are recorded on every Nth frame only
+    VSWD_PROFILE_DIR=profiles   where each process writes trace_<pid>.json at exit
+
+Every span is tagged with the worker (pid/thread) and the current video
+(set_context). Each trace file is a Chrome trace / Perfetto JSON; merge the
+files of a run and print p50/p95 per step with:
+
+    python utils/profiling.py profiles
+"""
+
+import atexit
+import contextlib
+import json
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+ENABLED = os.environ.get("VSWD_PROFILE", "") not in ("", "0")
+SAMPLE_EVERY = max(1, int(os.environ.get("VSWD_PROFILE_SAMPLE", "10")))
+PROFILE_DIR = os.environ.get("VSWD_PROFILE_DIR", "profiles")
+MAX_TRACE_EVENTS = 200000  # Per process; durations are still aggregated past this
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = []                       # Chrome trace events
+        self.durations = defaultdict(list)     # (video, worker, name) -> [microseconds]
+        self.sample_factor = {}                # name -> SAMPLE_EVERY for per-frame spans
+        self.threads = {}                      # tid -> thread name
+        self._async_id = 0
+
+    def record(self, name, start_ns, end_ns, sample=1, is_async=False, args=None):
+        thread = threading.current_thread()
+        tid = threading.get_native_id()
+        video = getattr(_local, "video", None) or ""
+        ts, dur = start_ns / 1000.0, (end_ns - start_ns) / 1000.0
+        with self._lock:
+            self.durations[(video, f"{os.getpid()}/{thread.name}", name)].append(dur)
+            if sample > 1:
+                self.sample_factor[name] = sample
+            self.threads[tid] = thread.name
+            if len(self.events) >= MAX_TRACE_EVENTS:
+                return
+            event_args = {"video": video, **(args or {})}
+            if is_async:
+                # Concurrent awaits overlap on one thread: use async begin/end pairs
+                self._async_id += 1
+                base = {"name": name, "cat": "async", "pid": os.getpid(), "tid": tid, "id": self._async_id}
+                self.events.append({**base, "ph": "b", "ts": ts, "args": event_args})
+                self.events.append({**base, "ph": "e", "ts": ts + dur})
+            else:
+                self.events.append({"name": name, "cat": "span", "ph": "X", "ts": ts, "dur": dur,
+                                    "pid": os.getpid(), "tid": tid, "args": event_args})
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        meta = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"{Path(sys.argv[0]).name} [{pid}]"}}]
+        meta += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in self.threads.items()]
+        return {
+            "traceEvents": meta + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "durations": [[video, worker, name, d] for (video, worker, name), d in self.durations.items()],
+                "sample_factor": self.sample_factor,
+            },
+        }
+
+_profiler = Profiler()
+
+class _Span:
+    __slots__ = ("name", "sample", "is_async", "args", "start")
+
+    def __init__(self, name, sample=1, is_async=False, args=None):
+        self.name = name
+        self.sample = sample
+        self.is_async = is_async
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _profiler.record(self.name, self.start, time.perf_counter_ns(), self.sample, self.is_async, self.args)
+        return False
+
+def set_context(video=None):
+    """Tag the spans of the current thread with a video ID."""
+    if ENABLED:
+        _local.video = video
+
+def span(name, **args):
+    """Context manager timing one step (no-op when profiling is off)."""
+    if not ENABLED:
+        return _NULL
+    return _Span(name, args=args or None)
+
+def async_span(name, **args):
+    """span() for awaits that overlap on one thread (exported as async events)."""
+    if not ENABLED:
+        return _NULL
+    return _Span(name, is_async=True, args=args or None)
+
+def sample_frame(index):
+    """Start frame index of a per-frame loop; returns whether its frame_span()s are recorded."""
+    if not ENABLED:
+        return False
+    _local.sampled = index % SAMPLE_EVERY == 0
+    return _local.sampled
+
+def frame_span(name):
+    """Per-frame span, recorded only on frames selected by sample_frame()."""
+    if not ENABLED or not getattr(_local, "sampled", False):
+        return _NULL
+    return _Span(name, sample=SAMPLE_EVERY)
+
+def profiled_iter(iterable, name):
+    """
+    Time each next() of a per-frame iterable (e.g. a FrameSource, i.e. decode wait)
+    on sampled steps. Returns iterable unchanged when profiling is off.
+    """
+    if not ENABLED:
+        return iterable
+    return _profiled_iter(iterable, name)
+
+def _profiled_iter(iterable, name):
+    it = iter(iterable)
+    i = 0
+    while True:
+        start = time.perf_counter_ns()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        if i % SAMPLE_EVERY == 0:
+            _profiler.record(name, start, time.perf_counter_ns(), SAMPLE_EVERY)
+        i += 1
+        yield item
+
+def percentile_table(durations, sample_factor, title):
+    """Text table: one row per key with count, estimated total, p50, p95, max."""
+    lines = [title, f"{'step':<56} {'count':>8} {'total s':>10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+    rows = []
+    for key, values in durations.items():
+        arr = np.asarray(values) / 1000.0  # us -> ms
+        name = key[-1] if isinstance(key, tuple) else key
+        factor = sample_factor.get(name, 1)
+        label = " | ".join(k for k in key if k) if isinstance(key, tuple) else key
+        if factor > 1:
+            label += f" (1/{factor})"
+        rows.append((arr.sum() * factor / 1000.0, label, len(arr), arr))
+    for total, label, count, arr in sorted(rows, key=lambda r: -r[0]):
+        lines.append(f"{label[:56]:<56} {count:>8} {total:>10.2f} {np.percentile(arr, 50):>9.2f} "
+                     f"{np.percentile(arr, 95):>9.2f} {arr.max():>9.2f}")
+    return "\n".join(lines)
+
+def summarize(durations, sample_factor, by=("name",)):
+    """
+    durations: {(video, worker, name): [us]}; by: subset of ("video", "worker", "name").
+    Sampled totals are scaled by their sample factor.
+    """
+    fields = ("video", "worker", "name")
+    grouped = defaultdict(list)
+    for key, values in durations.items():
+        grouped[tuple(key[fields.index(f)] for f in by)].extend(values)
+    return percentile_table(grouped, sample_factor, f"--- per {' / '.join(by)} ---")
+
+def summary(by=("name",)):
+    """p50/p95 text summary of this process."""
+    with _profiler._lock:
+        durations = {k: list(v) for k, v in _profiler.durations.items()}
+    return summarize(durations, _profiler.sample_factor, by)
+
+def export_chrome_trace(path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with _profiler._lock:
+        trace = _profiler.to_chrome_trace()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace, f)
+    return path
+
+_dumped = False
+
+def dump(profile_dir=None):
+    """Write this process's trace to <profile_dir>/trace_<pid>.json (once, at exit)."""
+    global _dumped
+    if not ENABLED or _dumped or not _profiler.durations:
+        return None
+    _dumped = True
+    return export_chrome_trace(Path(profile_dir or PROFILE_DIR) / f"trace_{os.getpid()}.json")
+
+def _register_exit_dump():
+    # Pool worker processes exit without running atexit handlers, but do run these finalizers
+    multiprocessing.util.Finalize(None, dump, exitpriority=10)
+
+def _after_fork(_):
+    """Forked workers start with an empty profile and their own exit dump."""
+    global _profiler, _dumped
+    _profiler = Profiler()
+    _dumped = False
+    _register_exit_dump()
+
+if ENABLED:
+    atexit.register(dump)
+    _register_exit_dump()
+    multiprocessing.util.register_after_fork(_after_fork, _after_fork)
+
+def merge_traces(profile_dir):
+    """
+    Merge the per-process trace files of a run.
+
+    Returns:
+        (chrome trace dict, durations {(video, worker, name): [us]}, sample_factor)
+    """
+    events, durations, sample_factor = [], defaultdict(list), {}
+    for path in sorted(Path(profile_dir).glob("trace_*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        events.extend(data.get("traceEvents", []))
+        other = data.get("otherData", {})
+        for video, worker, name, values in other.get("durations", []):
+            durations[(video, worker, name)].extend(values)
+        sample_factor.update(other.get("sample_factor", {}))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}, durations, sample_factor
+
+def main():
+    profile_dir = sys.argv[1] if len(sys.argv) > 1 else PROFILE_DIR
+    trace, durations, sample_factor = merge_traces(profile_dir)
+    if not durations:
+        print(f"No trace_*.json files in {profile_dir} (run with VSWD_PROFILE=1)")
+        return
+    out_path = Path(profile_dir) / "merged_trace.json"
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(trace, f)
+    for by in (("name",), ("video", "name"), ("worker", "name")):
+        print(summarize(durations, sample_factor, by))
+        print()
+    print(f"Chrome trace / Perfetto: {out_path}")
+
+if __name__ == "__main__":
+    main()
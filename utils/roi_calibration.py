@@ -0,0 +1,226 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.frame_source import probe_video
+
+# --- CONFIGURATION ---
+RAW_VIDEO_DIR = "/workspace/datdq/SignWeather/data/raw_videos"
+ROI_CACHE_PATH = "/workspace/datdq/SignWeather/data/metadata/roi_cache.json"
+
+NUM_SAMPLES = 32         # Frames sampled per raw video
+SEARCH_REGION = {'x': 0.0, 'y': 0.4, 'w': 0.5, 'h': 0.6}  # Where the signer inset is searched (relative)
+SAMPLE_HEIGHT = 360      # Search region is rescaled to this height before pose detection
+MIN_DETECTION_RATE = 0.25
+ROI_PADDING = 0.15       # Relative padding around the detected upper body
+BOX_PERCENTILE = 5       # ROI spans the 5th-95th percentile of the per-sample box edges
+DRIFT_THRESHOLD = 0.02   # Max spread of the ROI center across samples before a video is reported
+
+# Pose landmarks 0-24: face, shoulders, arms, hands and hips (no legs)
+UPPER_BODY_LANDMARKS = list(range(25))
+VIS_THRESHOLD = 0.5
+
+mp_pose = mp.solutions.pose
+
+
+def sample_frame_indices(frame_count, num_samples):
+    """Evenly spaced frame indices, skipping the first and last 5% (intro/outro)."""
+    if frame_count <= 0:
+        return []
+    start = int(frame_count * 0.05)
+    end = max(start + 1, int(frame_count * 0.95))
+    return sorted(set(np.linspace(start, end - 1, num_samples).astype(int).tolist()))
+
+
+def detect_signer_box(pose, frame, search_region=SEARCH_REGION, sample_height=SAMPLE_HEIGHT):
+    """
+    Locate the signer's upper body in one frame.
+
+    Returns:
+        (x0, y0, x1, y1) in full-frame relative coordinates, or None
+    """
+    h, w = frame.shape[:2]
+    sx, sy = int(search_region['x'] * w), int(search_region['y'] * h)
+    sw, sh = int(search_region['w'] * w), int(search_region['h'] * h)
+    region = frame[sy:sy+sh, sx:sx+sw]
+
+    scale = sample_height / max(1, region.shape[0])
+    region = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    results = pose.process(cv2.cvtColor(region, cv2.COLOR_BGR2RGB))
+    if not results.pose_landmarks:
+        return None
+
+    lms = results.pose_landmarks.landmark
+    pts = np.array([[lms[i].x, lms[i].y] for i in UPPER_BODY_LANDMARKS if lms[i].visibility > VIS_THRESHOLD])
+    if len(pts) < 4:
+        return None
+
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    # Search region coords -> full frame relative coords
+    return (
+        search_region['x'] + x0 * search_region['w'],
+        search_region['y'] + y0 * search_region['h'],
+        search_region['x'] + x1 * search_region['w'],
+        search_region['y'] + y1 * search_region['h'],
+    )
+
+
+def calibrate_video_roi(video_path, num_samples=NUM_SAMPLES, padding=ROI_PADDING):
+    """
+    Sample frames of a raw video, detect the signer and derive a per-video ROI.
+
+    Returns:
+        Dict with 'roi' ('x', 'y', 'w', 'h' relative, or None if the signer was
+        not found often enough), detection counts, 'drift' and timing.
+    """
+    t0 = time.perf_counter()
+    info = probe_video(video_path)
+    indices = sample_frame_indices(info['frame_count'], num_samples)
+
+    boxes = []
+    cap = cv2.VideoCapture(str(video_path))
+    with mp_pose.Pose(static_image_mode=True, model_complexity=1, min_detection_confidence=0.3) as pose:
+        for idx in indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            box = detect_signer_box(pose, frame)
+            if box is not None:
+                boxes.append(box)
+    cap.release()
+
+    elapsed = time.perf_counter() - t0
+    duration = info['frame_count'] / info['fps'] if info['fps'] else 0.0
+    result = {
+        "roi": None,
+        "samples": len(indices),
+        "detected": len(boxes),
+        "drift": None,
+        "drifting": False,
+        "seconds": round(elapsed, 2),
+        "video_seconds": round(duration, 2),
+    }
+
+    if not indices or len(boxes) < MIN_DETECTION_RATE * len(indices):
+        return result
+
+    boxes = np.array(boxes)
+    # Near-union of the sampled boxes: raised arms and leaning must stay inside the ROI
+    x0, y0 = np.percentile(boxes[:, :2], BOX_PERCENTILE, axis=0)
+    x1, y1 = np.percentile(boxes[:, 2:], 100 - BOX_PERCENTILE, axis=0)
+    pad_w, pad_h = (x1 - x0) * padding, (y1 - y0) * padding
+    x0, y0 = max(0.0, x0 - pad_w), max(0.0, y0 - pad_h)
+    x1, y1 = min(1.0, x1 + pad_w), min(1.0, y1 + pad_h)
+
+    # Drift: spread (10th-90th percentile) of the box center over time
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+    spread = np.percentile(centers, 90, axis=0) - np.percentile(centers, 10, axis=0)
+    drift = float(spread.max())
+
+    result.update({
+        "roi": {'x': round(float(x0), 4), 'y': round(float(y0), 4),
+                'w': round(float(x1 - x0), 4), 'h': round(float(y1 - y0), 4)},
+        "drift": round(drift, 4),
+        "drifting": drift > DRIFT_THRESHOLD,
+    })
+    return result
+
+
+# --- CACHE ---
+
+def load_roi_cache(cache_path=ROI_CACHE_PATH):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_roi_cache(cache, cache_path=ROI_CACHE_PATH):
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def get_cached_roi(video_id, cache, default=None):
+    """ROI for a raw video id (e.g. '0Gw4diTa1xA'), or default if not calibrated."""
+    entry = cache.get(video_id)
+    if entry and entry.get("roi"):
+        return entry["roi"]
+    return default
+
+
+def _is_fresh(entry, video_path):
+    stat = Path(video_path).stat()
+    return entry.get("source_size") == stat.st_size and entry.get("source_mtime") == int(stat.st_mtime)
+
+
+def update_roi_cache(video_paths, cache_path=ROI_CACHE_PATH, force=False):
+    """
+    Calibrate every video that is missing or stale in the cache.
+
+    Returns:
+        The updated cache dict
+    """
+    cache = load_roi_cache(cache_path)
+    for video_path in video_paths:
+        video_path = Path(video_path)
+        entry = cache.get(video_path.stem)
+        if entry and not force and _is_fresh(entry, video_path):
+            continue
+
+        try:
+            entry = calibrate_video_roi(video_path)
+        except Exception as e:
+            print(f"Error calibrating {video_path.name}: {e}")
+            continue
+
+        stat = video_path.stat()
+        entry["source_size"] = stat.st_size
+        entry["source_mtime"] = int(stat.st_mtime)
+        cache[video_path.stem] = entry
+        # Save after each video so an interrupted run keeps its progress
+        save_roi_cache(cache, cache_path)
+
+        status = "DRIFT" if entry["drifting"] else ("OK" if entry["roi"] else "NOT FOUND")
+        print(f"{video_path.stem}: {status} roi={entry['roi']} drift={entry['drift']} "
+              f"({entry['detected']}/{entry['samples']} detected, {entry['seconds']}s for {entry['video_seconds']}s of video)")
+    return cache
+
+
+def main():
+    video_paths = sorted(Path(RAW_VIDEO_DIR).glob("*.mp4"))
+    if not video_paths:
+        print(f"No videos found in {RAW_VIDEO_DIR}")
+        return
+
+    print(f"Calibrating signer ROI for {len(video_paths)} videos...")
+    cache = update_roi_cache(video_paths)
+
+    drifting = sorted(vid for vid, e in cache.items() if e.get("drifting"))
+    missing = sorted(vid for vid, e in cache.items() if not e.get("roi"))
+    spent = sum(e.get("seconds", 0) for e in cache.values())
+    total = sum(e.get("video_seconds", 0) for e in cache.values())
+
+    print("\n--- Summary ---")
+    print(f"Calibrated: {len(cache) - len(missing)}")
+    print(f"Signer not found: {len(missing)}")
+    print(f"ROI drifting (> {DRIFT_THRESHOLD}): {len(drifting)}")
+    for vid in drifting:
+        print(f"  {vid}: drift={cache[vid]['drift']}")
+    if total:
+        print(f"Calibration time: {spent:.1f}s for {total:.0f}s of video ({100 * spent / total:.2f}%)")
+    print(f"Cache: {ROI_CACHE_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
-from utils.common import run_cmd
-from utils.gpt_utils import call_gpt
+from utils.common import run_cmd, parse_video_id
+from utils.gpt_utils import call_gpt, call_gpt_batch
+from utils.video_catalog import get_catalog, YTDLP_BIN
 
 FILTER_SYSTEM_PROMPT = """
 Bạn là bộ lọc nội dung video cho dự án dữ liệu thời tiết, hiện tượng tự nhiên, thiên tai.
@@ -15,9 +16,17 @@ Chỉ trả lời duy nhất 1 từ: TRUE hoặc FALSE.
 """
 
 def get_video_title(url: str) -> str:
-    """Lấy tiêu đề video YouTube mà không cần download video."""
+    """Lấy tiêu đề video YouTube mà không cần download video (ưu tiên đọc từ catalog)."""
+    video_id = parse_video_id(url)
+    if video_id:
+        row = get_catalog().get(video_id)
+        if row and row.get("title"):
+            return row["title"]
+        if row and row.get("status") == "unavailable":
+            return ""
+
     cmd = [
-        "yt-dlp",
+        YTDLP_BIN,
         "--get-title",
         "--skip-download",
         "--no-playlist",
@@ -25,7 +34,10 @@ def get_video_title(url: str) -> str:
     ]
     try:
         res = run_cmd(cmd)
-        return res.stdout.strip()
+        title = res.stdout.strip()
+        if video_id and title:
+            get_catalog().set_title(video_id, title)
+        return title
     except Exception as e:
         print(f"Error getting title for URL {url}: {e}")
         return ""
@@ -43,3 +55,9 @@ def is_weather_related(url: str) -> bool:
     print(f"  => Decision: {'KEEP' if decision else 'SKIP'} ({response})")
     
     return decision
+
+def filter_titles(titles: list[str]) -> list[bool]:
+    """Check many already-known titles concurrently (empty titles -> False)."""
+    known = [t for t in titles if t]
+    answers = iter(call_gpt_batch(FILTER_SYSTEM_PROMPT, [f"Tiêu đề video: {t}" for t in known]))
+    return [("TRUE" in next(answers).strip().upper()) if t else False for t in titles]
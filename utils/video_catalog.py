@@ -0,0 +1,268 @@
+"""
+Local catalog of YouTube metadata (title, duration, upload date, formats).
+
+One yt-dlp process reads a batch file of URLs and dumps one JSON object per
+video; results are stored in SQLite so filtering, download planning and
+scheduling never ask YouTube twice.
+
+    python utils/video_catalog.py   # harvest every ID in INPUT_ID_FILE
+"""
+
+import json
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config import Config
+
+# --- CONFIGURATION ---
+INPUT_ID_FILE = "/workspace/datdq/SignWeather/data_collection/ids_2020_2024.txt"
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CATALOG_PATH = getattr(Config, "VIDEO_CATALOG_PATH", REPO_ROOT / "data/metadata/video_catalog.sqlite")
+YTDLP_BIN = getattr(Config, "YTDLP_BIN", "yt-dlp")  # Point at a stub executable for testing
+BATCH_SIZE = 200       # URLs per yt-dlp invocation
+FLAT = False           # --flat-playlist: faster, but no format info
+RETRY_UNAVAILABLE_AFTER = 7 * 24 * 3600  # Seconds before IDs that failed are asked again
+BATCH_RETRIES = 3      # Re-runs of a batch whose IDs failed for a non-permanent reason
+RETRY_BACKOFF = 30     # Seconds before the first re-run, doubled each time
+
+# yt-dlp error messages (lowercased) that mean the video itself is gone for us
+UNAVAILABLE_PATTERNS = ("video unavailable", "private video", "has been removed", "no longer available",
+                        "account associated with this video has been terminated",
+                        "not made this video available in your country", "confirm your age")
+# ... and ones that mean the request failed (rate limit, network); those IDs are retried
+TRANSIENT_PATTERNS = ("http error 429", "too many requests", "http error 5", "unable to download webpage",
+                      "urlopen error", "timed out", "temporary failure in name resolution",
+                      "connection reset", "connection refused", "network is unreachable",
+                      "confirm you're not a bot")
+ERROR_LINE = re.compile(r"ERROR: \[[^\]]+\] ([A-Za-z0-9_-]{11}): (.*)")
+
+COLUMNS = ["video_id", "title", "duration", "upload_date", "channel", "width", "height",
+           "vcodec", "acodec", "filesize_approx", "formats", "status", "fetched_at"]
+
+def video_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def summarize_info(info: dict) -> dict:
+    """Catalog row from one yt-dlp --dump-json object."""
+    formats = [
+        {k: f.get(k) for k in ("format_id", "ext", "vcodec", "acodec", "height", "fps", "filesize", "filesize_approx")}
+        for f in info.get("formats") or []
+    ]
+    return {
+        "video_id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "upload_date": info.get("upload_date"),
+        "channel": info.get("channel") or info.get("uploader"),
+        "width": info.get("width"),
+        "height": info.get("height"),
+        "vcodec": info.get("vcodec"),
+        "acodec": info.get("acodec"),
+        "filesize_approx": info.get("filesize_approx") or info.get("filesize"),
+        "formats": json.dumps(formats) if formats else None,
+        "status": "ok",
+        "fetched_at": time.time(),
+    }
+
+class VideoCatalog:
+    def __init__(self, path=CATALOG_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS videos ("
+            " video_id TEXT PRIMARY KEY, title TEXT, duration REAL, upload_date TEXT, channel TEXT,"
+            " width INTEGER, height INTEGER, vcodec TEXT, acodec TEXT, filesize_approx INTEGER,"
+            " formats TEXT, status TEXT, fetched_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_date ON videos(upload_date)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_duration ON videos(duration)")
+        self._conn.commit()
+
+    def get(self, video_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(row) if row else None
+
+    def upsert(self, rows: list) -> None:
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO videos ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                [tuple(row.get(c) for c in COLUMNS) for row in rows],
+            )
+            self._conn.commit()
+
+    def set_title(self, video_id: str, title: str) -> None:
+        """Record a title fetched outside harvest() without overwriting richer rows."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO videos (video_id, title, status, fetched_at) VALUES (?, ?, 'ok', ?) "
+                "ON CONFLICT(video_id) DO UPDATE SET title = excluded.title",
+                (video_id, title, time.time()),
+            )
+            self._conn.commit()
+
+    def missing(self, video_ids: list, refresh: bool = False) -> list:
+        """IDs with no usable row (failed ones are retried after RETRY_UNAVAILABLE_AFTER)."""
+        if refresh:
+            return list(video_ids)
+        now = time.time()
+        out = []
+        for vid in video_ids:
+            row = self.get(vid)
+            if row is None or (row["status"] != "ok" and now - (row["fetched_at"] or 0) > RETRY_UNAVAILABLE_AFTER):
+                out.append(vid)
+        return out
+
+    def plan_by_duration(self, video_ids: list, max_duration: float = None) -> list:
+        """
+        Known-available IDs ordered longest first (so long bulletins do not end up
+        as the tail of a worker pool), optionally capped by duration.
+        Unknown IDs are appended at the end in input order.
+        """
+        known, unknown = [], []
+        for vid in video_ids:
+            row = self.get(vid)
+            if row is None or row["duration"] is None:
+                if row is None or row["status"] == "ok":
+                    unknown.append(vid)
+                continue
+            if max_duration is None or row["duration"] <= max_duration:
+                known.append((row["duration"], vid))
+        return [vid for _, vid in sorted(known, reverse=True)] + unknown
+
+    def close(self):
+        self._conn.close()
+
+def run_ytdlp_batch(urls: list, flat: bool = FLAT, ytdlp_bin: str = YTDLP_BIN) -> tuple:
+    """
+    One yt-dlp process for all urls.
+
+    Returns:
+        (parsed JSON objects, stderr, exit code); failed URLs are absent from the objects
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        f.write("\n".join(urls) + "\n")
+        batch_file = f.name
+
+    cmd = [ytdlp_bin, "--dump-json", "--skip-download", "--no-playlist", "--ignore-errors", "--no-warnings",
+           "-a", batch_file]
+    if flat:
+        cmd.append("--flat-playlist")
+    try:
+        # --ignore-errors exits non-zero when some URLs fail; the rest of stdout is still valid
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    finally:
+        Path(batch_file).unlink(missing_ok=True)
+
+    infos = []
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if line.startswith("{"):
+            try:
+                infos.append(json.loads(line))
+            except ValueError:
+                continue
+    return infos, result.stderr, result.returncode
+
+def classify_ytdlp_errors(stderr: str) -> tuple:
+    """
+    Returns:
+        unavailable: {video_id: message} for IDs yt-dlp reports as private, removed or unavailable
+        transient: True if any error looks like a rate limit or network failure
+    """
+    unavailable, transient = {}, False
+    for line in (stderr or "").splitlines():
+        lower = line.lower()
+        if any(p in lower for p in TRANSIENT_PATTERNS):
+            transient = True
+            continue
+        m = ERROR_LINE.search(line)
+        if m and any(p in lower for p in UNAVAILABLE_PATTERNS):
+            unavailable[m.group(1)] = m.group(2).strip()
+    return unavailable, transient
+
+def harvest(video_ids: list, catalog: VideoCatalog = None, batch_size: int = BATCH_SIZE,
+            flat: bool = FLAT, refresh: bool = False) -> dict:
+    """
+    Fetch metadata for IDs not in the catalog yet.
+
+    Only IDs that yt-dlp reports as private/removed/unavailable are stored as
+    "unavailable". IDs that failed for any other reason get no row. A batch
+    with rate-limit/network errors, or one that failed as a whole, is re-run
+    for those IDs with backoff, and RuntimeError is raised if they still fail.
+    Other per-ID errors are left for the next harvest.
+
+    Returns:
+        Counts: requested, fetched, unavailable, cached, errors
+    """
+    catalog = catalog or VideoCatalog()
+    todo = catalog.missing(list(dict.fromkeys(video_ids)), refresh)
+    counts = {"requested": len(video_ids), "cached": len(set(video_ids)) - len(todo), "fetched": 0,
+              "unavailable": 0, "errors": 0}
+
+    for i in range(0, len(todo), batch_size):
+        batch = todo[i:i + batch_size]
+        t0 = time.perf_counter()
+        pending = batch
+        fetched = unavailable = 0
+        for attempt in range(BATCH_RETRIES + 1):
+            infos, stderr, returncode = run_ytdlp_batch([video_url(vid) for vid in pending], flat)
+            rows = [summarize_info(info) for info in infos if info.get("id")]
+            got = {row["video_id"] for row in rows}
+            reported, transient = classify_ytdlp_errors(stderr)
+            gone = {vid for vid in pending if vid in reported and vid not in got}
+            rows += [{"video_id": vid, "status": "unavailable", "fetched_at": time.time()} for vid in sorted(gone)]
+            catalog.upsert(rows)
+            fetched += len(got)
+            unavailable += len(gone)
+            pending = [vid for vid in pending if vid not in got and vid not in gone]
+
+            failed_whole = returncode != 0 and not got and not gone
+            if not pending or not (transient or failed_whole):
+                break
+            if attempt == BATCH_RETRIES:
+                raise RuntimeError(f"yt-dlp batch failed for {len(pending)} IDs after {attempt + 1} attempts "
+                                   f"(exit {returncode}): {stderr.strip()[-500:]}")
+            delay = RETRY_BACKOFF * 2 ** attempt
+            print(f"yt-dlp batch: {len(pending)} IDs failed (rate limit / network), retrying in {delay}s")
+            time.sleep(delay)
+
+        counts["fetched"] += fetched
+        counts["unavailable"] += unavailable
+        counts["errors"] += len(pending)
+        print(f"Catalog batch {i // batch_size + 1}: {fetched}/{len(batch)} videos, {unavailable} unavailable, "
+              f"{len(pending)} errors in {time.perf_counter() - t0:.1f}s")
+    return counts
+
+_default_catalog = None
+
+def get_catalog() -> VideoCatalog:
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = VideoCatalog()
+    return _default_catalog
+
+def main():
+    if not Path(INPUT_ID_FILE).exists():
+        print(f"Error: Input file {INPUT_ID_FILE} not found.")
+        return
+    with open(INPUT_ID_FILE, "r") as f:
+        video_ids = [line.strip() for line in f if line.strip()]
+
+    print(f"Loaded {len(video_ids)} IDs. Catalog: {CATALOG_PATH}")
+    counts = harvest(video_ids)
+    print(f"Cached: {counts['cached']}, fetched: {counts['fetched']}, unavailable: {counts['unavailable']}, "
+          f"errors: {counts['errors']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import cv2
 from pathlib import Path
 
+from utils.frame_source import FrameSource
+
 def crop_video(input_path, output_path, crop_params):
     """
     Crop video based on relative coordinates (0-1 range).
@@ -13,21 +15,9 @@ def crop_video(input_path, output_path, crop_params):
     Returns:
         frame_count: Number of frames processed
     """
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video: {input_path}")
-    
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    x = int(crop_params['x'] * orig_w)
-    y = int(crop_params['y'] * orig_h)
-    w = int(crop_params['w'] * orig_w)
-    h = int(crop_params['h'] * orig_h)
-    
-    if w % 2 != 0: w -= 1
-    if h % 2 != 0: h -= 1
+    source = FrameSource(input_path, crop=crop_params)
+    fps = source.fps
+    w, h = source.width, source.height
     
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(str(output_path), fourcc, fps, (w, h))
@@ -37,16 +27,11 @@ def crop_video(input_path, output_path, crop_params):
         out = cv2.VideoWriter(str(output_path), fourcc, fps, (w, h))
     
     frame_count = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        crop_frame = frame[y:y+h, x:x+w]
-        out.write(crop_frame)
-        frame_count += 1
+    with source:
+        for _, crop_frame in source:
+            out.write(crop_frame)
+            frame_count += 1
     
-    cap.release()
     out.release()
     
     return frame_count
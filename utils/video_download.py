@@ -1,7 +1,11 @@
-import re
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
-from utils.common import run_cmd, ensure_dir_exists
+from utils.common import run_cmd, ensure_dir_exists, parse_video_id
 from config import Config
 
 
@@ -20,33 +24,9 @@ def get_video_urls(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> list[str]
         print(f"Failed to download {url}: {e}")
         return None
 
-def parse_video_id(url: str) -> Optional[str]:
-    patterns = [
-        r'(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]+)',
-        r'youtube\.com/embed/([a-zA-Z0-9_-]+)',
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
-
-def download_video(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> Optional[Path]:
-    ensure_dir_exists(out_dir)
+def fetch_raw_video(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> Optional[Path]:
+    """yt-dlp step of download_video. Returns the raw downloaded file (not yet normalized)."""
     video_id = parse_video_id(url)
-    if not video_id:
-        print(f"Cannot parse video ID from URL: {url}")
-        return None
-    
-    final_mp4 = out_dir / f"{video_id}.mp4"
-    if final_mp4.exists():
-        if final_mp4.stat().st_size > 0:
-            print(f"Video already exists: {final_mp4}")
-            return final_mp4
-        else:
-             final_mp4.unlink()
-    
-    
     print(f"Downloading (VSWD style): {url}")
 
     temp_pattern = str(out_dir / f"{video_id}.%(ext)s")
@@ -60,45 +40,92 @@ def download_video(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> Optional[
         url
     ]
     
-    try:
-        run_cmd(cmd_dl)
-        
-        # Tìm file vừa down
-        # Exclude .part and .ytdl which are temporary
-        candidates = [p for p in out_dir.glob(f"{video_id}.*") 
-                      if not p.name.endswith(".part") and not p.name.endswith(".ytdl")]
-        
-        # Filter out the temp raw file we might have created in a previous failed run
-        candidates = [p for p in candidates if not p.name.endswith("_temp_raw.mp4")]
-        
-        # If final MP4 exists in candidates (maybe from a previous partial run?)
-        # we can't trust it unless we verify it. But logic start checked final_mp4 existence.
-        # So here candidates are likely the raw download.
-        
-        if not candidates:
-            print(f"Error: Downloaded file not found per ID {video_id}")
-            # Debug: List what IS there
-            all_files = list(out_dir.glob(f"{video_id}*"))
-            print(f"   Debug: Files found match video_id: {[f.name for f in all_files]}")
-            return None
-            
-        # Pick the most likely video file (largest size usually)
-        raw_file = max(candidates, key=lambda p: p.stat().st_size)
+    run_cmd(cmd_dl)
+    
+    # Tìm file vừa down
+    # Exclude .part and .ytdl which are temporary
+    candidates = [p for p in out_dir.glob(f"{video_id}.*") 
+                  if not p.name.endswith(".part") and not p.name.endswith(".ytdl")]
+    
+    # Filter out the temp raw file we might have created in a previous failed run
+    candidates = [p for p in candidates if not p.name.endswith("_temp_raw.mp4")]
+    
+    # If final MP4 exists in candidates (maybe from a previous partial run?)
+    # we can't trust it unless we verify it. But logic start checked final_mp4 existence.
+    # So here candidates are likely the raw download.
+    
+    if not candidates:
+        print(f"Error: Downloaded file not found per ID {video_id}")
+        # Debug: List what IS there
+        all_files = list(out_dir.glob(f"{video_id}*"))
+        print(f"   Debug: Files found match video_id: {[f.name for f in all_files]}")
+        return None
         
-        if raw_file.stat().st_size < 1024:
-            print(f"Error: Downloaded file too small ({raw_file.stat().st_size} bytes): {raw_file.name}")
-            return None
+    # Pick the most likely video file (largest size usually)
+    raw_file = max(candidates, key=lambda p: p.stat().st_size)
+    
+    if raw_file.stat().st_size < 1024:
+        print(f"Error: Downloaded file too small ({raw_file.stat().st_size} bytes): {raw_file.name}")
+        return None
+    return raw_file
 
-        # Chuẩn hóa sang MP4 (AAC + H264)
-        # Trường hợp raw_file trùng tên final_mp4 (do yt-dlp tự ra mp4)
-        if raw_file.resolve() == final_mp4.resolve():
-            temp_name = out_dir / f"{video_id}_temp_raw.mp4"
-            # Move raw to temp to clear the path for final output
-            raw_file.rename(temp_name)
-            raw_file = temp_name
-            
-        print(f"Converting/Standardizing to MP4: {final_mp4.name} (Source: {raw_file.name})")
-        
+def probe_streams(path: Path) -> dict:
+    """codec_type -> {codec_name, pix_fmt} of the first stream of each type."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,pix_fmt",
+        "-of", "json",
+        str(path)
+    ]
+    streams = {}
+    for stream in json.loads(run_cmd(cmd).stdout).get("streams", []):
+        streams.setdefault(stream.get("codec_type"), stream)
+    return streams
+
+def is_remux_compliant(streams: dict) -> bool:
+    """True if the streams already are what the libx264/AAC conversion would produce."""
+    video = streams.get("video")
+    audio = streams.get("audio")
+    if video is None or video.get("codec_name") != "h264" or video.get("pix_fmt") not in ("yuv420p", "yuvj420p"):
+        return False
+    return audio is None or audio.get("codec_name") == "aac"
+
+def normalize_video(raw_file: Path, final_mp4: Path) -> tuple:
+    """
+    Standardize a raw download to MP4 (H.264 + AAC).
+    Streams that are already compliant are remuxed with -c copy instead of re-encoded.
+
+    Returns:
+        (final path or None, "remux" | "encode")
+    """
+    out_dir = final_mp4.parent
+    video_id = final_mp4.stem
+
+    # Chuẩn hóa sang MP4 (AAC + H264)
+    # Trường hợp raw_file trùng tên final_mp4 (do yt-dlp tự ra mp4)
+    if raw_file.resolve() == final_mp4.resolve():
+        temp_name = out_dir / f"{video_id}_temp_raw.mp4"
+        # Move raw to temp to clear the path for final output
+        raw_file.rename(temp_name)
+        raw_file = temp_name
+
+    try:
+        remux = is_remux_compliant(probe_streams(raw_file))
+    except Exception:
+        remux = False
+    method = "remux" if remux else "encode"
+    print(f"Converting/Standardizing to MP4 ({method}): {final_mp4.name} (Source: {raw_file.name})")
+
+    if remux:
+        cmd_convert = [
+            "ffmpeg", "-y",
+            "-i", str(raw_file),
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            str(final_mp4)
+        ]
+    else:
         cmd_convert = [
             "ffmpeg", "-y",
             "-i", str(raw_file),
@@ -107,24 +134,65 @@ def download_video(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> Optional[
             "-strict", "experimental",
             str(final_mp4)
         ]
-        
-        run_cmd(cmd_convert)
-        
-        # Clean up raw temp file
-        if raw_file.exists() and raw_file.resolve() != final_mp4.resolve():
-             raw_file.unlink()
-             
-        if final_mp4.exists() and final_mp4.stat().st_size > 0:
-            print(f"Success: {final_mp4}")
+
+    run_cmd(cmd_convert)
+
+    # Clean up raw temp file
+    if raw_file.exists() and raw_file.resolve() != final_mp4.resolve():
+         raw_file.unlink()
+         
+    if final_mp4.exists() and final_mp4.stat().st_size > 0:
+        print(f"Success: {final_mp4}")
+        return final_mp4, method
+    return None, method
+
+def _existing_video(final_mp4: Path) -> Optional[Path]:
+    if final_mp4.exists():
+        if final_mp4.stat().st_size > 0:
+            print(f"Video already exists: {final_mp4}")
             return final_mp4
         else:
+             final_mp4.unlink()
+    return None
+
+def download_video(url: str, out_dir: Path = Config.RAW_VIDEOS_DIR) -> Optional[Path]:
+    ensure_dir_exists(out_dir)
+    video_id = parse_video_id(url)
+    if not video_id:
+        print(f"Cannot parse video ID from URL: {url}")
+        return None
+    
+    final_mp4 = out_dir / f"{video_id}.mp4"
+    if _existing_video(final_mp4):
+        return final_mp4
+    
+    try:
+        raw_file = fetch_raw_video(url, out_dir)
+        if raw_file is None:
             return None
+        final, _ = normalize_video(raw_file, final_mp4)
+        return final
 
     except Exception as e:
         print(f"Failed to download/convert {url}: {e}")
         return None
 
-from utils.title_filter import is_weather_related
+from utils.title_filter import is_weather_related, filter_titles
+from utils.phash import PerceptualIndex, dedup_thumbnails
+from utils.video_catalog import get_catalog, harvest
+
+def drop_duplicate_thumbnails(urls: list[str], thumb_dir: Path, index_path: Path = None) -> list[str]:
+    """Drop URLs whose thumbnail is a near-duplicate of an earlier (or already indexed) video."""
+    index = PerceptualIndex(index_path)
+    ids = [parse_video_id(url) for url in urls]
+    kept_ids, duplicates = dedup_thumbnails([vid for vid in ids if vid], thumb_dir, index)
+    index.save()
+
+    for dup, original in duplicates.items():
+        print(f"Skipping near-duplicate thumbnail: {dup} ~ {original}")
+    print(f"Thumbnail dedup: {len(duplicates)}/{len(urls)} links dropped before title check and download")
+    kept = set(kept_ids)
+    return [url for url, vid in zip(urls, ids) if vid is None or vid in kept]
 
 def download_all_from_links_file(links_file: Path = Config.LINKS_FILE) -> list[Path]:
     if not links_file.exists():
@@ -137,6 +205,10 @@ def download_all_from_links_file(links_file: Path = Config.LINKS_FILE) -> list[P
     downloaded = []
     print(f"Found {len(urls)} links. Starting filter & download process...")
 
+    thumb_dir = getattr(Config, "THUMBNAIL_DIR", None)
+    if thumb_dir:
+        urls = drop_duplicate_thumbnails(urls, Path(thumb_dir), getattr(Config, "PHASH_INDEX_PATH", None))
+
     for url in urls:
         if not is_weather_related(url):
             print(f"Skipping non-weather video: {url}")
@@ -147,3 +219,158 @@ def download_all_from_links_file(links_file: Path = Config.LINKS_FILE) -> list[P
             downloaded.append(video_path)
     
     return downloaded
+
+def download_all_pipelined(links_file: Path = Config.LINKS_FILE, out_dir: Path = Config.RAW_VIDEOS_DIR,
+                           metadata_workers: int = 8, download_workers: int = 3,
+                           normalize_workers: int = None, use_catalog: bool = True,
+                           max_duration: float = None) -> tuple:
+    """
+    Pipelined download_all_from_links_file:
+    title/GPT checks run concurrently, passing URLs go to a bounded yt-dlp pool,
+    and finished downloads go to a separate normalization (ffmpeg) pool.
+    With use_catalog, metadata for all links is harvested in one yt-dlp batch
+    first; unavailable videos and videos longer than max_duration are dropped,
+    the longest videos are queued first, and the catalog titles are checked in
+    one concurrent GPT batch (links without a catalog title fall back to is_weather_related).
+
+    Returns:
+        (final video paths, stats); stats["failed_urls"] lists every URL that failed in any stage
+    """
+    if not links_file.exists():
+        print(f"Links file not found: {links_file}")
+        return [], {}
+    ensure_dir_exists(out_dir)
+
+    with open(links_file, 'r') as f:
+        urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    thumb_dir = getattr(Config, "THUMBNAIL_DIR", None)
+    if thumb_dir:
+        urls = drop_duplicate_thumbnails(urls, Path(thumb_dir), getattr(Config, "PHASH_INDEX_PATH", None))
+
+    if use_catalog:
+        catalog = get_catalog()
+        harvest([vid for vid in map(parse_video_id, urls) if vid], catalog)
+        by_id = {parse_video_id(url): url for url in urls}
+        planned = catalog.plan_by_duration([vid for vid in by_id if vid], max_duration)
+        print(f"Catalog plan: {len(planned)}/{len(urls)} links available"
+              + (f" and <= {max_duration}s" if max_duration else ""))
+        urls = [by_id[vid] for vid in planned]
+
+        to_check = [(by_id[vid], (catalog.get(vid) or {}).get("title")) for vid in planned
+                    if not _existing_video(out_dir / f"{vid}.mp4")]
+        to_check = [(url, title) for url, title in to_check if title]
+        title_ok = dict(zip((url for url, _ in to_check), filter_titles([title for _, title in to_check])))
+        print(f"Title filter: {sum(title_ok.values())}/{len(title_ok)} catalog titles weather-related")
+    else:
+        title_ok = {}
+
+    normalize_workers = normalize_workers or max(1, (os.cpu_count() or 2) // 2)
+    print(f"Found {len(urls)} links. Pipeline: {metadata_workers} metadata / "
+          f"{download_workers} download / {normalize_workers} normalize workers")
+
+    stats = {"links": len(urls), "skipped_filter": 0, "existing": 0, "downloaded": 0,
+             "remux": 0, "encode": 0, "failed": 0, "failed_urls": [], "bytes": 0,
+             "download_seconds": 0.0, "normalize_seconds": 0.0}
+    lock = threading.Lock()
+    results = []
+    t0 = time.perf_counter()
+
+    def count(key, value=1):
+        with lock:
+            stats[key] += value
+
+    def fail(url, reason):
+        print(f"{reason}: {url}")
+        with lock:
+            stats["failed"] += 1
+            stats["failed_urls"].append(url)
+
+    def guarded(stage, worker):
+        """Any exception in a stage marks its URL failed (a done-callback would lose it)."""
+        def run(url, *args):
+            try:
+                return worker(url, *args)
+            except Exception as e:
+                fail(url, f"{stage} failed ({type(e).__name__}: {e})")
+                return None
+        return run
+
+    def check(url):
+        video_id = parse_video_id(url)
+        if not video_id:
+            fail(url, "Cannot parse video ID from URL")
+            return None
+        final_mp4 = out_dir / f"{video_id}.mp4"
+        if _existing_video(final_mp4):
+            count("existing")
+            return final_mp4
+        if not (title_ok[url] if url in title_ok else is_weather_related(url)):
+            print(f"Skipping non-weather video: {url}")
+            count("skipped_filter")
+            return None
+        return url
+
+    def fetch(url):
+        t = time.perf_counter()
+        try:
+            raw_file = fetch_raw_video(url, out_dir)
+        finally:
+            count("download_seconds", time.perf_counter() - t)
+        if raw_file is None:
+            fail(url, "Failed to download")
+            return None
+        count("downloaded")
+        count("bytes", raw_file.stat().st_size)
+        return url, raw_file, out_dir / f"{parse_video_id(url)}.mp4"
+
+    def normalize(url, raw_file, final_mp4):
+        t = time.perf_counter()
+        try:
+            final, method = normalize_video(raw_file, final_mp4)
+        finally:
+            count("normalize_seconds", time.perf_counter() - t)
+        if final is None:
+            fail(url, f"Failed to convert {raw_file.name}")
+        else:
+            count(method)
+        return final
+
+    meta_pool = ThreadPoolExecutor(metadata_workers)
+    dl_pool = ThreadPoolExecutor(download_workers)
+    norm_pool = ThreadPoolExecutor(normalize_workers)
+
+    # Each stage hands its result to the next pool from a done-callback, so a
+    # download is normalized as soon as it finishes while other links are still checked.
+    # Workers are guarded, so future.result() never raises here.
+    def on_checked(future):
+        res = future.result()
+        if isinstance(res, Path):
+            results.append(res)
+        elif res is not None:
+            dl_pool.submit(guarded("Download", fetch), res).add_done_callback(on_fetched)
+
+    def on_fetched(future):
+        res = future.result()
+        if res is not None:
+            norm_pool.submit(guarded("Normalize", normalize), *res).add_done_callback(on_normalized)
+
+    def on_normalized(future):
+        if future.result() is not None:
+            results.append(future.result())
+
+    for url in urls:
+        meta_pool.submit(guarded("Check", check), url).add_done_callback(on_checked)
+    # Callbacks run before a worker exits, so each shutdown sees all work queued by the previous stage
+    meta_pool.shutdown(wait=True)
+    dl_pool.shutdown(wait=True)
+    norm_pool.shutdown(wait=True)
+
+    wall = time.perf_counter() - t0
+    print("\n--- Download throughput ---")
+    print(f"Links: {stats['links']} | already present: {stats['existing']} | filtered out: {stats['skipped_filter']} | failed: {stats['failed']}")
+    print(f"Downloaded: {stats['downloaded']} ({stats['bytes'] / 1e9:.2f} GB) | remuxed: {stats['remux']} | re-encoded: {stats['encode']}")
+    print(f"Wall: {wall:.1f}s | download busy: {stats['download_seconds']:.1f}s | normalize busy: {stats['normalize_seconds']:.1f}s")
+    if wall > 0:
+        print(f"Throughput: {stats['bytes'] / 1e6 / wall:.2f} MB/s, {3600 * (stats['remux'] + stats['encode']) / wall:.1f} videos/h")
+    return results, stats
@@ -1,6 +1,8 @@
 import cv2
 from pathlib import Path
 
+from utils.frame_source import FrameSource, probe_video, crop_to_pixels
+
 def scale_video(input_path, output_path, scale_factor, interpolation=cv2.INTER_CUBIC):
     """
     Scale video by a factor.
@@ -14,16 +16,14 @@ def scale_video(input_path, output_path, scale_factor, interpolation=cv2.INTER_C
     Returns:
         frame_count: Number of frames processed
     """
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video: {input_path}")
+    info = probe_video(input_path)
     
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    new_w = info['width'] * scale_factor
+    new_h = info['height'] * scale_factor
     
-    new_w = orig_w * scale_factor
-    new_h = orig_h * scale_factor
+    # Scaling happens on the decoder thread
+    source = FrameSource(input_path, size=(new_w, new_h), interpolation=interpolation)
+    fps = source.fps
     
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(str(output_path), fourcc, fps, (new_w, new_h))
@@ -34,16 +34,11 @@ def scale_video(input_path, output_path, scale_factor, interpolation=cv2.INTER_C
         out = cv2.VideoWriter(str(output_path), fourcc, fps, (new_w, new_h))
     
     frame_count = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        scaled_frame = cv2.resize(frame, (new_w, new_h), interpolation=interpolation)
-        out.write(scaled_frame)
-        frame_count += 1
-    
-    cap.release()
+    with source:
+        for _, scaled_frame in source:
+            out.write(scaled_frame)
+            frame_count += 1
+    
     out.release()
     
     return frame_count
@@ -62,25 +57,16 @@ def crop_and_scale_video(input_path, output_path, crop_params, scale_factor, int
     Returns:
         frame_count: Number of frames processed
     """
-    cap = cv2.VideoCapture(str(input_path))
-    if not cap.isOpened():
-        raise ValueError(f"Cannot open video: {input_path}")
-    
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    x = int(crop_params['x'] * orig_w)
-    y = int(crop_params['y'] * orig_h)
-    w = int(crop_params['w'] * orig_w)
-    h = int(crop_params['h'] * orig_h)
-    
-    if w % 2 != 0: w -= 1
-    if h % 2 != 0: h -= 1
+    info = probe_video(input_path)
+    _, _, w, h = crop_to_pixels(crop_params, info['width'], info['height'])
     
     final_w = w * scale_factor
     final_h = h * scale_factor
     
+    # Crop and scale both happen on the decoder thread
+    source = FrameSource(input_path, crop=crop_params, size=(final_w, final_h), interpolation=interpolation)
+    fps = source.fps
+    
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(str(output_path), fourcc, fps, (final_w, final_h))
     
@@ -90,17 +76,11 @@ def crop_and_scale_video(input_path, output_path, crop_params, scale_factor, int
         out = cv2.VideoWriter(str(output_path), fourcc, fps, (final_w, final_h))
     
     frame_count = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        crop_frame = frame[y:y+h, x:x+w]
-        scaled_frame = cv2.resize(crop_frame, (final_w, final_h), interpolation=interpolation)
-        out.write(scaled_frame)
-        frame_count += 1
-    
-    cap.release()
+    with source:
+        for _, scaled_frame in source:
+            out.write(scaled_frame)
+            frame_count += 1
+    
     out.release()
     
     return frame_count
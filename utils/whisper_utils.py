@@ -1,33 +1,74 @@
+import asyncio
 import json
+import tempfile
+import wave
 from pathlib import Path
 from typing import Dict, List
+import numpy as np
 from openai import OpenAI
 from config import Config
 from utils.common import ensure_dir_exists
+from utils.ffmpeg_utils import extract_audio_compressed
+from utils.llm_cache import get_llm_cache, audio_key
+from utils.openai_client import get_async_client
+from utils.profiling import span
 
 client = OpenAI(api_key=Config.OPENAI_API_KEY)
 
 def run_whisper_verbose(input_wav: Path, out_json: Path) -> dict:
     ensure_dir_exists(out_json.parent)
-    print("Run Whisper verbose_json...")
-    
-    with open(input_wav, "rb") as f:
-        resp = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=f,
-            response_format="verbose_json",
-        )
-    
-    try:
-        data = resp.model_dump()
-    except Exception:
-        data = resp
+
+    def compute():
+        print("Run Whisper verbose_json...")
+        with open(input_wav, "rb") as f, span("openai.transcribe.request"):
+            resp = client.audio.transcriptions.create(
+                model="whisper-1",
+                file=f,
+                response_format="verbose_json",
+            )
+        try:
+            return resp.model_dump()
+        except Exception:
+            return resp
+
+    # Keyed by audio content: a re-extracted but identical WAV is not transcribed again
+    key = audio_key(input_wav, "whisper-1", response_format="verbose_json")
+    data = get_llm_cache().get_or_compute(key, compute, kind="audio")
         
     with open(out_json, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
     
     return data
 
+def run_whisper_verbose_stream(video_path: Path, out_json: Path, codec: str = "opus", audio_cache_dir: Path = None) -> dict:
+    """
+    Same result as extract_audio_to_wav + run_whisper_verbose, but the audio is
+    encoded with a speech codec and uploaded straight from ffmpeg's output.
+    A one-hour bulletin at 24 kbps is ~11 MB, so it fits a single upload.
+    """
+    ensure_dir_exists(out_json.parent)
+    name, audio = extract_audio_compressed(video_path, codec, cache_dir=audio_cache_dir)
+
+    def compute():
+        print(f"Run Whisper verbose_json ({name}, {len(audio) / 1e6:.1f} MB)...")
+        with span("openai.transcribe.request"):
+            resp = client.audio.transcriptions.create(
+                model="whisper-1",
+                file=(name, audio),
+                response_format="verbose_json",
+            )
+        try:
+            return resp.model_dump()
+        except Exception:
+            return resp
+
+    key = audio_key(audio, "whisper-1", response_format="verbose_json")
+    data = get_llm_cache().get_or_compute(key, compute, kind="audio")
+
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
 def extract_segments(whisper_json: dict) -> List[dict]:
     segs = whisper_json.get("segments", []) or []
     segs = sorted(segs, key=lambda s: s["start"])
@@ -54,3 +95,157 @@ def extract_segments(whisper_json: dict) -> List[dict]:
         prev_end = end
 
     return results
+
+# --- CHUNKED TRANSCRIPTION ---
+
+WHISPER_CHUNK_SECONDS = getattr(Config, "WHISPER_CHUNK_SECONDS", 600)   # 16 kHz mono PCM: ~19 MB, under the 25 MB upload limit
+WHISPER_SPLIT_SEARCH_SECONDS = 20.0   # Look this far back from each chunk limit for the quietest point
+WHISPER_CHUNK_OVERLAP_SECONDS = 1.0   # Audio shared by neighbouring chunks so no word is cut at a boundary
+ENERGY_FRAME_MS = 30
+
+def find_split_points(samples: np.ndarray, sample_rate: int, max_chunk_seconds: float = WHISPER_CHUNK_SECONDS,
+                      search_seconds: float = WHISPER_SPLIT_SEARCH_SECONDS) -> List[int]:
+    """
+    Sample positions where the audio is cut: the lowest-RMS frame within
+    search_seconds before each max_chunk_seconds limit.
+    """
+    frame_len = max(1, int(sample_rate * ENERGY_FRAME_MS / 1000))
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return []
+    frames = samples[:n_frames * frame_len].astype(np.float32).reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+
+    max_frames = max(1, int(max_chunk_seconds * sample_rate / frame_len))
+    # Never search more than half a chunk back, so every chunk is at least max_chunk_seconds / 2
+    search_frames = min(max_frames // 2, int(search_seconds * sample_rate / frame_len))
+    points, start = [], 0
+    while n_frames - start > max_frames:
+        lo, hi = start + max_frames - search_frames, start + max_frames
+        cut = lo + int(np.argmin(rms[lo:hi]))
+        points.append(cut * frame_len)
+        start = cut
+    return points
+
+def split_wav(input_wav: Path, out_dir: Path, max_chunk_seconds: float = WHISPER_CHUNK_SECONDS,
+              overlap_seconds: float = WHISPER_CHUNK_OVERLAP_SECONDS) -> List[dict]:
+    """
+    Split a PCM WAV at low-energy points.
+
+    Returns:
+        One dict per chunk: path, offset (seconds of the chunk start in the
+        original file) and the [core_start, core_end) range this chunk owns
+        when segments are stitched back together.
+    """
+    with wave.open(str(input_wav), "rb") as wf:
+        params = wf.getparams()
+        raw = wf.readframes(params.nframes)
+    if params.sampwidth != 2:
+        raise ValueError(f"Expected 16-bit PCM WAV, got sample width {params.sampwidth}: {input_wav}")
+
+    sr = params.framerate
+    audio = np.frombuffer(raw, dtype=np.int16).reshape(-1, params.nchannels)
+    total = len(audio)
+    cuts = [0] + find_split_points(audio.mean(axis=1), sr, max_chunk_seconds) + [total]
+    overlap = int(overlap_seconds * sr)
+
+    ensure_dir_exists(out_dir)
+    chunks = []
+    for i in range(len(cuts) - 1):
+        lo = max(0, cuts[i] - overlap)
+        hi = min(total, cuts[i + 1] + overlap)
+        path = out_dir / f"{Path(input_wav).stem}_chunk{i:03d}.wav"
+        with wave.open(str(path), "wb") as out:
+            out.setnchannels(params.nchannels)
+            out.setsampwidth(params.sampwidth)
+            out.setframerate(sr)
+            out.writeframes(audio[lo:hi].tobytes())
+        chunks.append({
+            "path": path,
+            "offset": lo / sr,
+            "core_start": cuts[i] / sr,
+            "core_end": cuts[i + 1] / sr,
+        })
+    return chunks
+
+async def _atranscribe_chunk(path: Path) -> dict:
+    cache = get_llm_cache()
+    key = audio_key(path, "whisper-1", response_format="verbose_json")
+    data = cache.get(key)
+    if data is None:
+        resp = await get_async_client().transcribe(path, response_format="verbose_json")
+        try:
+            data = resp.model_dump()
+        except Exception:
+            data = resp
+        cache.put(key, data, kind="audio")
+    return data
+
+def stitch_segments(chunks: List[dict], results: List[dict]) -> dict:
+    """
+    Merge per-chunk verbose_json results into one.
+    Timestamps are shifted by each chunk's offset, a segment is kept by the
+    chunk whose core range contains its midpoint, and overlaps are clamped
+    the same way as extract_segments (start < prev_end -> start = prev_end).
+    """
+    segments = []
+    for chunk, data in zip(chunks, results):
+        for seg in data.get("segments", []) or []:
+            start = float(seg["start"]) + chunk["offset"]
+            end = float(seg["end"]) + chunk["offset"]
+            mid = (start + end) / 2.0
+            if not (chunk["core_start"] <= mid < chunk["core_end"]):
+                continue
+            segments.append({**seg, "start": start, "end": end})
+
+    segments.sort(key=lambda s: s["start"])
+    prev_end = 0.0
+    for idx, seg in enumerate(segments):
+        if seg["start"] < prev_end:
+            seg["start"] = prev_end
+        seg["end"] = max(seg["end"], seg["start"])
+        seg["id"] = idx
+        prev_end = seg["end"]
+
+    language = next((r.get("language") for r in results if r.get("language")), None)
+    return {
+        "task": "transcribe",
+        "language": language,
+        "duration": chunks[-1]["core_end"] if chunks else 0.0,
+        "text": " ".join((s.get("text") or "").strip() for s in segments).strip(),
+        "segments": segments,
+    }
+
+def run_whisper_chunked(input_wav: Path, out_json: Path, plain_json: Path = None,
+                        max_chunk_seconds: float = WHISPER_CHUNK_SECONDS) -> dict:
+    """
+    Chunked, concurrent replacement for run_whisper_verbose.
+    Chunks are cached by content, so only changed audio is re-sent.
+    If plain_json is given, the plain transcript ({"text": ...}, as written by
+    gpt_utils.run_gpt4o_full_transcript) is derived from the verbose result
+    instead of a second transcription call.
+    """
+    ensure_dir_exists(out_json.parent)
+    with tempfile.TemporaryDirectory(prefix="whisper_chunks_") as tmp:
+        chunks = split_wav(input_wav, Path(tmp), max_chunk_seconds)
+        print(f"Run Whisper verbose_json on {len(chunks)} chunk(s)...")
+
+        async def transcribe_all():
+            return await asyncio.gather(*(_atranscribe_chunk(c["path"]) for c in chunks))
+
+        results = asyncio.run(transcribe_all())
+    data = stitch_segments(chunks, results)
+
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    if plain_json is not None:
+        write_plain_transcript(data, plain_json)
+    return data
+
+def write_plain_transcript(whisper_json: dict, out_path: Path) -> dict:
+    """Plain transcript file derived from a verbose_json result."""
+    ensure_dir_exists(out_path.parent)
+    result = {"text": whisper_json.get("text", "")}
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return result